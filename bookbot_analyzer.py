@@ -0,0 +1,368 @@
+import codecs
+import heapq
+import re
+from array import array
+from collections import Counter
+from operator import itemgetter
+
+from bookbot_compressed import open_book
+from bookbot_encoding import ascii_compatible, detect_file, detect_stream
+from bookbot_lazy import lazy_import
+from bookbot_profile import timed
+
+numpy = lazy_import("numpy")  # optional, only speeds up the histogram
+
+CHUNK_SIZE = 1 << 20  # 1 MiB of raw bytes per read
+BACKENDS = ("auto", "python", "bytes", "counter", "numpy")
+
+
+def _latin1_tables():
+    """Translate table folding Latin-1 letters to lowercase, plus the bytes to drop"""
+    fold = bytearray(range(256))
+    drop = bytearray()
+    for byte in range(256):
+        char = chr(byte).lower()
+        if char.isalpha():
+            fold[byte] = ord(char)
+        else:
+            drop.append(byte)
+    return bytes(fold), bytes(drop)
+
+
+_FOLD, _DROP = _latin1_tables()
+_ASCII_LETTERS = bytes(range(ord("a"), ord("z") + 1))
+_ASCII = bytes(range(0x80))
+
+# Words for frequency reports: letters and digits, with inner apostrophes
+_WORD = re.compile(r"[^\W_]+(?:'[^\W_]+)*")
+NGRAM_NAMES = ("word", "bigram", "trigram")
+
+
+def resolve_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown histogram backend: {backend}")
+    if backend == "auto":
+        return "numpy" if numpy is not None else "bytes"
+    if backend == "numpy" and numpy is None:
+        raise ValueError("The numpy histogram backend needs NumPy installed")
+    return backend
+
+
+def byte_histogram(letters, backend):
+    """Count each byte value of already folded letters as {byte: count}"""
+    if backend == "numpy":
+        counts = numpy.bincount(numpy.frombuffer(letters, dtype=numpy.uint8), minlength=256)
+        return {int(byte): int(counts[byte]) for byte in numpy.flatnonzero(counts)}
+    if backend == "counter":
+        return Counter(letters)
+    counts = {}
+    for byte in _ASCII_LETTERS:
+        count = letters.count(byte.to_bytes(1, "big"))
+        if count:
+            counts[byte] = count
+    if not letters.isascii():
+        # Accented letters are rare enough to count one by one
+        counts.update(Counter(letters.translate(None, _ASCII_LETTERS)))
+    return counts
+
+
+def count_letter_bytes(raw, backend="auto", chars=None):
+    """count_chars() for Latin-1 bytes: fold, drop non-letters, count in one go.
+
+    Counts are added to chars, which keeps letters in first-seen order.
+    """
+    backend = resolve_backend(backend)
+    chars = {} if chars is None else chars
+    letters = raw.translate(_FOLD, _DROP)
+    counts = byte_histogram(letters, backend)
+    new = [byte for byte in counts if chr(byte) not in chars]
+    new.sort(key=lambda byte: letters.find(byte.to_bytes(1, "big")))
+    for byte in new:
+        chars[chr(byte)] = 0
+    for byte, count in counts.items():
+        chars[chr(byte)] += count
+    return chars
+
+
+def count_words_in(text, in_word=False):
+    """(words in a chunk of text, whether it ends inside a word).
+
+    in_word says the previous chunk ended inside a word; a word it continues
+    was counted there already.
+    """
+    if not text:
+        return 0, in_word
+    words = len(text.split())
+    if in_word and words and not text[0].isspace():
+        words -= 1
+    return words, not text[-1].isspace()
+
+
+class FrequencyTable:
+    """Counts of words or n-grams, exact or bounded by capacity.
+
+    With a capacity the table is a space-saving summary: once it holds more
+    than twice capacity entries, only the capacity most frequent are kept and
+    floor records the largest count dropped. An entry that comes back starts
+    from floor, so every count is an overestimate by at most floor, and any
+    item more frequent than floor is guaranteed to still be in the table.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.counts = Counter()
+        self.floor = 0
+
+    @property
+    def exact(self):
+        return self.floor == 0
+
+    def update(self, items):
+        if self.capacity is None or not self.floor:
+            self.counts.update(items)
+        else:
+            counts, floor = self.counts, self.floor
+            for item, count in Counter(items).items():
+                counts[item] = counts.get(item, floor) + count
+        self._prune()
+
+    def _prune(self):
+        if self.capacity is None or len(self.counts) <= 2 * self.capacity:
+            return
+        kept = heapq.nlargest(self.capacity + 1, self.counts.items(), key=itemgetter(1))
+        self.floor = max(self.floor, kept.pop()[1])
+        self.counts = Counter(dict(kept))
+
+    def merge(self, other):
+        if self.capacity is None and other.floor == 0:
+            self.counts.update(other.counts)
+            return self
+        counts = Counter()
+        for item in self.counts.keys() | other.counts.keys():
+            counts[item] = (self.counts.get(item, self.floor) +
+                            other.counts.get(item, other.floor))
+        self.counts = counts
+        self.floor += other.floor
+        self._prune()
+        return self
+
+    def top(self, k):
+        """The k most frequent (item, count) pairs, without sorting the rest"""
+        return heapq.nlargest(k, self.counts.items(), key=itemgetter(1))
+
+
+class BookStats:
+    """Word count and letter frequencies accumulated one chunk at a time.
+
+    With ngrams=N it also counts words, and up to N-word sequences, into
+    FrequencyTables in the same pass; capacity bounds their memory.
+    """
+
+    def __init__(self, backend="auto", ngrams=0, capacity=None):
+        self.words = 0
+        self.chars = {}
+        self.backend = resolve_backend(backend)
+        self.lines = None  # array('Q') of line start offsets, when requested
+        self.ngrams = [FrequencyTable(capacity) for _ in range(ngrams)]
+        self._in_word = False
+        self._tail = ""  # start of a word cut off by the end of the last chunk
+        self._context = []  # last words seen, to join n-grams across chunks
+        self._head = []  # first words seen, to join n-grams with a chunk merged before
+
+    def feed(self, text, raw=None):
+        """Add a chunk of text.
+
+        raw may hold the same chunk as Latin-1 compatible bytes (one byte per
+        character), which lets the vectorized backends skip the per-character
+        loop. Without it they still count the chunk's ASCII letters in one go
+        and only its other characters one by one.
+        """
+        if not text:
+            return
+        words, self._in_word = count_words_in(text, self._in_word)
+        self.words += words
+        if self.backend == "python":
+            self._count_letters(text)
+        elif raw is not None:
+            count_letter_bytes(raw, self.backend, self.chars)
+        else:
+            self._count_mixed(text)
+        if self.ngrams:
+            self._count_ngrams(text)
+
+    def _count_ngrams(self, text, final=False):
+        text = self._tail + text
+        end = len(text)
+        if not final:
+            while end and (text[end - 1].isalnum() or text[end - 1] == "'"):
+                end -= 1
+        self._tail = text[end:]
+        words = _WORD.findall(text[:end].lower())
+        if not words:
+            return
+        self.ngrams[0].update(words)
+        keep = len(self.ngrams) - 1
+        if len(self._head) < keep:
+            self._head = (self._head + words)[:keep]
+        context = self._context
+        for n, table in enumerate(self.ngrams[1:], 2):
+            seq = context[max(0, len(context) - n + 1):] + words
+            table.update(map(" ".join, zip(*(seq[i:] for i in range(n)))))
+        self._context = (context + words)[-(len(self.ngrams) - 1):] if len(self.ngrams) > 1 else []
+
+    def finish(self):
+        """Count the word left over at the end of the last chunk"""
+        if self.ngrams and self._tail:
+            self._count_ngrams("", final=True)
+
+    def _count_letters(self, text):
+        # Counter keeps first-seen order, so ties sort exactly like count_chars()
+        chars = self.chars
+        for char, count in Counter(text.lower()).items():
+            if char.isalpha():
+                chars[char] = chars.get(char, 0) + count
+
+    def _count_mixed(self, text):
+        # Dropping the ASCII bytes of UTF-8 leaves the other characters whole
+        rest = text.encode("utf-8", "surrogatepass").translate(None, _ASCII).decode(
+            "utf-8", "surrogatepass")
+        if "\u03a3" in rest:
+            # A capital sigma lowercases by its neighbours, which rest has lost
+            self._count_letters(text)
+            return
+        letters = text.encode("ascii", "ignore").translate(_FOLD, _DROP)
+        counts = {chr(byte): count for byte, count in byte_histogram(letters, self.backend).items()}
+        for char, count in Counter(rest.lower()).items():
+            if char.isalpha():
+                counts[char] = counts.get(char, 0) + count
+        chars = self.chars
+        new = [char for char in counts if char not in chars]
+        if new:
+            # Letters new to the book go in first-seen order, as in _count_letters()
+            new.sort(key=text.lower().find)
+            for char in new:
+                chars[char] = 0
+        for char, count in counts.items():
+            chars[char] += count
+
+    def merge(self, other, adjacent=True):
+        """Fold in the stats of a chunk that directly follows this one.
+
+        The n-grams that straddle the boundary are counted from the last
+        words of this chunk and the first words of the other. Pass
+        adjacent=False to add up unrelated texts, e.g. a corpus total.
+        """
+        self.words += other.words
+        for char, count in other.chars.items():
+            self.chars[char] = self.chars.get(char, 0) + count
+        if other.ngrams and not self.ngrams:
+            self.ngrams = [FrequencyTable(table.capacity) for table in other.ngrams]
+        for mine, theirs in zip(self.ngrams, other.ngrams):
+            mine.merge(theirs)
+        keep = len(self.ngrams) - 1
+        if adjacent and keep > 0:
+            for n, table in enumerate(self.ngrams[1:], 2):
+                # Neither side holds n words here, so every n-gram crosses the boundary
+                seq = self._context[max(0, len(self._context) - n + 1):] + other._head[:n - 1]
+                table.update(map(" ".join, zip(*(seq[i:] for i in range(n)))))
+            self._head = (self._head + other._head)[:keep]
+            self._context = (self._context + other._context)[-keep:]
+        return self
+
+
+def iter_chunks(f, chunk_size=CHUNK_SIZE, limit=None):
+    """Yield raw byte chunks from a binary file object, at most limit bytes"""
+    while limit is None or limit > 0:
+        data = f.read(chunk_size if limit is None else min(chunk_size, limit))
+        if not data:
+            return
+        if limit is not None:
+            limit -= len(data)
+        yield data
+
+
+def add_line_starts(data, pos, offsets):
+    """Append the offset of every line that starts inside data (read at pos)"""
+    find = data.find
+    i = find(b"\n")
+    while i != -1:
+        offsets.append(pos + i + 1)
+        i = find(b"\n", i + 1)
+
+
+def _track_lines(chunks, pos, offsets):
+    for data in chunks:
+        add_line_starts(data, pos, offsets)
+        pos += len(data)
+        yield data
+
+
+def iter_decoded(chunks, encoding):
+    """Decode an iterable of byte chunks into (text, raw) pairs.
+
+    The incremental decoder holds back multi-byte sequences that straddle
+    a chunk boundary until the rest of their bytes arrive. raw is the chunk's
+    bytes when they map one-to-one onto its characters (Latin-1, or pure
+    ASCII in an ASCII compatible encoding) and None otherwise.
+    """
+    name = codecs.lookup(encoding).name
+    latin1 = name == "iso8859-1"
+    plain_ascii = ascii_compatible(encoding)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for data in chunks:
+        clean = latin1 or (plain_ascii and not decoder.getstate()[0] and data.isascii())
+        text = decoder.decode(data)
+        if text:
+            yield text, data if clean else None
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail, None
+
+
+def iter_text(chunks, encoding):
+    """Decode an iterable of byte chunks into text chunks"""
+    for text, _ in iter_decoded(chunks, encoding):
+        yield text
+
+
+def analyze_file(path, encoding=None, chunk_size=CHUNK_SIZE, backend="auto", lines=False,
+                 ngrams=0, capacity=None):
+    """Count words and letters of a book in a single streaming pass.
+
+    With lines=True the same pass also records stats.lines, the byte offset
+    where each line starts. ngrams and capacity are passed to BookStats.
+    Without an encoding it is detected from samples of the file.
+    """
+    return analyze_range(path, 0, None, encoding, chunk_size, backend, lines, ngrams, capacity)
+
+
+@timed("count.range")
+def analyze_range(path, start, end, encoding=None, chunk_size=CHUNK_SIZE, backend="auto",
+                  lines=False, ngrams=0, capacity=None):
+    """Count words and letters in the byte range [start, end) of a book"""
+    stats = BookStats(backend, ngrams, capacity)
+    encoding = encoding or detect_file(path)
+    with open_book(path) as f:
+        f.seek(start)
+        limit = None if end is None else end - start
+        chunks = iter_chunks(f, chunk_size, limit)
+        if lines and ascii_compatible(encoding):
+            stats.lines = array("Q", [start])
+            chunks = _track_lines(chunks, start, stats.lines)
+        for text, raw in iter_decoded(chunks, encoding):
+            stats.feed(text, raw)
+    stats.finish()
+    return stats
+
+
+def analyze_stream(f, encoding=None, chunk_size=CHUNK_SIZE, backend="auto", ngrams=0,
+                   capacity=None):
+    """Count words and letters read from a binary file object, e.g. stdin"""
+    stats = BookStats(backend, ngrams, capacity)
+    chunks = iter_chunks(f, chunk_size)
+    if encoding is None:
+        encoding, chunks = detect_stream(chunks)
+    for text, raw in iter_decoded(chunks, encoding):
+        stats.feed(text, raw)
+    stats.finish()
+    return stats
@@ -0,0 +1,342 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not on Windows, peak RSS is then left out
+    resource = None
+
+from bookbot_analyzer import count_letter_bytes, numpy
+from bookbot_book import Book
+from bookbot_cache import AnalysisCache, default_cache_dir
+from bookbot_paginate import START, Paginator
+from main import count_chars, count_words, get_book
+
+WORDS = ("the of and to a in that was my I with had which but his as me not you for "
+         "it on by this be from her he at is were all so when have Victor Elizabeth").split()
+UNICODE_WORDS = WORDS + ("déjà naïve façade café résumé Ångström Über ÆON — “so” ‘it’ "
+                         "λόγος мир 书 المكتبة").split()
+VARIANTS = ("ascii", "unicode", "long-lines")
+BLOCK_SIZE = 1 << 20  # generated books are stitched together from such blocks
+BLOCKS = 16
+IN_MEMORY_LIMIT = 256 << 20  # largest book handed to the read-it-all benchmarks
+PAGE_TURNS = 200
+
+
+def synthetic_text(size, seed=84, variant="ascii"):
+    """Deterministic prose of about size characters.
+
+    "unicode" mixes in accented, Greek, Cyrillic, CJK and Arabic words and
+    typographic punctuation; "long-lines" keeps whole chapters on one line.
+    """
+    rng = random.Random(seed)
+    words = UNICODE_WORDS if variant == "unicode" else WORDS
+    end = " " if variant == "long-lines" else "\n"
+    parts = []
+    total = 0
+    while total < size:
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(4, 20)))
+        line = sentence.capitalize() + rng.choice([".", "!", "?", ","]) + end
+        parts.append(line)
+        total += len(line)
+    return "".join(parts)[:size]
+
+
+def write_book(path, size, variant="ascii", seed=84):
+    """Write a synthetic book of exactly size bytes (UTF-8), in bounded memory.
+
+    A few distinct blocks are generated up front and then picked in a seeded
+    random order, so multi-gigabyte books are as fast to make as to copy.
+    """
+    rng = random.Random(seed)
+    blocks = [synthetic_text(BLOCK_SIZE, seed + i, variant).encode("utf-8")
+              for i in range(min(BLOCKS, max(1, size // BLOCK_SIZE)))]
+    written = 0
+    with open(path, "wb") as f:
+        while written < size:
+            block = rng.choice(blocks)[:size - written]
+            # Never end the book in the middle of a character
+            block = block.decode("utf-8", "ignore").encode("utf-8")
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+    return path
+
+
+def corpus_book(directory, size, variant, seed=84):
+    """Path to a generated book, made on first use and reused afterwards"""
+    path = Path(directory) / f"{variant}-{size}-{seed}.txt"
+    # A book may come out a few bytes short so it ends on a whole character
+    if not path.exists() or not size - 4 <= path.stat().st_size <= size:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_book(path.with_suffix(".tmp"), size, variant, seed)
+        os.replace(path.with_suffix(".tmp"), path)
+    return path
+
+
+def parse_size(text):
+    """'1M', '512K', '2G' or a plain number of bytes"""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def best_time(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_histogram(text, repeat=5):
+    """Time count_chars() against each vectorized histogram backend"""
+    raw = text.encode("latin-1")
+    expected = count_chars(text)
+    baseline = best_time(lambda: count_chars(text), repeat)
+    results = {"count_chars": baseline}
+    backends = ["bytes", "counter"] + (["numpy"] if numpy is not None else [])
+    for backend in backends:
+        if count_letter_bytes(raw, backend) != expected:
+            raise AssertionError(f"{backend} backend disagrees with count_chars()")
+        results[backend] = best_time(lambda: count_letter_bytes(raw, backend), repeat)
+    return results
+
+
+def run_count_chars(path):
+    count_chars(get_book(path))
+
+
+def run_count_words(path):
+    count_words(path)
+
+
+def run_get_book(path):
+    get_book(path)
+
+
+def run_reader(path):
+    """Open a book in the terminal reader and turn PAGE_TURNS pages.
+
+    The reader gets an empty cache and state store of its own and no book
+    server, so runs are alike and the user's stores are left alone.
+    """
+    from bookbot_reader import BookReader
+    from bookbot_state import StateStore
+    with tempfile.TemporaryDirectory() as tmp:
+        reader = BookReader(AnalysisCache(Path(tmp) / "analysis.sqlite"),
+                            StateStore(Path(tmp) / "state.sqlite"), server=False)
+        try:
+            reader.load_book(str(path))
+            reader.get_current_page(24, 80)
+            for _ in range(PAGE_TURNS):
+                reader.next_page(24, 80)
+                reader.get_current_page(24, 80)
+        finally:
+            reader.close()
+
+
+def run_paginate(path):
+    """Wrap and page through the whole book at a typical GUI page size"""
+    with Book(str(path)) as book:
+        paginator = Paginator(book, 100, 40)
+        pos = START
+        while pos is not None:
+            pos = paginator.next_start(pos)
+
+
+def run_gui_viewport(path):
+    """Scroll a real Tk text viewport page by page; needs a display"""
+    import tkinter as tk
+    from bookbot_gui import TextViewport
+    root = tk.Tk()
+    try:
+        text = tk.Text(root, wrap=tk.NONE, width=100, height=40)
+        text.pack()
+        root.update()
+        with Book(str(path)) as book:
+            viewport = TextViewport(text, Paginator(book, 100, 40))
+            viewport.show(START)
+            for _ in range(PAGE_TURNS):
+                viewport.scroll_rows(40)
+                root.update_idletasks()
+                viewport.rebalance()
+    finally:
+        root.destroy()
+
+
+BENCHMARKS = {
+    "count_chars": (run_count_chars, True),
+    "get_book": (run_get_book, True),
+    "count_words": (run_count_words, False),
+    "reader": (run_reader, False),
+    "paginate": (run_paginate, False),
+    "gui_viewport": (run_gui_viewport, False),
+}
+
+
+def _measure(name, path, repeat):
+    """Run one benchmark in this (fresh) process: timings, RSS, allocations"""
+    func = BENCHMARKS[name][0]
+    try:
+        seconds = best_time(lambda: func(path), repeat)
+    except Exception as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+    result = {"seconds": seconds}
+    if resource is not None:
+        # Linux reports KiB, macOS bytes
+        scale = 1 if sys.platform == "darwin" else 1024
+        result["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    tracemalloc.start()
+    func(path)
+    result["alloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result
+
+
+def measure(name, path, repeat):
+    """_measure() in a child process, so peak RSS belongs to this benchmark alone"""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(_measure, (name, str(path), repeat))
+
+
+def environment():
+    try:
+        version = subprocess.run(["git", "describe", "--always", "--dirty"],
+                                 capture_output=True, text=True,
+                                 cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        version = ""
+    return {
+        "version": version or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": numpy.__version__ if numpy is not None else None,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run_suite(books, names, repeat, in_memory_limit=IN_MEMORY_LIMIT, log=print):
+    """Measure every benchmark on every (variant, path) in books"""
+    results = []
+    for variant, path in books:
+        size = os.path.getsize(path)
+        for name in names:
+            entry = {"benchmark": name, "variant": variant, "bytes": size}
+            if BENCHMARKS[name][1] and size > in_memory_limit:
+                entry["skipped"] = "larger than the in-memory limit"
+            else:
+                entry.update(measure(name, path, repeat))
+            if "seconds" in entry:
+                entry["mb_per_s"] = size / entry["seconds"] / 1e6 if entry["seconds"] else None
+            results.append(entry)
+            log(format_result(entry))
+    return results
+
+
+def format_result(entry):
+    label = f"{entry['benchmark']:>12} {entry['variant']:>10} {entry['bytes'] / 1e6:9.1f} MB"
+    if "skipped" in entry:
+        return f"{label}  skipped ({entry['skipped']})"
+    line = f"{label}  {entry['seconds'] * 1000:10.2f} ms  {entry['mb_per_s']:8.1f} MB/s"
+    if "peak_rss_bytes" in entry:
+        line += f"  rss {entry['peak_rss_bytes'] / 1e6:7.1f} MB"
+    return line + f"  alloc {entry['alloc_peak_bytes'] / 1e6:7.1f} MB"
+
+
+def compare(results, baseline, tolerance):
+    """Benchmarks at least tolerance (a fraction) slower than in baseline"""
+    old = {(e["benchmark"], e["variant"], e["bytes"]): e for e in baseline["results"]}
+    regressions = []
+    for entry in results:
+        before = old.get((entry["benchmark"], entry["variant"], entry["bytes"]))
+        if before and "seconds" in entry and "seconds" in before:
+            ratio = entry["seconds"] / before["seconds"]
+            if ratio > 1 + tolerance:
+                regressions.append((entry, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark BookBot hot paths")
+    parser.add_argument("--book", action="append",
+                        help="book to use instead of synthetic ones (repeatable)")
+    parser.add_argument("--sizes", default="1M",
+                        help="comma separated synthetic book sizes, e.g. 1M,64M,2G (default: 1M)")
+    parser.add_argument("--variants", default=",".join(VARIANTS),
+                        help=f"comma separated synthetic variants out of {', '.join(VARIANTS)}")
+    parser.add_argument("--bench", default=",".join(BENCHMARKS),
+                        help="comma separated benchmarks to run (default: all)")
+    parser.add_argument("--corpus-dir", default=None,
+                        help="where generated books are kept (default: bench/ in the cache dir)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--in-memory-limit", type=parse_size, default=IN_MEMORY_LIMIT,
+                        help="skip whole-file benchmarks on books above this size (default: 256M)")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="slowdown that counts as a regression (default: 0.10)")
+    parser.add_argument("--histogram", action="store_true",
+                        help="only compare count_chars() with the histogram backends")
+    args = parser.parse_args()
+
+    if args.histogram:
+        if args.book:
+            with open(args.book[0], encoding="latin-1") as f:
+                text = f.read()
+        else:
+            text = synthetic_text(parse_size(args.sizes.split(",")[0]))
+        results = bench_histogram(text, args.repeat)
+        baseline = results["count_chars"]
+        print(f"Letter histogram over {len(text)} characters")
+        for name, seconds in results.items():
+            print(f"{name:>12}: {seconds * 1000:8.2f} ms  {baseline / seconds:6.1f}x")
+        return
+
+    names = [name.strip() for name in args.bench.split(",") if name.strip()]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise SystemExit(f"Unknown benchmark: {', '.join(unknown)}")
+    if args.book:
+        books = [(Path(book).name, Path(book)) for book in args.book]
+    else:
+        corpus_dir = Path(args.corpus_dir) if args.corpus_dir else default_cache_dir() / "bench"
+        books = []
+        for variant in args.variants.split(","):
+            if variant not in VARIANTS:
+                raise SystemExit(f"Unknown variant: {variant}")
+            for size in args.sizes.split(","):
+                books.append((variant, corpus_book(corpus_dir, parse_size(size), variant)))
+
+    report = environment()
+    report["repeat"] = args.repeat
+    report["results"] = run_suite(books, names, args.repeat, args.in_memory_limit)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report["results"], json.load(f), args.tolerance)
+        for entry, ratio in regressions:
+            print(f"Regression: {entry['benchmark']} on {entry['variant']} "
+                  f"({entry['bytes']} bytes) is {ratio:.2f}x slower")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import codecs
+import mmap
+import os
+import queue
+import threading
+from array import array
+
+from bookbot_analyzer import add_line_starts, analyze_file
+from bookbot_cache import AnalysisCache
+from bookbot_client import POLL_INTERVAL, RemoteBook
+from bookbot_compressed import CompressedBuffer, compression
+from bookbot_encoding import Sampler, ascii_compatible, detect_file, one_to_one
+from bookbot_profile import timed
+
+INDEX_CHUNK = 1 << 20  # bytes scanned for newlines per step
+
+
+class Book:
+    """A book file mapped into memory and decoded only where it is displayed.
+
+    Offsets are byte offsets into the file (into its decompressed text for
+    .gz and .zst books, see CompressedBuffer). Line start offsets are kept in an
+    array('Q') that is extended lazily, only as far as the reader has gone,
+    so opening a book and showing its first page costs the same for any size.
+    Without an encoding it is detected from samples of the file (of a
+    compressed book, taken during CompressedBuffer's index pass); the line
+    index needs one that keeps ASCII newlines as single bytes.
+    """
+
+    @timed("load.open")
+    def __init__(self, path, encoding=None, line_starts=None):
+        self.path = path
+        buf = None
+        if not encoding and compression(path):
+            sampler = Sampler()
+            buf = CompressedBuffer(path, sampler.feed)
+            encoding = sampler.guess()
+        self.encoding = encoding = encoding or detect_file(path)
+        if not ascii_compatible(encoding):
+            if buf is not None:
+                buf.close()
+            raise ValueError(f"Cannot page through {encoding} text")
+        self._utf8 = codecs.lookup(encoding).name.startswith("utf-8")
+        self._one_to_one = one_to_one(encoding)
+        if compression(path):
+            # Decompressed block by block, near what is being read
+            self._file = None
+            self._buf = buf or CompressedBuffer(path)
+            self.size = len(self._buf)
+        else:
+            self._file = open(path, 'rb')
+            self.size = os.fstat(self._file.fileno()).st_size
+            # mmap refuses empty files
+            if self.size:
+                self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buf = b""
+        # utf-8-sig decodes a BOM to no text at all, which offset() has to skip
+        bom = codecs.lookup(encoding).name == "utf-8-sig" and self._buf[:3] == codecs.BOM_UTF8
+        self._bom = len(codecs.BOM_UTF8) if bom else 0
+        if line_starts is not None:
+            # A complete index, e.g. from the analysis cache
+            self.line_starts = line_starts
+            self._scanned = self.size
+        else:
+            self.line_starts = array('Q', [0])
+            self._scanned = 0
+        # The index may be extended by a loader thread and the UI at once
+        self._index_lock = threading.Lock()
+
+    @property
+    def indexed(self):
+        return self._scanned >= self.size
+
+    @property
+    def progress(self):
+        """Fraction of the book covered by the line index"""
+        return self._scanned / self.size if self.size else 1.0
+
+    @timed("load.index_step")
+    def index_step(self):
+        """Scan the next INDEX_CHUNK bytes for line starts"""
+        with self._index_lock:
+            if self._scanned < self.size:
+                end = min(self._scanned + INDEX_CHUNK, self.size)
+                add_line_starts(self._buf[self._scanned:end], self._scanned, self.line_starts)
+                self._scanned = end
+
+    def index_until(self, line=None):
+        """Extend the line index until it covers line (or the whole book)"""
+        while self._scanned < self.size and (line is None or len(self.line_starts) <= line):
+            self.index_step()
+
+    def line_count(self):
+        self.index_until()
+        return len(self.line_starts)
+
+    def read(self, start, end):
+        """Decode the bytes in [start, end)"""
+        return str(self._buf[start:end], self.encoding, 'replace')
+
+    def char_boundary(self, offset):
+        """Move offset back to the start of the UTF-8 sequence it falls into"""
+        if self._utf8:
+            while 0 < offset < self.size and 0x80 <= self._buf[offset] < 0xC0:
+                offset -= 1
+        return offset
+
+    def line_span(self, line):
+        """(start, end) byte offsets of a line without its line break"""
+        self.index_until(line + 1)
+        starts = self.line_starts
+        start = starts[line]
+        end = starts[line + 1] - 1 if line + 1 < len(starts) else self.size
+        if end > start and self._buf[end - 1] == 0x0D:  # CRLF
+            end -= 1
+        return start, end
+
+    def line(self, line):
+        """Decoded text of a line, without its line break"""
+        return self.read(*self.line_span(line))
+
+    def lines(self, first, count):
+        """Decode up to count lines starting at line number first"""
+        self.index_until(first + count)
+        last = min(first + count, len(self.line_starts))
+        return [self.line(line) for line in range(first, last)]
+
+    def line_at(self, offset):
+        """Number of the line containing byte offset"""
+        starts = self.line_starts
+        while not self.indexed and starts[-1] <= offset:
+            self.index_until(len(starts))
+        lo, hi = 0, len(starts)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if starts[mid] <= offset:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    def position(self, offset):
+        """(line, column) of byte offset, as used by the paginator"""
+        offset = min(offset, self.size)
+        line = self.line_at(offset)
+        start = self.line_starts[line]
+        if self._one_to_one or self._buf[start:offset].isascii():
+            return line, offset - start
+        return line, len(self.read(start, offset))
+
+    def offset(self, position):
+        """Byte offset of a (line, column) position, the inverse of position()"""
+        line, col = position
+        self.index_until(line + 1)
+        start, end = self.line_span(min(line, len(self.line_starts) - 1))
+        if self._one_to_one or self._buf[start:end].isascii():
+            return min(start + col, end)
+        prefix = self.read(start, end)[:col]
+        skip = self._bom if start == 0 else 0
+        return start + skip + len(prefix.encode("utf-8" if self._utf8 else self.encoding, "replace"))
+
+    def close(self):
+        if not isinstance(self._buf, bytes):
+            self._buf.close()
+        if self._file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_cached(cache, path, encoding=None):
+    """(Book, its cached BookStats or None), opened with what cache knows of it.
+
+    An encoding cache has not seen yet is left to Book to detect (during
+    the index pass, for a compressed book) and then stored in cache.
+    """
+    encoding = encoding or cache.encoding(path, detect=False)
+    cached = cache.get(path, lines=True, encoding=encoding) if encoding else None
+    book = Book(path, encoding, line_starts=cached.lines if cached else None)
+    if not encoding:
+        cache.set_encoding(path, book.encoding)
+    return book, cached
+
+
+class BookLoader(threading.Thread):
+    """Opens a book on a worker thread and reports back through a queue.
+
+    Events are (loader, kind, value) tuples:
+      ('opened', Book)      - the first pages can be shown right away
+      ('progress', float)   - fraction of the line index built so far
+      ('stats', BookStats)  - word and letter counts, when analyze=True
+      ('done', None)        - the whole book is indexed
+      ('error', Exception)
+    The UI thread drains the queue from its own event loop. With a client
+    (see bookbot_client) the book is opened by the book server, which does
+    the indexing and analysis once for all its readers, and the loader only
+    relays its progress. If that fails, the error is a ConnectionError or
+    a bookbot_client.ServerError, and the UI can load the book without it.
+    """
+
+    def __init__(self, path, encoding=None, events=None, analyze=False, client=None):
+        super().__init__(daemon=True)
+        self.path = path
+        self.encoding = encoding
+        self.events = events if events is not None else queue.Queue()
+        self.analyze = analyze
+        self.client = client
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _emit(self, kind, value=None):
+        self.events.put((self, kind, value))
+
+    def _run_remote(self):
+        book = RemoteBook(self.client, self.path)
+        self._emit('opened', book)
+        while not book.indexed:
+            if self._cancelled.wait(POLL_INTERVAL):
+                return
+            book.refresh()
+            self._emit('progress', book.progress)
+        if self.analyze:
+            self._emit('stats', self.client.stats(self.path))
+        self._emit('done')
+
+    @timed("load.background")
+    def run(self):
+        try:
+            if self.client:
+                self._run_remote()
+            else:
+                self._run_local()
+        except Exception as e:
+            self._emit('error', e)
+
+    def _run_local(self):
+        # sqlite connections belong to the thread that opened them
+        cache = AnalysisCache()
+        try:
+            book, cached = open_cached(cache, self.path, self.encoding)
+            encoding = book.encoding
+            self._emit('opened', book)
+            while not book.indexed:
+                if self._cancelled.is_set():
+                    return
+                book.index_step()
+                self._emit('progress', book.progress)
+            if self.analyze:
+                stats = cached
+                if stats is None:
+                    stats = analyze_file(self.path, encoding)
+                    stats.lines = book.line_starts
+                    cache.put(self.path, stats, encoding)
+                self._emit('stats', stats)
+        finally:
+            cache.close()
+        self._emit('done')
@@ -0,0 +1,204 @@
+import codecs
+import json
+import os
+import sqlite3
+import time
+from array import array
+from pathlib import Path
+
+from bookbot_analyzer import BookStats, analyze_file
+from bookbot_encoding import detect_file
+from bookbot_lazy import lazy_import
+from bookbot_profile import timed
+
+hashlib = lazy_import("hashlib")  # only for key_mode="content"
+
+MAX_BYTES = 256 << 20  # default size cap for cached results
+TOUCH_BATCH = 256  # hits whose last_used times are written together
+
+
+def default_cache_dir():
+    base = os.environ.get("BOOKBOT_CACHE_DIR")
+    if base:
+        return Path(base)
+    xdg = os.environ.get("XDG_CACHE_HOME")
+    return (Path(xdg) if xdg else Path.home() / ".cache") / "bookbot"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """On-disk LRU cache of word counts, letter histograms and line indexes.
+
+    Entries are keyed by (path, size, mtime) by default, or by a hash of the
+    file contents with key_mode="content" so identical copies share an entry,
+    plus the encoding the book was decoded with (its detected one unless
+    given). A file that changes gets a new key, and its stale entry is
+    dropped. The detected encoding of each book is kept alongside, until its
+    file changes or its entries are evicted.
+
+    Hits only note the time; last_used is written for TOUCH_BATCH of them at
+    once, with the next put(), or on flush() and close().
+    """
+
+    def __init__(self, path=None, max_bytes=MAX_BYTES, key_mode="stat"):
+        if key_mode not in ("stat", "content"):
+            raise ValueError(f"Unknown cache key mode: {key_mode}")
+        self.path = Path(path) if path else default_cache_dir() / "analysis.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.key_mode = key_mode
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                words INTEGER NOT NULL,
+                chars TEXT NOT NULL,
+                lines BLOB,
+                bytes INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_path ON entries (path);
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            CREATE TABLE IF NOT EXISTS encodings (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                encoding TEXT NOT NULL
+            );
+        """)
+        self._touched = {}  # key -> time of a hit, not yet written
+
+    def _key(self, path, encoding):
+        """(version of the file, key of its entry when decoded as encoding)"""
+        if self.key_mode == "content":
+            version = "blake2b:" + file_digest(path)
+        else:
+            st = os.stat(path)
+            version = f"stat:{st.st_size}:{st.st_mtime_ns}:{path}"
+        return version, f"{version}:{codecs.lookup(encoding or self.encoding(path)).name}"
+
+    @timed("cache.get")
+    def get(self, book, lines=False, encoding=None):
+        """Cached BookStats for book decoded as encoding, or None on a miss.
+
+        Without an encoding, the one detected for the book is used, if any:
+        a book never detected was never analyzed either.
+        """
+        path = os.path.realpath(book)
+        encoding = encoding or self.encoding(path, detect=False)
+        if encoding is None:
+            return None
+        _, key = self._key(path, encoding)
+        row = self.db.execute(
+            "SELECT words, chars, lines FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or (lines and row[2] is None):
+            return None
+        self._touched[key] = time.time()
+        if len(self._touched) >= TOUCH_BATCH:
+            self.flush()
+        stats = BookStats()
+        stats.words = row[0]
+        stats.chars = json.loads(row[1])
+        if row[2] is not None:
+            stats.lines = array("Q")
+            stats.lines.frombytes(row[2])
+        return stats
+
+    def put(self, book, stats, encoding=None):
+        path = os.path.realpath(book)
+        version, key = self._key(path, encoding)
+        chars = json.dumps(stats.chars, ensure_ascii=False)
+        lines = stats.lines.tobytes() if stats.lines is not None else None
+        size = len(chars) + (len(lines) if lines else 0)
+        with self.db:
+            self._write_touches()  # so eviction sees recent hits
+            # Whatever was cached under an older version of this file is stale now
+            self.db.execute("DELETE FROM entries WHERE path = ? AND substr(key, 1, ?) != ?",
+                            (path, len(version), version))
+            st = os.stat(path)
+            self.db.execute("DELETE FROM encodings WHERE path = ? AND (size != ? OR mtime_ns != ?)",
+                            (path, st.st_size, st.st_mtime_ns))
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, path, stats.words, chars, lines, size, time.time()))
+            self._evict()
+
+    def _write_touches(self):
+        self.db.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                            [(used, key) for key, used in self._touched.items()])
+        self._touched.clear()
+
+    def flush(self):
+        """Write the last_used times of the hits since the last write"""
+        if self._touched:
+            with self.db:
+                self._write_touches()
+
+    def _evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute(
+                "SELECT key, bytes FROM entries ORDER BY last_used").fetchall():
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        # A book with nothing cached no longer needs its encoding either
+        self.db.execute("DELETE FROM encodings WHERE path NOT IN (SELECT path FROM entries)")
+
+    def encoding(self, book, detect=True):
+        """Detected encoding of book, sampled only once per version of the file.
+
+        With detect false, None if it has not been detected yet.
+        """
+        path = os.path.realpath(book)
+        st = os.stat(path)
+        row = self.db.execute(
+            "SELECT encoding FROM encodings WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, st.st_size, st.st_mtime_ns)).fetchone()
+        if row:
+            return row[0]
+        if not detect:
+            return None
+        encoding = detect_file(path)
+        self.set_encoding(path, encoding)
+        return encoding
+
+    def set_encoding(self, book, encoding):
+        """Remember an encoding of book detected elsewhere, e.g. by Book"""
+        path = os.path.realpath(book)
+        st = os.stat(path)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO encodings VALUES (?, ?, ?, ?)",
+                            (path, st.st_size, st.st_mtime_ns, encoding))
+
+    def analyze(self, book, lines=False, **kwargs):
+        """Cached analyze_file(): only reads the book on a miss.
+
+        N-gram tables are not cached, so asking for them always reads the book.
+        """
+        kwargs["encoding"] = kwargs.get("encoding") or self.encoding(book)
+        stats = None if kwargs.get("ngrams") else self.get(book, lines, kwargs["encoding"])
+        if stats is None:
+            stats = analyze_file(book, lines=lines, **kwargs)
+            self.put(book, stats, kwargs["encoding"])
+        return stats
+
+    def clear(self):
+        self._touched.clear()
+        with self.db:
+            self.db.execute("DELETE FROM entries")
+            self.db.execute("DELETE FROM encodings")
+
+    def close(self):
+        self.flush()
+        self.db.close()
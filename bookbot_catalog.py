@@ -0,0 +1,266 @@
+import os
+import re
+import sqlite3
+import unicodedata
+from collections import namedtuple
+
+from bookbot_compressed import BOOK_SUFFIXES, open_book
+from bookbot_encoding import guess
+from bookbot_library import describe
+from bookbot_profile import timed
+
+HEADER_SIZE = 16 << 10  # bytes read from the start of each book for its metadata
+FIELDS = ("title", "author", "language")
+ARTICLES = ("the ", "a ", "an ")  # skipped when sorting by title
+
+CatalogEntry = namedtuple("CatalogEntry",
+                          ["id", "path", "name", "size", "title", "author", "language", "words"])
+
+_TITLE_LINE = re.compile(r"project gutenberg'?s? e-?book,? of (.+?)(?:,? by (.+))?$", re.IGNORECASE)
+_WORD = re.compile(r"\w+")
+_HIGHEST = chr(0x10FFFF)
+
+
+def fold(text):
+    """Lower-case text without accents, so "resume" finds "Résumé" """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def terms(text):
+    return _WORD.findall(fold(text))
+
+
+def _words(title, author):
+    return set(terms(title)) | set(terms(author or ""))
+
+
+def sort_key(title):
+    key = fold(title).strip()
+    for article in ARTICLES:
+        if key.startswith(article):
+            return key[len(article):]
+    return key
+
+
+def parse_header(text):
+    """Title, author and language from the header of a Project Gutenberg book"""
+    fields, key = {}, None
+    for line in text.splitlines():
+        if line.startswith(("*** START OF", "*END*")):
+            break
+        if key and line[:1] in (" ", "\t") and line.strip():
+            # Long titles go on over indented lines
+            fields[key] += " " + line.strip()
+            continue
+        key = None
+        name, sep, value = line.partition(":")
+        name = name.strip().lower()
+        if sep and name in FIELDS and name not in fields and value.strip():
+            key = name
+            fields[key] = value.strip()
+    if "title" not in fields:
+        # Older books only have "The Project Gutenberg EBook of <title>, by <author>"
+        for line in text.splitlines()[:5]:
+            match = _TITLE_LINE.search(line.strip())
+            if match:
+                fields["title"] = match.group(1)
+                if match.group(2):
+                    fields.setdefault("author", match.group(2))
+                break
+    return fields
+
+
+def read_header(path):
+    """parse_header() of the first HEADER_SIZE bytes of a book"""
+    with open_book(path) as f:
+        head = f.read(HEADER_SIZE)
+    return parse_header(head.decode(guess(head), "replace"))
+
+
+def book_name(name):
+    for suffix in BOOK_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def title_line(entry):
+    """Title and author of a catalog entry, for one row of a book list"""
+    return f"{entry.title} — {entry.author}" if entry.author else entry.title
+
+
+def info_line(entry):
+    return f"{entry.language}, {describe(entry)}" if entry.language else describe(entry)
+
+
+class Catalog:
+    """Titles, authors and languages of the books in a Library, for filtering.
+
+    Metadata comes from the Project Gutenberg header at the start of each
+    book, so only the first HEADER_SIZE bytes are read, and only for books
+    that are new or changed since the last sync(). It is kept in SQLite
+    next to the library's manifest: the books ordered by title, and every
+    word of each title and author in a table clustered by word, so a
+    prefix search is one index range scan however large the catalog is.
+    search() returns ids only; rows() looks up the few a menu shows.
+
+    Books added by hand (not in the library directory) go in TEMP tables
+    with negative ids, so they last for this connection only and other
+    sessions sharing the catalog never see them.
+    """
+
+    def __init__(self, library, path=None):
+        self.library = library
+        self.path = path or library.manifest.with_suffix(".sqlite")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        for temp, books, terms in (("", "books", "terms"), ("TEMP", "added", "added_terms")):
+            self.db.executescript(f"""
+                CREATE {temp} TABLE IF NOT EXISTS {books} (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    author TEXT,
+                    language TEXT,
+                    sort_key TEXT NOT NULL,
+                    listed INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS {books}_sort ON {books} (sort_key, id);
+                CREATE {temp} TABLE IF NOT EXISTS {terms} (
+                    term TEXT NOT NULL,
+                    book INTEGER NOT NULL,
+                    PRIMARY KEY (term, book)
+                ) WITHOUT ROWID;
+            """)
+        # Earlier versions kept books added by hand in the shared tables
+        with self.db:
+            self._delete("listed = 0")
+        self._synced = False
+
+    @staticmethod
+    def _tables(listed):
+        return ("books", "terms") if listed else ("added", "added_terms")
+
+    def _delete(self, where, params=()):
+        for book_id, title, author in self.db.execute(
+                f"SELECT id, title, author FROM books WHERE {where}", params).fetchall():
+            self._forget("terms", book_id, title, author)
+            self.db.execute("DELETE FROM books WHERE id = ?", (book_id,))
+
+    def _forget(self, table, book_id, title, author):
+        # Terms are clustered by word, so a book's rows are found from its words
+        self.db.executemany(f"DELETE FROM {table} WHERE term = ? AND book = ?",
+                            [(word, book_id) for word in _words(title, author)])
+
+    def _put(self, path, size, mtime_ns, listed):
+        try:
+            fields = read_header(path)
+        except Exception:
+            # Unreadable or corrupt (zlib and zstd errors are neither OSError nor
+            # ValueError); the book is still listed, under its file name
+            fields = {}
+        title = fields.get("title") or book_name(os.path.basename(path))
+        author = fields.get("author")
+        books, terms = self._tables(listed)
+        row = self.db.execute(f"SELECT id, title, author FROM {books} WHERE path = ?",
+                              (path,)).fetchone()
+        if row:
+            self._forget(terms, *row)
+            book_id = row[0]
+        elif listed:
+            book_id = None
+        else:
+            book_id = self.db.execute("SELECT COALESCE(MIN(id), 0) - 1 FROM added").fetchone()[0]
+        cursor = self.db.execute(
+            f"INSERT OR REPLACE INTO {books} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (book_id, path, size, mtime_ns, title, author,
+             fields.get("language"), sort_key(title), listed))
+        book_id = cursor.lastrowid
+        self.db.executemany(f"INSERT INTO {terms} VALUES (?, ?)",
+                            [(word, book_id) for word in _words(title, author)])
+        return book_id
+
+    @timed("catalog.sync")
+    def sync(self, entries):
+        """Match the catalog to a listing of LibraryEntry; returns the headers read"""
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self.db.execute(
+            "SELECT path, size, mtime_ns FROM books WHERE listed = 1")}
+        read = 0
+        with self.db:
+            for entry in entries:
+                if known.pop(entry.path, None) != (entry.size, entry.mtime_ns):
+                    self._put(entry.path, entry.size, entry.mtime_ns, 1)
+                    read += 1
+            for path in known:
+                self._delete("path = ?", (path,))
+        self._synced = True
+        return read
+
+    def refresh(self, force=False):
+        """Refresh the library and catalog any changes; True if the books changed"""
+        changed = self.library.refresh(force)
+        if changed or not self._synced:
+            changed = self.sync(self.library.entries) > 0 or changed
+        return changed
+
+    def add(self, path):
+        """Catalog a book from outside the library directory, for this session"""
+        path = str(path)
+        row = self.db.execute("SELECT id FROM books WHERE path = ? UNION ALL "
+                              "SELECT id FROM added WHERE path = ?", (path, path)).fetchone()
+        if row:
+            return row[0]
+        st = os.stat(path)
+        with self.db:
+            return self._put(path, st.st_size, st.st_mtime_ns, 0)
+
+    @timed("catalog.search")
+    def search(self, text=""):
+        """Ids of the books with a title or author word starting with each word of text.
+
+        The ids come in title order.
+        """
+        words = terms(text)
+        params = [bound for word in words for bound in (word, word + _HIGHEST)]
+        parts = []
+        for listed in (1, 0):
+            books, table = self._tables(listed)
+            sql = f"SELECT id, sort_key FROM {books}"
+            if words:
+                sql += " WHERE " + " AND ".join(
+                    [f"id IN (SELECT book FROM {table} WHERE term >= ? AND term < ?)"] * len(words))
+            parts.append(sql)
+        # Both halves come in index order, so sqlite merges them instead of sorting
+        sql = " UNION ALL ".join(parts) + " ORDER BY sort_key, id"
+        return [row[0] for row in self.db.execute(sql, params * 2)]
+
+    def rows(self, ids):
+        """CatalogEntry for each of ids (a screenful, say), in the same order"""
+        if not ids:
+            return []
+        found = {}
+        where = f"WHERE id IN ({','.join('?' * len(ids))})"
+        for row in self.db.execute(
+                f"SELECT id, path, size, title, author, language FROM books {where} UNION ALL "
+                f"SELECT id, path, size, title, author, language FROM added {where}",
+                list(ids) * 2):
+            book_id, path = row[:2]
+            listed = self.library.get(path)
+            found[book_id] = CatalogEntry(book_id, path, os.path.basename(path), *row[2:],
+                                          listed.words if listed else None)
+        return [found[book_id] for book_id in ids if book_id in found]
+
+    def paths(self):
+        return [row[0] for row in self.db.execute(
+            "SELECT path, sort_key, id FROM books UNION ALL "
+            "SELECT path, sort_key, id FROM added ORDER BY sort_key, id")]
+
+    def __len__(self):
+        return self.db.execute(
+            "SELECT (SELECT COUNT(*) FROM books) + (SELECT COUNT(*) FROM added)").fetchone()[0]
+
+    def close(self):
+        self.db.close()
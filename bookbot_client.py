@@ -0,0 +1,276 @@
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from bookbot_analyzer import BookStats
+from bookbot_lazy import lazy_import
+from bookbot_profile import timed
+from bookbot_state import default_state_dir
+
+bookbot_search = lazy_import("bookbot_search")
+
+SOCKET_NAME = "server.sock"
+LINE_BLOCK = 256  # lines a RemoteBook asks for at once
+CACHED_BLOCKS = 64
+TIMEOUT = 30  # seconds to wait for the reply to a page request
+POLL_INTERVAL = 0.1  # seconds between progress checks while the server indexes
+
+
+class ServerError(Exception):
+    pass
+
+
+def default_socket_path():
+    path = os.environ.get("BOOKBOT_SOCKET")
+    if path:
+        return Path(path)
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return Path(runtime) / "bookbot" / SOCKET_NAME
+    return default_state_dir() / SOCKET_NAME
+
+
+class _Connection:
+    """One socket to a BookServer; requests on it are sent one at a time.
+
+    That is also what the server expects: it reads a connection's next
+    request only after the last reply was sent. Any failure (a timeout, a
+    lost socket, a reply to some other request) closes the connection for
+    good, since the rest of the stream can no longer be trusted.
+    """
+
+    def __init__(self, path, timeout):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+        self._replies = self.sock.makefile("rb")
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.lost = False
+
+    def call(self, op, args):
+        with self._lock:
+            if self.lost:
+                raise ConnectionError("The connection to the book server was lost")
+            self._next_id += 1
+            request = dict(args, id=self._next_id, op=op)
+            try:
+                self.sock.sendall(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+                line = self._replies.readline()
+                if not line:
+                    raise ConnectionError("The book server closed the connection")
+                reply = json.loads(line)
+                if reply.get("id") != request["id"]:
+                    raise ConnectionError("The book server answered another request")
+            except (OSError, ValueError) as e:
+                self.close()
+                if isinstance(e, ConnectionError):
+                    raise
+                raise ConnectionError(f"Lost the book server: {e}") from e
+        if "error" in reply:
+            raise ServerError(reply["error"])
+        return reply["result"]
+
+    def close(self):
+        self.lost = True
+        try:
+            # Wakes up a thread still waiting for a reply
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._replies.close()
+        self.sock.close()
+
+
+class Client:
+    """A reader's connections to a BookServer, shared by its threads.
+
+    Page requests (open, lines, read, ...) share one connection and give
+    up after timeout seconds. Stats and search can take as long as reading
+    a whole book or library, so each gets a connection of its own for as
+    long as it runs, and waits without a timeout: they never hold up
+    paging. Every failure to talk to the server is a ConnectionError, after
+    which lost is true and the caller is expected to go on without it.
+    """
+
+    def __init__(self, path=None, timeout=TIMEOUT):
+        self.path = str(path or default_socket_path())
+        self._pages = _Connection(self.path, timeout)
+        self._lock = threading.Lock()
+        self._running = set()  # connections of stats and search calls under way
+
+    @property
+    def lost(self):
+        return self._pages.lost
+
+    @timed("client.call")
+    def call(self, op, **args):
+        return self._pages.call(op, args)
+
+    def _call_alone(self, op, **args):
+        """call() on a connection of its own that waits as long as the server works"""
+        try:
+            connection = _Connection(self.path, None)
+        except OSError as e:
+            raise ConnectionError(f"Cannot reach the book server: {e}") from e
+        with self._lock:
+            self._running.add(connection)
+        try:
+            return connection.call(op, args)
+        finally:
+            with self._lock:
+                self._running.discard(connection)
+            connection.close()
+
+    def stats(self, path):
+        """BookStats (words and letters) of a book, analyzed once by the server"""
+        result = self._call_alone("stats", path=os.path.abspath(path))
+        stats = BookStats()
+        stats.words = result["words"]
+        stats.chars = result["chars"]
+        return stats
+
+    def search(self, query, books, limit=1000):
+        """Like SearchIndex.update() then search(), on the server's index"""
+        books = [os.path.abspath(book) for book in books]
+        hits = self._call_alone("search", query=query, books=books, limit=limit)
+        return [bookbot_search.Hit(*hit) for hit in hits]
+
+    def close(self):
+        self._pages.close()
+        with self._lock:
+            running = list(self._running)
+        for connection in running:
+            connection.close()
+
+
+def connect(path=None):
+    """Client for the book server at path (or the default socket), None if none is running"""
+    path = path or default_socket_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        return Client(path)
+    except OSError:
+        return None
+
+
+class _LineStarts:
+    """Book.line_starts of a RemoteBook: fetched a block at a time"""
+
+    def __init__(self, book):
+        self.book = book
+
+    def __len__(self):
+        return self.book._lines
+
+    def __getitem__(self, line):
+        if line < 0:
+            line += len(self)
+        if not 0 <= line < len(self):
+            raise IndexError("line index out of range")
+        starts, _ = self.book._block(line // LINE_BLOCK)
+        return starts[line % LINE_BLOCK]
+
+
+class RemoteBook:
+    """A book opened by a BookServer, with the parts of Book the readers use.
+
+    The server holds the file, its line index and the decoding; this side
+    keeps the last CACHED_BLOCKS blocks of LINE_BLOCK lines it was sent
+    (their text and start offsets), so paging through a book costs a
+    round trip every LINE_BLOCK lines.
+    """
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self._path = os.path.abspath(path)
+        info = client.call("open", path=self._path)
+        self.encoding = info["encoding"]
+        self.size = info["size"]
+        self._update(info)
+        self._blocks = OrderedDict()  # block number -> (starts, text)
+        self.line_starts = _LineStarts(self)
+
+    def _update(self, status):
+        self._lines = status["lines"]
+        self.indexed = status["indexed"]
+        self.progress = status["progress"]
+
+    def refresh(self):
+        """Catch up with the server's indexing progress"""
+        if not self.indexed:
+            self._update(self.client.call("status", path=self._path))
+
+    def _block(self, number):
+        block = self._blocks.get(number)
+        if block is not None:
+            self._blocks.move_to_end(number)
+            return block
+        reply = self.client.call("lines", path=self._path, first=number * LINE_BLOCK,
+                                 count=LINE_BLOCK)
+        self._update(reply)
+        block = (reply["starts"], reply["text"])
+        if len(block[0]) == LINE_BLOCK or self.indexed:
+            # A short block away from the end of the book would grow later
+            self._blocks[number] = block
+            if len(self._blocks) > CACHED_BLOCKS:
+                self._blocks.popitem(last=False)
+        return block
+
+    def index_until(self, line=None):
+        if self.indexed or (line is not None and line < self._lines):
+            return
+        if line is None:
+            while not self.indexed:
+                time.sleep(POLL_INTERVAL)
+                self.refresh()
+        else:
+            self._block(line // LINE_BLOCK)
+
+    def line_count(self):
+        self.index_until()
+        return self._lines
+
+    def line(self, line):
+        _, text = self._block(line // LINE_BLOCK)
+        return text[line % LINE_BLOCK]
+
+    def lines(self, first, count):
+        self.index_until(first + count)
+        last = min(first + count, self._lines)
+        return [self.line(line) for line in range(first, last)]
+
+    def read(self, start, end):
+        return self.client.call("read", path=self._path, start=start, end=end)
+
+    def line_at(self, offset):
+        return self.client.call("line_at", path=self._path, offset=offset)
+
+    def position(self, offset):
+        return tuple(self.client.call("position", path=self._path, offset=offset))
+
+    def offset(self, position):
+        return self.client.call("offset", path=self._path, position=list(position))
+
+    def close(self):
+        try:
+            self.client.call("close", path=self._path)
+        except (OSError, ServerError):
+            pass
+        self._blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
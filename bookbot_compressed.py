@@ -0,0 +1,299 @@
+import bisect
+import gzip
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from itertools import chain
+
+from bookbot_lazy import lazy_import
+
+zstandard = lazy_import("zstandard")  # optional, only for .zst books
+
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd"}
+BOOK_SUFFIXES = (".txt", ".txt.gz", ".txt.zst")
+CHECKPOINT = 1 << 20  # decompressed bytes between random access checkpoints
+READ_SIZE = 64 << 10
+CACHED_BLOCKS = 4
+CACHED_BUFFERS = 4
+ZSTD_MAGIC = 0xFD2FB528
+ZSTD_SKIPPABLE = 0x184D2A50  # low four bits vary
+
+_buffers = OrderedDict()  # (path, size, mtime_ns) -> CompressedBuffer, for read_range()
+_buffers_lock = threading.Lock()
+
+
+def compression(path):
+    """Compression of a book ("gzip" or "zstd") from its file name, or None"""
+    for suffix, kind in COMPRESSIONS.items():
+        if str(path).endswith(suffix):
+            return kind
+    return None
+
+
+def _zstd():
+    if zstandard is None:
+        raise ValueError("Reading .zst books needs the zstandard package installed")
+    return zstandard
+
+
+def _zstd_frames(f):
+    """Yield the compressed (start, end) of every frame of a zstd file.
+
+    Only frame and block headers are read: three bytes for every block of
+    up to 128 KB of text.
+    """
+    pos = 0
+    while True:
+        f.seek(pos)
+        head = f.read(18)  # the longest frame header
+        if len(head) < 8:
+            return
+        magic = int.from_bytes(head[:4], "little")
+        start = pos
+        if magic & 0xFFFFFFF0 == ZSTD_SKIPPABLE:
+            pos += 8 + int.from_bytes(head[4:8], "little")
+            yield start, pos
+            continue
+        if magic != ZSTD_MAGIC:
+            return  # padding after the last frame
+        checksum = head[4] & 0x04
+        pos += _zstd().frame_header_size(head)
+        last = False
+        while not last:
+            f.seek(pos)
+            header = f.read(3)
+            if len(header) < 3:
+                raise ValueError("Truncated zstd frame")
+            block = int.from_bytes(header, "little")
+            last = block & 1
+            # An RLE block (type 1) stores one byte, repeated block >> 3 times
+            pos += 3 + (1 if (block >> 1) & 3 == 1 else block >> 3)
+        pos += 4 if checksum else 0
+        yield start, pos
+
+
+class _FileAt:
+    """The bytes of a file from pos up to end, for a reader that may be set
+    aside while other reads move the file"""
+
+    def __init__(self, f, pos, end=None):
+        self.f = f
+        self.pos = pos
+        self.end = end
+
+    def read(self, size=-1):
+        if self.end is not None:
+            size = self.end - self.pos if size < 0 else min(size, self.end - self.pos)
+        self.f.seek(self.pos)
+        data = self.f.read(size)
+        self.pos += len(data)
+        return data
+
+
+def open_book(path):
+    """Binary file object with the (decompressed) bytes of a book, for sequential reads"""
+    kind = compression(path)
+    if kind == "gzip":
+        return gzip.open(path, "rb")
+    if kind == "zstd":
+        return _zstd().ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True,
+                                                        closefd=True)
+    return open(path, "rb")
+
+
+class CompressedBuffer:
+    """Random access to the decompressed bytes of a gzip or zstd book.
+
+    Opening makes one decompression pass that records a checkpoint about
+    every CHECKPOINT output bytes: the compressed offset plus a copy of the
+    zlib decompressor there. A read then inflates just the block between two
+    checkpoints, and the last few blocks are kept. Indexing and slicing work
+    like on the mmap Book uses for plain files.
+
+    zstd decompressors cannot be copied, so a zstd checkpoint inside a frame
+    resumes at the start of that frame and skips the output before it. The
+    decompressor that read the last block is kept, so reading on from there
+    does not replay the frame. Only READ_SIZE of output and the cached blocks
+    are held at once, but jumping back in a single-frame book decompresses
+    it from the start again: books written as many frames seek well.
+
+    feed, if given, is called with the decompressed text piece by piece
+    during the index pass (e.g. an encoding Sampler's feed), so nothing
+    else has to decompress the book to look at it.
+    """
+
+    def __init__(self, path, feed=None):
+        self.kind = compression(path)
+        if self.kind is None:
+            raise ValueError(f"Not a compressed book: {path}")
+        if self.kind == "zstd":
+            _zstd()
+        self._file = open(path, "rb")
+        self._lock = threading.Lock()
+        self._blocks = OrderedDict()  # checkpoint number -> decompressed block
+        # (decompressed offset, compressed offset, decompressor state or None for a
+        # fresh one, output bytes to skip after resuming there)
+        self._checkpoints = [(0, 0, None, 0)]
+        self._starts = [0]
+        self._stream = None  # (decompressed offset, rest of the output) after the last zstd block
+        feed = feed or (lambda data: None)
+        self.size = self._index_zstd(feed) if self.kind == "zstd" else self._index(feed)
+
+    def _inflate(self, d, pos):
+        """Yield (data, compressed offset consumed, decompressor) of a gzip book from pos.
+
+        Moves on to the next gzip member by itself; the decompressor is None
+        right where one ends. data is at most READ_SIZE however well the
+        book compresses, so checkpoints stay CHECKPOINT apart.
+        """
+        f = self._file
+        f.seek(pos)
+        while chunk := f.read(READ_SIZE):
+            end = pos + len(chunk)
+            more = False  # output may still be held back by the decompressor
+            while chunk or more:
+                if d is None:
+                    if not chunk.strip(b"\0"):
+                        break  # padding after the last member
+                    d = zlib.decompressobj(zlib.MAX_WBITS | 32)  # gzip header expected
+                data = d.decompress(chunk, READ_SIZE)
+                chunk = d.unconsumed_tail
+                more = len(data) == READ_SIZE
+                if d.eof:
+                    chunk = d.unused_data
+                    d = None
+                    more = False
+                yield data, end - len(chunk), d
+            pos = end
+
+    def _zstd_output(self, pos, end=None):
+        """Decompressed bytes of a zstd book from the frame at pos (up to end), READ_SIZE at a time"""
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            _FileAt(self._file, pos, end), read_size=READ_SIZE, read_across_frames=True,
+            closefd=False)
+        while data := reader.read(READ_SIZE):
+            yield data
+
+    def _checkpoint(self, size, pos, state, skip=0):
+        self._checkpoints.append((size, pos, state, skip))
+        self._starts.append(size)
+
+    def _index(self, feed):
+        size = 0
+        for data, pos, d in self._inflate(None, 0):
+            feed(data)
+            size += len(data)
+            if size - self._checkpoints[-1][0] >= CHECKPOINT:
+                self._checkpoint(size, pos, d.copy() if d else None)
+        return size
+
+    def _index_zstd(self, feed):
+        size = 0
+        # Listed first: decompressing moves the file the header walk reads
+        for frame, frame_end in list(_zstd_frames(self._file)):
+            if size - self._checkpoints[-1][0] >= CHECKPOINT:
+                self._checkpoint(size, frame, None)
+            frame_start = size
+            for data in self._zstd_output(frame, frame_end):
+                feed(data)
+                size += len(data)
+                if size - self._checkpoints[-1][0] >= CHECKPOINT:
+                    self._checkpoint(size, frame, None, size - frame_start)
+        return size
+
+    def _block(self, i):
+        block = self._blocks.get(i)
+        if block is not None:
+            self._blocks.move_to_end(i)
+            return block
+        start, pos, state, skip = self._checkpoints[i]
+        end = self._starts[i + 1] if i + 1 < len(self._starts) else self.size
+        if self._stream is not None and start - skip <= self._stream[0] <= start:
+            out, output = self._stream
+        elif self.kind == "zstd":
+            out, output = start - skip, self._zstd_output(pos)
+        else:
+            out = start
+            output = (data for data, _, _ in self._inflate(state.copy() if state else None, pos))
+        parts, got, rest = [], 0, b""
+        for data in output:
+            if out < start:
+                drop = min(len(data), start - out)
+                data = data[drop:]
+                out += drop
+            piece = data[:end - start - got]
+            parts.append(piece)
+            got += len(piece)
+            out += len(piece)
+            if got >= end - start:
+                rest = data[len(piece):]
+                break
+        if self.kind == "zstd":
+            self._stream = (out, chain([rest], output))
+        block = b"".join(parts)
+        self._blocks[i] = block
+        if len(self._blocks) > CACHED_BLOCKS:
+            self._blocks.popitem(last=False)
+        return block
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                raise ValueError("Only contiguous slices are supported")
+            return self._read(start, stop)
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("CompressedBuffer index out of range")
+        return self._read(key, key + 1)[0]
+
+    def _read(self, start, stop):
+        if start >= stop:
+            return b""
+        parts = []
+        with self._lock:
+            i = bisect.bisect_right(self._starts, start) - 1
+            while start < stop:
+                block = self._block(i)
+                offset = start - self._starts[i]
+                piece = block[offset:offset + stop - start]
+                if not piece:
+                    break
+                parts.append(piece)
+                start += len(piece)
+                i += 1
+        return b"".join(parts)
+
+    def close(self):
+        self._blocks.clear()
+        self._stream = None
+        self._checkpoints = []
+        self._file.close()
+
+
+def read_range(path, start, end):
+    """Bytes [start, end) of a book's (decompressed) text.
+
+    Compressed books keep their checkpoint index open for the next call, so
+    e.g. a list of search results only decompresses the blocks it shows.
+    """
+    if compression(path) is None:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+    with _buffers_lock:
+        buf = _buffers.get(key)
+        if buf is None:
+            buf = _buffers[key] = CompressedBuffer(path)
+            if len(_buffers) > CACHED_BUFFERS:
+                _buffers.popitem(last=False)[1].close()
+        else:
+            _buffers.move_to_end(key)
+        return buf[start:end]
@@ -0,0 +1,218 @@
+import glob
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from bookbot_analyzer import BookStats, analyze_range
+from bookbot_compressed import BOOK_SUFFIXES, compression
+from bookbot_encoding import ascii_compatible, detect_file
+from bookbot_profile import enabled, init_worker, merge, take
+
+SPLIT_SIZE = 64 << 20  # books larger than this are counted in parallel byte ranges
+BOUNDARY_SCAN = 1 << 16
+
+_WHITESPACE = re.compile(rb"[ \t\n\r\x0b\x0c]")
+
+
+def find_books(targets):
+    """Expand files, directories and glob patterns into a sorted list of books"""
+    books = []
+    for target in targets:
+        path = Path(target)
+        if path.is_dir():
+            books.extend(sorted(p for suffix in BOOK_SUFFIXES for p in path.glob(f"*{suffix}")))
+        elif path.is_file():
+            books.append(path)
+        else:
+            books.extend(Path(p) for p in sorted(glob.glob(target, recursive=True)) if os.path.isfile(p))
+    return books
+
+
+def can_split(encoding, book=None):
+    """True if a book can be counted in byte ranges; compressed books cannot"""
+    if book is not None and compression(book):
+        return False
+    # There an ASCII whitespace byte can never be part of another character
+    return ascii_compatible(encoding)
+
+
+def split_ranges(path, size, split_size=SPLIT_SIZE):
+    """Cut a file into byte ranges of roughly split_size.
+
+    Every cut is moved forward to just after an ASCII whitespace byte, so no
+    word or multi-byte character straddles two ranges.
+    """
+    ranges = []
+    start = 0
+    with open(path, "rb") as f:
+        while size - start > split_size:
+            f.seek(start + split_size)
+            cut = None
+            while cut is None:
+                block = f.read(BOUNDARY_SCAN)
+                if not block:
+                    break
+                match = _WHITESPACE.search(block)
+                if match:
+                    cut = f.tell() - len(block) + match.end()
+            if cut is None:
+                break
+            ranges.append((start, cut))
+            start = cut
+    ranges.append((start, size))
+    return ranges
+
+
+def book_encoding(book, encoding=None, cache=None):
+    """encoding if given, else the book's detected one (looked up in cache if given)"""
+    if encoding:
+        return encoding
+    return cache.encoding(book) if cache else detect_file(book)
+
+
+def _plan(books, split_size, encodings):
+    """Group books and book ranges into tasks of roughly split_size bytes"""
+    tasks = []
+    batch, batch_bytes = [], 0
+    for idx, (book, encoding) in enumerate(zip(books, encodings)):
+        size = os.path.getsize(book)
+        if size > split_size and can_split(encoding, book):
+            for start, end in split_ranges(book, size, split_size):
+                tasks.append([(idx, str(book), start, end, encoding)])
+            continue
+        # Read to the end: size is the compressed size for compressed books
+        batch.append((idx, str(book), 0, None, encoding))
+        batch_bytes += size
+        if batch_bytes >= split_size:
+            tasks.append(batch)
+            batch, batch_bytes = [], 0
+    if batch:
+        tasks.append(batch)
+    return tasks
+
+
+def _pool(jobs):
+    """Process pool whose workers profile, and report back, when we do"""
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(enabled(),))
+
+
+def _run_task(task, backend, ngrams=0, capacity=None):
+    results = [(idx, start, analyze_range(path, start, end, encoding, backend=backend,
+                                          ngrams=ngrams, capacity=capacity))
+               for idx, path, start, end, encoding in task]
+    return results, take()
+
+
+def _run_range(path, start, end, encoding, **options):
+    return analyze_range(path, start, end, encoding, **options), take()
+
+
+def analyze_corpus(books, jobs=None, split_size=SPLIT_SIZE, encoding=None, backend="auto",
+                   cache=None, ngrams=0, capacity=None):
+    """Count every book on a process pool.
+
+    Returns (per_book, total) where per_book is a list of BookStats in the
+    same order as books and total merges all of them. Books found in cache
+    are not read again, and freshly counted books are added to it. N-gram
+    tables are not cached, so with ngrams every book is read. Encodings
+    are detected here, once per book, and handed to the workers.
+    """
+    encodings = [book_encoding(book, encoding, cache) for book in books]
+    per_book = [cache.get(book, encoding=detected) if cache and not ngrams else None
+                for book, detected in zip(books, encodings)]
+    missing = [idx for idx, stats in enumerate(per_book) if stats is None]
+    tasks = _plan([books[idx] for idx in missing], split_size,
+                  [encodings[idx] for idx in missing])
+    parts = [[] for _ in missing]
+    if tasks:
+        with _pool(jobs) as pool:
+            for results, timings in pool.map(_run_task, tasks, [backend] * len(tasks),
+                                             [ngrams] * len(tasks), [capacity] * len(tasks)):
+                merge(timings)
+                for idx, start, stats in results:
+                    parts[idx].append((start, stats))
+
+    for idx, book_parts in zip(missing, parts):
+        stats = BookStats()
+        for _, part in sorted(book_parts, key=lambda item: item[0]):
+            stats.merge(part)
+        per_book[idx] = stats
+        if cache:
+            cache.put(books[idx], stats, encodings[idx])
+
+    total = BookStats()
+    for stats in per_book:
+        total.merge(stats, adjacent=False)
+    return per_book, total
+
+
+def iter_corpus(books, jobs=None, split_size=SPLIT_SIZE, encoding=None, backend="auto",
+                cache=None, ngrams=0, capacity=None, max_pending=None):
+    """Yield (book, stats, error) for each book as soon as it has been counted.
+
+    books may be any iterable, e.g. paths read lazily from stdin. At most
+    about max_pending tasks (default: twice the workers) are in flight, so
+    memory stays bounded however many books there are. Results arrive in
+    completion order; a book that cannot be read yields its exception.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    max_pending = max_pending or 2 * jobs
+    books = iter(books)
+    pending = {}  # future -> (book number, range start)
+    parts = {}  # book number -> [book, ranges left, [(start, stats)], error, encoding]
+    number = 0
+    with _pool(jobs) as pool:
+        while True:
+            while len(pending) < max_pending:
+                book = next(books, None)
+                if book is None:
+                    break
+                try:
+                    # Detected once here rather than in every worker counting a range
+                    detected = book_encoding(book, encoding, cache)
+                    stats = cache.get(book, encoding=detected) if cache and not ngrams else None
+                    if stats is not None:
+                        yield book, stats, None
+                        continue
+                    size = os.path.getsize(book)
+                    if size > split_size and can_split(detected, book):
+                        ranges = split_ranges(book, size, split_size)
+                    else:
+                        ranges = [(0, None)]
+                except Exception as e:
+                    # Unreadable, or a damaged compressed book
+                    yield book, None, e
+                    continue
+                number += 1
+                parts[number] = [book, len(ranges), [], None, detected]
+                for start, end in ranges:
+                    future = pool.submit(_run_range, str(book), start, end, detected,
+                                         backend=backend, ngrams=ngrams, capacity=capacity)
+                    pending[future] = (number, start)
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, start = pending.pop(future)
+                entry = parts[key]
+                try:
+                    stats, timings = future.result()
+                    merge(timings)
+                    entry[2].append((start, stats))
+                except Exception as e:
+                    entry[3] = e
+                entry[1] -= 1
+                if entry[1]:
+                    continue
+                del parts[key]
+                book, _, book_parts, error, detected = entry
+                if error is not None:
+                    yield book, None, error
+                    continue
+                stats = BookStats()
+                for _, part in sorted(book_parts, key=lambda item: item[0]):
+                    stats.merge(part)
+                if cache:
+                    cache.put(book, stats, detected)
+                yield book, stats, None
@@ -0,0 +1,205 @@
+import codecs
+import os
+import re
+from itertools import chain
+
+from bookbot_compressed import compression, open_book
+
+SAMPLE_SIZE = 64 << 10  # bytes read from the start of a book
+SCAN_CHUNK = 1 << 20  # the rest is checked for non-ASCII bytes this much at a time
+SCAN_LIMIT = 16 << 20  # bytes checked through; past this only probes are read
+PROBES = 64  # evenly spaced places looked at past SCAN_LIMIT in a plain file
+PROBE_SIZE = 64 << 10
+SAMPLES = 16  # non-ASCII passages looked at beyond the start
+SAMPLE_SPAN = 4 << 10
+
+# Longest first, so UTF-32-LE is not mistaken for UTF-16-LE
+BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+# Bytes 0x80-0x9F that CP1252 leaves undefined; anything else there means CP1252
+_CP1252_UNDEFINED = frozenset(b"\x81\x8d\x8f\x90\x9d")
+_NOT_C1 = bytes(range(0x80)) + bytes(range(0xA0, 0x100))
+_NON_ASCII = re.compile(rb"[\x80-\xff]")
+_SINGLE_BYTE = ("ascii", "iso8859", "cp125", "mac-")
+
+_detected = {}  # (path, size, mtime_ns) -> encoding, for this process
+
+
+def sniff_bom(data):
+    """(encoding, BOM length) for data starting with a byte order mark, else (None, 0)"""
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding, len(bom)
+    return None, 0
+
+
+def _is_utf8(sample, partial_start):
+    if partial_start:
+        # A sample from the middle may begin inside a character
+        sample = sample.lstrip(bytes(range(0x80, 0xC0)))
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _utf16_without_bom(head):
+    # English text in UTF-16 has a NUL in every other byte
+    if len(head) < 64:
+        return None
+    even, odd = head[0::2].count(0), head[1::2].count(0)
+    if odd > len(head) * 0.4 and even < len(head) * 0.05:
+        return "utf-16-le"
+    if even > len(head) * 0.4 and odd < len(head) * 0.05:
+        return "utf-16-be"
+    return None
+
+
+def guess(head, samples=(), final=False):
+    """Encoding of a book from its first bytes and samples from further on.
+
+    final means nothing outside head and samples can be non-ASCII, so pure
+    ASCII can be reported as such; otherwise ASCII text is reported as
+    UTF-8, which decodes it the same way and keeps any later non-ASCII
+    bytes readable.
+    """
+    encoding, _ = sniff_bom(head)
+    if encoding:
+        return encoding
+    encoding = _utf16_without_bom(head[:SAMPLE_SPAN])
+    if encoding:
+        return encoding
+    parts = [(head, False)] + [(sample, True) for sample in samples]
+    if all(part.isascii() for part, _ in parts):
+        return "ascii" if final else "utf-8"
+    if all(_is_utf8(part, partial) for part, partial in parts):
+        return "utf-8"
+    c1 = set()
+    for part, _ in parts:
+        c1.update(part.translate(None, _NOT_C1))
+    # Windows-1252 puts curly quotes and dashes in the C1 range, Latin-1 controls
+    if c1 and not c1 & _CP1252_UNDEFINED:
+        return "cp1252"
+    return "latin-1"
+
+
+class Sampler:
+    """What guess() looks at, collected from a book's bytes as they are read in order.
+
+    feed() keeps the first SAMPLE_SIZE bytes and one passage around the
+    first non-ASCII byte of each later piece, up to SAMPLES passages.
+    """
+
+    def __init__(self):
+        self._head = []
+        self._head_size = 0
+        self.samples = []
+        self.full = False  # more non-ASCII text came after SAMPLES passages
+
+    @property
+    def head(self):
+        return b"".join(self._head)
+
+    def feed(self, data):
+        if self._head_size < SAMPLE_SIZE:
+            taken = data[:SAMPLE_SIZE - self._head_size]
+            self._head.append(taken)
+            self._head_size += len(taken)
+            data = data[len(taken):]
+        if not data or self.full or data.isascii():
+            return
+        if len(self.samples) == SAMPLES:
+            self.full = True
+            return
+        first = _NON_ASCII.search(data).start()
+        self.samples.append(data[max(0, first - 64):first + SAMPLE_SPAN])
+
+    def guess(self, final=True):
+        """guess() from what was fed; final means that was the whole book"""
+        return guess(self.head, self.samples, final and not self.full)
+
+
+def _scan(f, sampler, size):
+    """Feed sampler what follows the head of f; True if that was all of f.
+
+    The next SCAN_LIMIT bytes are fed through. Past that, a plain file (size
+    given) is only probed in PROBES evenly spaced places, and a compressed
+    one, which cannot seek cheaply, is not read further.
+    """
+    scanned = 0
+    while scanned < SCAN_LIMIT:
+        chunk = f.read(SCAN_CHUNK)
+        if not chunk:
+            return True
+        sampler.feed(chunk)
+        if sampler.full:
+            return False
+        scanned += len(chunk)
+    if size is not None:
+        start = f.tell()
+        for pos in range(start, size, max(PROBE_SIZE, (size - start) // PROBES)):
+            f.seek(pos)
+            sampler.feed(f.read(PROBE_SIZE))
+            if sampler.full:
+                break
+    return False
+
+
+def detect_file(path):
+    """Encoding of a book on disk, guessed without decoding it.
+
+    The first SAMPLE_SIZE bytes are sampled, and at most about SCAN_LIMIT
+    more are checked for non-ASCII passages to sample (see _scan()), so a
+    multi-gigabyte book costs the same as a small one. The answer is
+    remembered for as long as the file's size and mtime stay the same.
+    """
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+    encoding = _detected.get(key)
+    if encoding is None:
+        sampler = Sampler()
+        with open_book(path) as f:
+            sampler.feed(f.read(SAMPLE_SIZE))
+            final = True
+            if not sniff_bom(sampler.head)[0]:
+                final = _scan(f, sampler, None if compression(path) else st.st_size)
+        encoding = _detected[key] = sampler.guess(final)
+    return encoding
+
+
+def detect_stream(chunks):
+    """(encoding, chunks) for a stream, e.g. stdin, guessed from its first chunk.
+
+    The returned chunks still start with the chunk that was looked at.
+    """
+    chunks = iter(chunks)
+    head = next(chunks, b"")
+    encoding = guess(head[:SAMPLE_SIZE])
+    return encoding, chain([head], chunks)
+
+
+def ascii_compatible(encoding):
+    """True if ASCII bytes always stand for the same ASCII characters"""
+    return codecs.lookup(encoding).name.startswith(_SINGLE_BYTE + ("utf-8",))
+
+
+def one_to_one(encoding):
+    """True for single-byte encodings, where byte and character offsets match"""
+    return codecs.lookup(encoding).name.startswith(_SINGLE_BYTE)
+
+
+def skip_bom(f, encoding):
+    """Seek f past a UTF-8 BOM; returns (encoding to decode the rest with, offset)"""
+    if codecs.lookup(encoding).name == "utf-8-sig":
+        if f.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8:
+            return "utf-8", len(codecs.BOM_UTF8)
+        f.seek(0)
+        return "utf-8", 0
+    return encoding, 0
@@ -0,0 +1,306 @@
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+from bookbot_cache import default_cache_dir
+
+DEFAULT_MIRROR = "https://www.gutenberg.org/cache/epub"
+JOBS = 8
+CHUNK_SIZE = 64 << 10
+TIMEOUT = 30  # seconds per connect or read
+MAX_REDIRECTS = 5
+MANIFEST_BATCH = 64  # changed validators kept in memory before the manifest is rewritten
+
+FetchResult = namedtuple("FetchResult", ["book_id", "path", "status", "bytes"])
+
+
+class FetchError(Exception):
+    pass
+
+
+def default_mirror():
+    return os.environ.get("BOOKBOT_MIRROR", DEFAULT_MIRROR)
+
+
+def book_url(mirror, book_id):
+    """Plain text URL of a book, in the layout of gutenberg.org/cache/epub"""
+    return f"{mirror.rstrip('/')}/{book_id}/pg{book_id}.txt"
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections per host, shared by the download threads.
+
+    A connection goes back to the pool once its response has been read to
+    the end, so a run over many books on one mirror pays for a handful of
+    TCP (and TLS) handshakes instead of one per book.
+    """
+
+    def __init__(self, size=JOBS, timeout=TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = {}  # (scheme, host, port) -> [connection]
+        self._lock = threading.Lock()
+
+    def _new(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def acquire(self, key):
+        """(connection, reused) for key"""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._new(key), False
+
+    def release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+    @contextmanager
+    def request(self, method, url, headers):
+        """Send a request and yield the response, following redirects.
+
+        The connection is pooled again only if the caller read the whole
+        body and the server did not ask to close it.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https"):
+                raise FetchError(f"Unsupported URL: {url}")
+            key = (parts.scheme, parts.hostname,
+                   parts.port or (443 if parts.scheme == "https" else 80))
+            target = parts.path + (f"?{parts.query}" if parts.query else "")
+            conn, reused = self.acquire(key)
+            while True:
+                try:
+                    conn.request(method, target or "/", headers=headers)
+                    response = conn.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionError):
+                    conn.close()
+                    if not reused:
+                        raise
+                    # The server dropped an idle keep-alive connection; use a fresh one
+                    conn, reused = self._new(key), False
+                except Exception:
+                    conn.close()
+                    raise
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                url = urljoin(url, response.getheader("Location"))
+                response.read()
+                self._finish(key, conn, response)
+                continue
+            try:
+                yield response
+            finally:
+                self._finish(key, conn, response)
+            return
+        raise FetchError(f"Too many redirects for {url}")
+
+    def _finish(self, key, conn, response):
+        if response.isclosed() and not response.will_close:
+            self.release(key, conn)
+        else:
+            conn.close()
+
+
+class Fetcher:
+    """Downloads Project Gutenberg books into a directory, many at a time.
+
+    Each book is written to a .part file, fsync'ed and renamed into place,
+    so the directory never holds a half-written book. An interrupted
+    download resumes with a Range request (guarded by If-Range), and a book
+    that is already there is re-checked with If-None-Match and
+    If-Modified-Since, costing a 304 and no body when it has not changed.
+    The validators are kept in a JSON manifest in the cache directory,
+    rewritten every MANIFEST_BATCH changes and by save() and close(); a run
+    that dies in between only re-downloads the books it fetched since.
+    """
+
+    def __init__(self, dest="books", mirror=None, jobs=JOBS, pool=None, manifest=None):
+        self.dest = Path(dest)
+        self.mirror = mirror or default_mirror()
+        self.jobs = jobs
+        self.pool = pool or ConnectionPool(jobs)
+        if manifest is None:
+            key = os.path.realpath(self.dest).replace(os.sep, "_").strip("_") or "root"
+            manifest = default_cache_dir() / "fetch" / f"{key}.json"
+        self.manifest = Path(manifest)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # keeps manifest writes in order
+        self._unsaved = 0
+        try:
+            with open(self.manifest, encoding="utf-8") as f:
+                self.validators = json.load(f)
+        except (OSError, ValueError):
+            self.validators = {}  # file name -> {"etag", "last_modified"}
+
+    def _remember(self, name, response):
+        entry = {"etag": response.getheader("ETag"),
+                 "last_modified": response.getheader("Last-Modified")}
+        with self._lock:
+            if self.validators.get(name) == entry:
+                return
+            self.validators[name] = entry
+            self._unsaved += 1
+            if self._unsaved < MANIFEST_BATCH:
+                return
+        self.save()
+
+    def save(self):
+        """Write the manifest if validators changed since it was last written"""
+        with self._save_lock:
+            with self._lock:
+                if not self._unsaved:
+                    return
+                validators = dict(self.validators)  # entries are replaced, never changed
+                self._unsaved = 0
+            self.manifest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.manifest.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(validators, f)
+            os.replace(tmp, self.manifest)
+
+    def fetch(self, book_id):
+        """Download (or re-check, or resume) one book; returns a FetchResult"""
+        name = f"pg{book_id}.txt"
+        path = self.dest / name
+        part = self.dest / f"{name}.part"
+        entry = self.validators.get(name, {})
+        validator = entry.get("etag") or entry.get("last_modified")
+        headers = {"Accept-Encoding": "identity", "User-Agent": "bookbot"}
+        offset = part.stat().st_size if part.exists() else 0
+        if offset and validator:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+        else:
+            offset = 0
+            if path.exists():
+                if entry.get("etag"):
+                    headers["If-None-Match"] = entry["etag"]
+                if entry.get("last_modified"):
+                    headers["If-Modified-Since"] = entry["last_modified"]
+
+        with self.pool.request("GET", book_url(self.mirror, book_id), headers) as response:
+            if response.status == 304:
+                response.read()
+                return FetchResult(book_id, path, "unchanged", 0)
+            if response.status == 416 and offset:
+                # Nothing past what is already there: the .part file is complete
+                response.read()
+                received, status = 0, "resumed"
+            else:
+                if response.status == 206 and offset:
+                    content_range = response.getheader("Content-Range", "")
+                    if not content_range.startswith(f"bytes {offset}-"):
+                        raise FetchError(f"unexpected Content-Range {content_range!r}")
+                    mode, status = "ab", "resumed"
+                elif response.status == 200:
+                    mode, status = "wb", "downloaded"
+                else:
+                    response.read()
+                    raise FetchError(f"HTTP {response.status} {response.reason}")
+                self.dest.mkdir(parents=True, exist_ok=True)
+                self._remember(name, response)
+                expected = response.getheader("Content-Length")
+                received = 0
+                with open(part, mode) as f:
+                    while chunk := response.read(CHUNK_SIZE):
+                        f.write(chunk)
+                        received += len(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if expected is not None and received != int(expected):
+                    # Keep the .part file, the next run picks up from here
+                    raise FetchError(f"connection closed after {received} of {expected} bytes")
+        os.replace(part, path)
+        return FetchResult(book_id, path, status, received)
+
+    def fetch_all(self, book_ids):
+        """Yield (book_id, FetchResult, error) for each book as it finishes"""
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                futures = {pool.submit(self.fetch, book_id): book_id for book_id in book_ids}
+                for future in as_completed(futures):
+                    try:
+                        yield futures[future], future.result(), None
+                    except Exception as e:
+                        yield futures[future], None, e
+        finally:
+            self.save()
+
+    def close(self):
+        self.save()
+        self.pool.close()
+
+
+def parse_ids(specs):
+    """Book numbers from arguments such as 1342, 84 or 1-100"""
+    ids = []
+    for spec in specs:
+        first, _, last = spec.partition("-")
+        try:
+            ids.extend(range(int(first), int(last or first) + 1))
+        except ValueError:
+            raise SystemExit(f"Not a book number or range: {spec}")
+    return list(dict.fromkeys(ids))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download Project Gutenberg books")
+    parser.add_argument("ids", nargs="*", help="book numbers or ranges, e.g. 1342 84 100-120")
+    parser.add_argument("--ids-from", metavar="FILE", help="also read book numbers from FILE")
+    parser.add_argument("--dest", default="books", help="directory to save books in (default: books)")
+    parser.add_argument("--mirror", default=None,
+                        help=f"base URL laid out like {DEFAULT_MIRROR} "
+                             "(default: $BOOKBOT_MIRROR or that)")
+    parser.add_argument("-j", "--jobs", type=int, default=JOBS,
+                        help=f"downloads at once (default: {JOBS})")
+    args = parser.parse_args(argv)
+    specs = list(args.ids)
+    if args.ids_from:
+        with open(args.ids_from) as f:
+            specs += f.read().split()
+    ids = parse_ids(specs)
+    if not ids:
+        parser.error("no book numbers given")
+
+    fetcher = Fetcher(args.dest, args.mirror, args.jobs)
+    failed = 0
+    try:
+        for book_id, result, error in fetcher.fetch_all(ids):
+            if error is not None:
+                failed += 1
+                print(f"pg{book_id}.txt: {error}", file=sys.stderr)
+            else:
+                print(f"{result.path}: {result.status} ({result.bytes} bytes)")
+    finally:
+        fetcher.close()
+    if failed:
+        raise SystemExit(f"{failed} books could not be fetched")
+
+
+if __name__ == "__main__":
+    main()
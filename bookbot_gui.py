@@ -1,8 +1,199 @@
-import tkinter as tk
-from tkinter import ttk
-from tkinter import filedialog
+import argparse
 import os
 from pathlib import Path
+import queue
+import time
+
+from bookbot_book import BookLoader
+from bookbot_catalog import Catalog, info_line, title_line
+from bookbot_client import RemoteBook, ServerError, connect
+from bookbot_library import Library
+from bookbot_paginate import START, Paginator, Prefetcher
+from bookbot_profile import add_argument, count, enable_from, observe, timed
+from bookbot_state import FLUSH_DELAY, StateStore
+from bookbot_lazy import lazy_import
+
+# Tk is only loaded when a window is opened, not when e.g. the benchmark
+# imports TextViewport
+tk = lazy_import("tkinter")
+ttk = lazy_import("tkinter.ttk")
+filedialog = lazy_import("tkinter.filedialog")
+tkfont = lazy_import("tkinter.font")
+bookbot_search = lazy_import("bookbot_search")
+
+FRAME_MS = 16  # Shortest auto-scroll tick, about one frame at 60 Hz
+MAX_TICK_MS = 100  # Longest auto-scroll tick before motion looks jerky
+
+class TextViewport:
+    """Shows a book in a Text widget while holding only a window of rows.
+
+    The widget contains the visible rows plus BUFFER rows above and below.
+    As the view moves, rows are appended or prepended at the edges and
+    trimmed from the far side, so the whole book scrolls continuously while
+    the widget's size and the cost of each scroll step stay constant.
+    Rows come from paginator.rows(), a row at a time rather than in pages,
+    so what the Prefetcher leaves behind for it is the wrapped lines.
+    """
+
+    BUFFER = 60  # Rows kept beyond each edge of the view
+
+    def __init__(self, text, paginator):
+        self.text = text
+        self.paginator = paginator
+        self.positions = []  # Book position of each row in the widget
+        self.end = None  # Position after the last row held, None at the end of the book
+
+    def _line(self, index):
+        return int(self.text.index(index).split('.')[0])
+
+    def visible_rows(self):
+        """(first, last) widget row numbers currently on screen, zero-based"""
+        first = self._line('@0,0') - 1
+        last = self._line(f'@0,{self.text.winfo_height()}') - 1
+        return first, min(last, len(self.positions) - 1)
+
+    def top(self):
+        """Book position of the first visible row"""
+        if not self.positions:
+            return START
+        return self.positions[min(self.visible_rows()[0], len(self.positions) - 1)]
+
+    def at_start(self):
+        return not self.positions or (self.positions[0] == START and self.visible_rows()[0] == 0)
+
+    def at_end(self):
+        return self.end is None and self.text.yview()[1] >= 1.0
+
+    def show(self, pos):
+        """Refill the widget around pos and put pos at the top of the view"""
+        start = self.paginator.back(pos, self.BUFFER)
+        rows, self.end = self.paginator.rows(start, 2 * self.BUFFER + self.paginator.height)
+        self.positions = [p for p, _ in rows]
+        self.text.delete('1.0', tk.END)
+        self.text.insert('1.0', '\n'.join(t for _, t in rows))
+        if pos in self.positions:
+            self.text.yview(f'{self.positions.index(pos) + 1}.0')
+
+    def scroll_rows(self, rows):
+        self.text.yview_scroll(rows, 'units')
+        self.rebalance()
+
+    def scroll_pixels(self, pixels):
+        self.text.yview_scroll(pixels, 'pixels')
+        self.rebalance()
+
+    def _top_offset(self):
+        """Pixels of the first visible row that are scrolled out of view"""
+        info = self.text.dlineinfo('@0,0')
+        inset = int(self.text.cget('pady')) + int(self.text.cget('borderwidth'))
+        return max(0, inset - info[1]) if info else 0
+
+    def _keep_view(self, first, offset):
+        self.text.yview(f'{first + 1}.0')
+        if offset:
+            self.text.yview_scroll(offset, 'pixels')
+
+    @timed("render.rebalance")
+    def rebalance(self):
+        """Top up and trim the rows held so the buffer surrounds the view"""
+        if not self.positions:
+            return
+        first, last = self.visible_rows()
+        offset = self._top_offset()
+        moved = False
+
+        # Rows below the view
+        if self.end is not None and len(self.positions) - 1 - last < self.BUFFER:
+            rows, self.end = self.paginator.rows(self.end, self.BUFFER)
+            if rows:
+                self.text.insert('end-1c', '\n' + '\n'.join(t for _, t in rows))
+                self.positions.extend(p for p, _ in rows)
+        extra = len(self.positions) - 1 - last - 2 * self.BUFFER
+        if extra > 0:
+            keep = len(self.positions) - extra
+            self.text.delete(f'{keep}.end', tk.END)
+            self.end = self.positions[keep]
+            del self.positions[keep:]
+
+        # Rows above the view
+        if first < self.BUFFER // 2 and self.positions[0] != START:
+            start = self.paginator.back(self.positions[0], self.BUFFER)
+            rows, _ = self.paginator.rows(start, self.BUFFER)
+            rows = [row for row in rows if row[0] < self.positions[0]]
+            self.text.insert('1.0', '\n'.join(t for _, t in rows) + '\n')
+            self.positions[:0] = [p for p, _ in rows]
+            first += len(rows)
+            moved = True
+        elif first > 2 * self.BUFFER:
+            drop = first - self.BUFFER
+            self.text.delete('1.0', f'{drop + 1}.0')
+            del self.positions[:drop]
+            first -= drop
+            moved = True
+        if moved:
+            self._keep_view(first, offset)
+
+class CatalogList:
+    """Shows the catalog entries that match a filter, a Listbox-full at a time.
+
+    The Listbox only holds the rows it has room for. The scrollbar, the
+    mouse wheel and Page Up/Down move a window over the matching ids and
+    look up just the entries in it, so filtering and scrolling cost the
+    same for fifty books or fifty thousand.
+    """
+
+    def __init__(self, listbox, scrollbar, catalog):
+        self.listbox = listbox
+        self.scrollbar = scrollbar
+        self.catalog = catalog
+        self.ids = []  # matching catalog ids, in title order
+        self.top = 0  # index in ids of the first row shown
+        self.shown = []  # CatalogEntry of each Listbox row
+        self.selected = None  # id of the selected book
+        scrollbar.configure(command=self.on_scrollbar)
+        listbox.bind('<MouseWheel>', lambda e: self.scroll(-3 if e.delta > 0 else 3))
+        listbox.bind('<Button-4>', lambda e: self.scroll(-3))
+        listbox.bind('<Button-5>', lambda e: self.scroll(3))
+        listbox.bind('<Prior>', lambda e: self.scroll(-self.rows()))
+        listbox.bind('<Next>', lambda e: self.scroll(self.rows()))
+
+    def rows(self):
+        return int(self.listbox.cget('height'))
+
+    def show(self, ids):
+        self.ids = ids
+        self.top = 0
+        self.draw()
+
+    def draw(self):
+        rows = self.rows()
+        self.top = min(max(self.top, 0), max(len(self.ids) - rows, 0))
+        self.shown = self.catalog.rows(self.ids[self.top:self.top + rows])
+        self.listbox.delete(0, tk.END)
+        for entry in self.shown:
+            self.listbox.insert(tk.END, f"{title_line(entry)} ({info_line(entry)})")
+            if entry.id == self.selected:
+                self.listbox.selection_set(tk.END)
+        total = max(len(self.ids), 1)
+        self.scrollbar.set(self.top / total, min(1.0, (self.top + rows) / total))
+
+    def scroll(self, rows):
+        self.top += rows
+        self.draw()
+        return 'break'  # The Listbox must not scroll its few rows by itself
+
+    def on_scrollbar(self, *args):
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.ids))
+            self.draw()
+        elif args[0] == 'scroll':
+            self.scroll(int(args[1]) * (self.rows() if args[2] == 'pages' else 1))
+
+    def select(self, index):
+        """Path of the book in Listbox row index, which becomes the selection"""
+        entry = self.shown[index]
+        self.selected = entry.id
+        return entry.path
 
 class BookBotApp:
     def __init__(self, root):
@@ -18,14 +209,44 @@ class BookBotApp:
         
         # Bind window close event
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        # A book server that fails mid-callback is dropped, not reported
+        self.report_error = self.root.report_callback_exception
+        self.root.report_callback_exception = self.on_callback_error
         
         # Initialize reading state
-        self.current_text = ""
-        self.current_position = 0
-        self.page_size = 2000  # Characters per page
+        self.book = None
+        self.current_position = START  # (line, column) of the top visible row
+        self.paginator = None
+        self.viewport = None
+        self.prefetcher = None
+        self.prefetch_id = None
+        self.read_direction = 1  # 1 forward, -1 backward, for the prefetcher
+        self.rebalance_id = None
         self.auto_scroll_id = None
         self.page_turn_id = None
         self.is_scrolling = False
+        self.scroll_params = None  # Cached rate and dwell times for the current screen
+        self.scroll_interval = FRAME_MS
+        self.last_scroll_tick = None
+        self.scroll_carry = 0.0  # Fraction of a pixel still owed to the view
+        self.dropped_ticks = 0
+        self.line_height = 16
+        self.loader = None
+        self.load_events = queue.Queue()
+        self.load_poll_id = None
+        self.searcher = None  # SearchLoader of the search under way
+        self.search_events = queue.Queue()
+        self.search_poll_id = None
+        self.hits = []
+        self.pending_offset = None  # byte offset to show once the book opens
+        self.books = Library("books")
+        self.catalog = Catalog(self.books)
+        self.filter_id = None
+        self.state = StateStore()  # reading positions and settings
+        self.state_flush_id = None
+        self.position_save_id = None
+        self.saved_position = None  # current_position as last handed to the state store
+        self.client = connect()  # the shared book server, if one is running
         
         self.setup_book_selection()
         self.setup_reading_area()
@@ -42,31 +263,52 @@ class BookBotApp:
 
     def setup_book_selection(self):
         # Book selection frame
-        selection_frame = ttk.LabelFrame(self.main_container, text="Book Selection", padding="5")
+        self.selection_frame = selection_frame = ttk.LabelFrame(self.main_container, text="Book Selection", padding="5")
         selection_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=5, pady=5)
         
         # Add book button
         self.add_btn = ttk.Button(selection_frame, text="Add Books", command=self.add_books)
         self.add_btn.grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
         
+        # Typing narrows the list to titles and authors with words starting so
+        self.filter_var = tk.StringVar()
+        filter_entry = ttk.Entry(selection_frame, textvariable=self.filter_var)
+        filter_entry.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), padx=5)
+        self.filter_var.trace_add('write', lambda *args: self.filter_later())
+        
         # Book list
         self.book_list = tk.Listbox(selection_frame, selectmode=tk.SINGLE, height=6)
-        self.book_list.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), padx=5, pady=5)
+        self.book_list.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), padx=5, pady=5)
         self.book_list.bind('<<ListboxSelect>>', self.on_book_select)
         
         # Scrollbar for book list
-        scrollbar = ttk.Scrollbar(selection_frame, orient=tk.VERTICAL, command=self.book_list.yview)
-        scrollbar.grid(row=1, column=2, sticky=(tk.N, tk.S))
-        self.book_list.configure(yscrollcommand=scrollbar.set)
+        # It moves through all the matching books, not the few rows the Listbox holds
+        scrollbar = ttk.Scrollbar(selection_frame, orient=tk.VERTICAL)
+        scrollbar.grid(row=2, column=2, sticky=(tk.N, tk.S))
+        self.book_view = CatalogList(self.book_list, scrollbar, self.catalog)
+        self.catalog.refresh()
+        self.apply_filter()
+        
+        # Full-text search over the listed books and the books/ library
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(selection_frame, textvariable=self.search_var, width=30)
+        search_entry.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+        search_entry.bind('<Return>', lambda e: self.run_search())
+        
+        self.hit_list = tk.Listbox(selection_frame, selectmode=tk.SINGLE, height=4)
+        self.hit_list.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), padx=5, pady=5)
+        self.hit_list.bind('<<ListboxSelect>>', self.on_hit_select)
 
     def setup_reading_area(self):
         reading_frame = ttk.LabelFrame(self.main_container, text="Reading Area", padding="5")
+        self.reading_frame = reading_frame
         reading_frame.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=5, pady=5)
         reading_frame.columnconfigure(0, weight=1)
         reading_frame.rowconfigure(0, weight=1)
         
         # Text widget for displaying book content
-        self.text_area = tk.Text(reading_frame, wrap=tk.WORD, padx=10, pady=10)
+        # Rows arrive pre-wrapped by the paginator, one widget line each
+        self.text_area = tk.Text(reading_frame, wrap=tk.NONE, padx=10, pady=10)
         self.text_area.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
         # Bind manual scroll events
@@ -85,10 +327,11 @@ class BookBotApp:
         self.text_area.bind('<space>', lambda e: (self.toggle_scroll(), 'break'))
         
         # Scrollbar for text area
-        text_scroll = ttk.Scrollbar(reading_frame, orient=tk.VERTICAL, command=self.text_area.yview)
-        text_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        text_scroll.bind('<B1-Motion>', self.on_manual_scroll)
-        self.text_area.configure(yscrollcommand=text_scroll.set)
+        # It tracks the position in the whole book, not in the rows held by the widget
+        self.text_scroll = ttk.Scrollbar(reading_frame, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.text_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.text_scroll.bind('<B1-Motion>', self.on_manual_scroll)
+        self.text_area.configure(yscrollcommand=self.on_text_scrolled)
 
     def setup_controls(self):
         # Controls frame
@@ -117,7 +360,7 @@ class BookBotApp:
         
         ttk.Label(speed_frame, text="Speed:").grid(row=0, column=0, padx=5)
         self.speed_scale = ttk.Scale(speed_frame, from_=1, to=10, orient=tk.HORIZONTAL, length=200)
-        self.speed_scale.set(5)  # Default speed
+        self.speed_scale.set(self.state.get("gui.speed", 5))  # Default speed
         self.speed_scale.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5)
         # Update on both drag and release for responsive speed changes
         self.speed_scale.bind('<B1-Motion>', self.on_speed_change)     # During drag
@@ -139,10 +382,26 @@ class BookBotApp:
     def add_books(self):
         files = filedialog.askopenfilenames(
             title="Select Books",
-            filetypes=[("Text Files", "*.txt"), ("All Files", "*.*")]
+            filetypes=[("Books", "*.txt *.txt.gz *.txt.zst"), ("All Files", "*.*")]
         )
         for file in files:
-            self.book_list.insert(tk.END, file)
+            self.add_book(file)
+
+    def add_book(self, path):
+        self.catalog.add(path)
+        self.apply_filter()
+
+    def filter_later(self):
+        """Re-filter once Tk is idle, so fast typing filters once"""
+        if self.filter_id is None:
+            self.filter_id = self.root.after_idle(self.apply_filter)
+
+    def apply_filter(self):
+        self.filter_id = None
+        self.book_view.show(self.catalog.search(self.filter_var.get()))
+        matches, total = len(self.book_view.ids), len(self.catalog)
+        label = f"{total}" if matches == total else f"{matches} of {total}"
+        self.selection_frame.configure(text=f"Book Selection ({label})")
 
     def on_book_select(self, event):
         selection = self.book_list.curselection()
@@ -152,106 +411,332 @@ class BookBotApp:
                 self.auto_page_var.set(False)
                 self.update_auto_modes()
                 
-            file_path = self.book_list.get(selection[0])
+            file_path = self.book_view.select(selection[0])
+            self.start_loading(file_path)
+
+    def library(self):
+        """Books that search covers: books/ plus any added by hand"""
+        self.catalog.refresh()
+        return self.catalog.paths()
+
+    def run_search(self):
+        """Search the library on a worker thread and poll for the hits"""
+        query = self.search_var.get().strip()
+        self.hit_list.delete(0, tk.END)
+        self.hits = []
+        if self.searcher:
+            self.searcher.cancel()
+            self.searcher = None
+        if not query:
+            return
+        books = self.library()
+        self.hit_list.insert(tk.END, f"Searching {len(books)} books...")
+        self.searcher = bookbot_search.SearchLoader(query, books, events=self.search_events,
+                                                    client=self.client)
+        self.searcher.start()
+        if self.search_poll_id is None:
+            self.poll_search()
+
+    def poll_search(self):
+        """Show search progress and then the hits, on the Tk thread"""
+        self.search_poll_id = None
+        while True:
+            try:
+                searcher, kind, value = self.search_events.get_nowait()
+            except queue.Empty:
+                break
+            if searcher is not self.searcher:
+                continue  # replaced by a newer search
+            self.hit_list.delete(0, tk.END)
+            if kind == 'progress':
+                self.hit_list.insert(tk.END, "Indexing {} of {} books...".format(*value))
+                continue
+            self.searcher = None
+            if self.client and self.client.lost:
+                self.drop_client()
+            if kind == 'error':
+                self.hit_list.insert(tk.END, f"Search failed: {value}")
+                continue
+            self.hits = value
+            for hit in self.hits:
+                self.hit_list.insert(tk.END, f"{Path(hit.path).name}: {bookbot_search.snippet(hit)}")
+        if self.searcher:
+            self.search_poll_id = self.root.after(50, self.poll_search)
+
+    def on_hit_select(self, event):
+        selection = self.hit_list.curselection()
+        if not selection or selection[0] >= len(self.hits):
+            return  # nothing, or a progress line
+        hit = self.hits[selection[0]]
+        if self.auto_scroll_var.get():
+            self.auto_scroll_var.set(False)
+            self.auto_page_var.set(False)
+            self.update_auto_modes()
+        if self.book and os.path.realpath(self.book.path) == hit.path:
+            self.goto_offset(hit.offset)
+        else:
+            self.start_loading(hit.path, offset=hit.offset)
+
+    def goto_offset(self, offset):
+        """Show the row containing byte offset at the top"""
+        self.current_position = self.paginator.row_start(self.book.position(offset))
+        self.display_current_page()
+
+    def start_loading(self, file_path, offset=None, local=False):
+        """Open a book on a worker thread and poll for its events.
+
+        local opens it here even while a book server is running.
+        """
+        self.pending_offset = offset
+        if self.loader:
+            self.loader.cancel()
+        if self.book:
+            self.save_position()
+            self.book.close()
+            self.book = None
+            self.paginator = None
+            self.viewport = None
+            self.prefetcher = None
+        self.text_area.delete('1.0', tk.END)
+        self.reading_frame.configure(text=f"Reading Area - {Path(file_path).name} (loading)")
+        self.loader = BookLoader(file_path, events=self.load_events, analyze=True,
+                                 client=None if local else self.client)
+        self.loader.start()
+        if self.load_poll_id is None:
+            self.poll_loading()
+
+    def drop_client(self):
+        """Go on without the book server, e.g. once it stops answering.
+
+        A book it had open (or was opening) is opened again locally, at the
+        last saved position.
+        """
+        if self.client:
+            self.client.close()
+            self.client = None
+        if self.loader and self.loader.client:
+            self.start_loading(self.loader.path, self.pending_offset)
+        elif isinstance(self.book, RemoteBook):
+            self.start_loading(self.book.path)
+
+    def on_callback_error(self, exc, value, tb):
+        if isinstance(value, (ConnectionError, ServerError)) and isinstance(self.book, RemoteBook):
+            self.drop_client()
+        else:
+            self.report_error(exc, value, tb)
+
+    def poll_loading(self):
+        """Apply loader events on the Tk thread, then check again shortly"""
+        self.load_poll_id = None
+        while True:
             try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    self.current_text = file.read()
-                    self.current_position = 0
+                loader, kind, value = self.load_events.get_nowait()
+            except queue.Empty:
+                break
+            if loader is not self.loader:
+                # Left over from a book the user already moved away from
+                if kind == 'opened':
+                    value.close()
+                continue
+            name = Path(loader.path).name
+            if kind == 'opened':
+                self.book = value
+                self.current_position = START
+                self.saved_position = None
+                self.paginator = Paginator(value, *self.page_dimensions())
+                self.viewport = TextViewport(self.text_area, self.paginator)
+                self.prefetcher = Prefetcher(self.paginator)
+                self.read_direction = 1
+                if self.pending_offset is None:
+                    self.pending_offset = self.state.position(loader.path)
+                if self.pending_offset is not None:
+                    self.goto_offset(self.pending_offset)
+                    self.pending_offset = None
+                else:
                     self.display_current_page()
-            except Exception as e:
+            elif kind == 'progress':
+                self.reading_frame.configure(text=f"Reading Area - {name} (indexing {value:.0%})")
+            elif kind == 'stats':
+                self.reading_frame.configure(text=f"Reading Area - {name} ({value.words} words)")
+                self.books.set_words(loader.path, value.words)
+                self.books.save()
+                self.book_view.draw()
+            elif kind == 'done':
+                self.loader = None
+            elif kind == 'error' and loader.client and isinstance(value, ConnectionError):
+                self.drop_client()
+            elif kind == 'error' and loader.client and isinstance(value, ServerError):
+                self.start_loading(loader.path, self.pending_offset, local=True)
+            elif kind == 'error':
+                self.loader = None
+                self.reading_frame.configure(text="Reading Area")
                 self.text_area.delete('1.0', tk.END)
-                self.text_area.insert('1.0', f"Error reading file: {str(e)}")
+                self.text_area.insert('1.0', f"Error reading file: {str(value)}")
+        if self.loader:
+            self.load_poll_id = self.root.after(50, self.poll_loading)
+
+    def page_dimensions(self):
+        """Characters per row and rows per page that fit in the text area"""
+        font = tkfont.nametofont(self.text_area.cget('font'))
+        self.line_height = font.metrics('linespace')
+        inset = 2 * (int(self.text_area.cget('padx')) + int(self.text_area.cget('borderwidth')))
+        width = self.text_area.winfo_width() - inset
+        height = self.text_area.winfo_height() - inset
+        if width <= 1 or height <= 1:
+            # Not mapped yet, fall back to the configured size in characters
+            return int(self.text_area.cget('width')), int(self.text_area.cget('height'))
+        return (max(1, width // font.measure('0')),
+                max(1, height // font.metrics('linespace')))
 
+    @timed("render.display")
     def display_current_page(self):
-        start = self.current_position
-        end = start + self.page_size
-        if end > len(self.current_text):
-            end = len(self.current_text)
-        
-        current_page = self.current_text[start:end]
-        self.text_area.delete('1.0', tk.END)
-        self.text_area.insert('1.0', current_page)
-        
-        # Update button states
-        self.prev_btn['state'] = 'normal' if start > 0 else 'disabled'
-        self.next_btn['state'] = 'normal' if end < len(self.current_text) else 'disabled'
+        self.viewport.show(self.current_position)
+        self.update_position()
+
+    def update_position(self):
+        """Track the top visible row and refresh the navigation controls"""
+        self.current_position = self.viewport.top()
+        self.save_position_later()
+        self.prev_btn['state'] = 'disabled' if self.viewport.at_start() else 'normal'
+        self.next_btn['state'] = 'disabled' if self.viewport.at_end() else 'normal'
+        if self.book.size:
+            line = self.current_position[0]
+            top = self.book.line_starts[line] / self.book.size
+            bottom = self.book.line_starts[self.viewport.positions[self.viewport.visible_rows()[1]][0]]
+            self.text_scroll.set(top, max(top, bottom / self.book.size))
+        self.prefetch_later()
+
+    def save_position_later(self):
+        """Save the position once it has settled rather than on every tick.
+
+        Its byte offset is a server round trip for a RemoteBook.
+        """
+        if self.position_save_id is None:
+            self.position_save_id = self.root.after(int(FLUSH_DELAY * 1000), self.save_position)
+
+    def save_position(self):
+        """Hand the byte offset of the top row to the state store if it moved"""
+        if self.position_save_id is not None:
+            self.root.after_cancel(self.position_save_id)
+            self.position_save_id = None
+        if self.book is None or self.viewport is None or self.saved_position == self.current_position:
+            return
+        try:
+            offset = self.book.offset(self.current_position)
+        except (ConnectionError, ServerError):
+            return  # the book server is gone; the last saved position stands
+        self.saved_position = self.current_position
+        self.state.set_position(self.book.path, offset)
+        self.save_state_later()
+
+    def prefetch_later(self):
+        """Prepare the pages ahead of the reader whenever Tk is idle"""
+        if self.prefetcher and self.prefetch_id is None:
+            self.prefetch_id = self.root.after_idle(self.prefetch_pages)
+
+    def prefetch_pages(self):
+        self.prefetch_id = None
+        if self.prefetcher:
+            self.prefetcher.plan(self.current_position, self.read_direction)
+            # One page per idle call, so key presses and ticks are not held up.
+            # The viewport fills from arbitrary rows, not page starts, so it
+            # reuses the lines these pages wrapped rather than the pages
+            if self.prefetcher.step():
+                self.prefetch_later()
+
+    def on_text_scrolled(self, first, last):
+        """yscrollcommand: rebalance the viewport once Tk is idle"""
+        if self.viewport and self.rebalance_id is None:
+            self.rebalance_id = self.root.after_idle(self.rebalance_viewport)
+
+    def rebalance_viewport(self):
+        self.rebalance_id = None
+        if self.viewport:
+            self.viewport.rebalance()
+            self.update_position()
+
+    def on_scrollbar(self, *args):
+        """Scrollbar drags and clicks move through the whole book"""
+        if not self.viewport:
+            return
+        if args[0] == 'moveto':
+            offset = int(float(args[1]) * self.book.size)
+            line = self.book.line_at(min(max(offset, 0), max(self.book.size - 1, 0)))
+            self.current_position = (line, 0)
+            self.display_current_page()
+        elif args[0] == 'scroll':
+            rows = int(args[1]) * (self.paginator.height if args[2] == 'pages' else 1)
+            self.read_direction = 1 if rows >= 0 else -1
+            self.viewport.scroll_rows(rows)
+            self.update_position()
 
     def prev_page(self):
-        if self.current_position > 0:
+        if self.viewport and not self.viewport.at_start():
             if self.auto_scroll_var.get():
                 self.auto_scroll_var.set(False)
                 self.auto_page_var.set(False)
                 self.update_auto_modes()
-            self.current_position = max(0, self.current_position - self.page_size)
-            self.display_current_page()
+            self.read_direction = -1
+            self.viewport.scroll_rows(-self.paginator.height)
+            self.update_position()
 
     def next_page(self):
-        if self.current_position + self.page_size < len(self.current_text):
+        if self.viewport and not self.viewport.at_end():
             if self.auto_scroll_var.get():
                 self.auto_scroll_var.set(False)
                 self.auto_page_var.set(False)
                 self.update_auto_modes()
-            self.current_position += self.page_size
-            self.display_current_page()
+            self.read_direction = 1
+            self.viewport.scroll_rows(self.paginator.height)
+            self.update_position()
 
     def calculate_scroll_params(self):
-        """Calculate scroll parameters based on content and speed"""
+        """Scroll rate and paragraph dwell times for the screenful at the top.
+
+        Worked out once per screen page from the paginator's (usually
+        prefetched) page and the cached line height, instead of measuring the
+        widget contents on every tick.
+        """
         speed = self.speed_scale.get()  # 1-10
-        chars_per_minute = speed * 200 
-        current_page = self.text_area.get('1.0', 'end-1c')
-        char_count = len(current_page)
-        
-        try:
-            total_scroll_time = (char_count / chars_per_minute) * 60  # seconds
-            viewport_height = self.text_area.winfo_height()
-            self.text_area.update_idletasks()
-            line_info = self.text_area.dlineinfo('1.0')
-            if line_info:
-                line_height = line_info[3]
-                num_lines = int(self.text_area.index('end-1c').split('.')[0])
-                content_height = num_lines * line_height
-            else:
-                content_height = viewport_height
-                
-            total_height = max(viewport_height, content_height)
-            
-            # Calculate pixels per second for smooth scrolling
-            # Ensure minimum scroll speed for very large content
-            min_scroll_time = 20  # Maximum 20 seconds per page
-            total_scroll_time = min(total_scroll_time, min_scroll_time)
-            pixels_per_second = total_height / total_scroll_time
-            min_pixels_per_interval = 1
-            pixels_per_interval = max(pixels_per_second * 0.05, min_pixels_per_interval)
-            
-            return {
-                'scroll_interval': 50,
-                'pixels_per_interval': pixels_per_interval,
-                'total_time': int(total_scroll_time * 1000)
-            }
-            
-        except Exception as e:
-            # Fallback to basic scroll parameters if calculations fail
-            return {
-                'scroll_interval': 50,
-                'pixels_per_interval': 1,
-                'total_time': 10000
-            }
-
-    def calculate_delay(self, text):
+        chars_per_minute = speed * 200
+        page = self.paginator.page(self.viewport.top())
+
+        # Paragraphs are runs of rows separated by blank rows
+        paragraphs = [0]
+        for text in page.rows:
+            if text.strip():
+                paragraphs[-1] += len(text)
+            elif paragraphs[-1]:
+                paragraphs.append(0)
+        char_count = sum(paragraphs)
+
+        page_height = self.paginator.height * self.line_height
+        total_scroll_time = (char_count / chars_per_minute) * 60  # seconds
+        # Ensure minimum scroll speed for very large content
+        min_scroll_time = 20  # Maximum 20 seconds per page
+        total_scroll_time = min(max(total_scroll_time, 1), min_scroll_time)
+
+        return {
+            'page_end': page.next,
+            'pixels_per_second': page_height / total_scroll_time,
+            'first_delay': self.calculate_delay(paragraphs[0]),
+            'last_delay': self.calculate_delay(paragraphs[-1] or paragraphs[0]),
+        }
+
+    def calculate_delay(self, char_count):
         """Calculate delay time based on content and speed"""
-        char_count = len(text)
         speed = self.speed_scale.get()
         return min(max(int((char_count / (speed * 20)) * 1000), 3000), 10000)
 
     def calculate_bottom_delay(self):
         """Calculate delay time for bottom of page based on content and speed"""
-        current_page = self.text_area.get('1.0', 'end-1c')
-        last_paragraph = current_page.split('\n\n')[-1] if '\n\n' in current_page else current_page[-500:]
-        return self.calculate_delay(last_paragraph)
+        if self.scroll_params is None:
+            self.scroll_params = self.calculate_scroll_params()
+        return self.scroll_params['last_delay']
 
     def schedule_page_turn(self):
         """Schedule page turn with current delay"""
-        if hasattr(self, 'page_turn_id') and self.page_turn_id is not None:
+        if self.page_turn_id is not None:
             try:
                 self.root.after_cancel(self.page_turn_id)
             except ValueError:
@@ -259,13 +744,24 @@ class BookBotApp:
         delay = self.calculate_bottom_delay()
         self.page_turn_id = self.root.after(delay, self.handle_page_turn)
 
+    def next_scroll_interval(self, pixels_per_second, work):
+        """Milliseconds until the next tick, adapted to the frame budget.
+
+        Ticks are no more often than one frame and no less often than needed
+        to move a pixel at a time. If a tick's own work takes more than half
+        of the interval (a slow machine), the interval stretches to match.
+        """
+        interval = max(FRAME_MS, min(MAX_TICK_MS, 1000 / max(pixels_per_second, 1e-3)))
+        return int(min(MAX_TICK_MS, max(interval, work * 1000 * 2)))
+
+    @timed("scroll.tick")
     def auto_scroll(self):
-        if not self.auto_scroll_var.get():
+        self.auto_scroll_id = None
+        if not self.auto_scroll_var.get() or not self.viewport:
             return
-            
-        current_pos = self.text_area.yview()[1]
-        
-        if current_pos >= 1.0:
+
+        if self.viewport.at_end():
+            self.last_scroll_tick = None
             if self.auto_page_var.get():
                 self.schedule_page_turn()
             else:
@@ -273,22 +769,47 @@ class BookBotApp:
                 self.update_auto_modes()
             return
 
-        if current_pos == 0.0 and not hasattr(self, 'scroll_params'):
-            current_page = self.text_area.get('1.0', 'end-1c')
-            first_paragraph = current_page.split('\n\n')[0] if '\n\n' in current_page else current_page[:500]
-            delay = self.calculate_delay(first_paragraph)
-            self.auto_scroll_id = self.root.after(delay, self.auto_scroll)
-            return
-            
-        if not hasattr(self, 'scroll_params'):
+        now = time.monotonic()
+        self.read_direction = 1
+        if self.scroll_params is None:
             self.scroll_params = self.calculate_scroll_params()
-            
-        self.text_area.yview_scroll(int(self.scroll_params['pixels_per_interval']), 'pixels')
-        
-        self.auto_scroll_id = self.root.after(
-            self.scroll_params['scroll_interval'], 
-            self.auto_scroll
-        )
+        if self.last_scroll_tick is None:
+            self.last_scroll_tick = now
+            self.scroll_carry = 0.0
+            if self.viewport.at_start():
+                # Give the reader time for the opening paragraph first
+                self.auto_scroll_id = self.root.after(
+                    self.scroll_params['first_delay'], self.resume_auto_scroll)
+                return
+
+        # Move by elapsed time, not by tick count, so slow ticks do not slow the text
+        elapsed = now - self.last_scroll_tick
+        expected = self.scroll_interval / 1000
+        observe("scroll.tick_interval", elapsed)
+        if elapsed > 2 * expected:
+            self.dropped_ticks += int(elapsed / expected) - 1
+            count("scroll.dropped_ticks", int(elapsed / expected) - 1)
+        self.last_scroll_tick = now
+        self.scroll_carry += elapsed * self.scroll_params['pixels_per_second']
+        pixels = int(self.scroll_carry)
+        if pixels:
+            self.scroll_carry -= pixels
+            self.viewport.scroll_pixels(pixels)
+            self.update_position()
+            end = self.scroll_params['page_end']
+            if end is not None and self.current_position >= end:
+                # Next screen page: its rate and dwell times are worked out once
+                self.scroll_params = None
+
+        work = time.monotonic() - now
+        rate = self.scroll_params['pixels_per_second'] if self.scroll_params else 1
+        self.scroll_interval = self.next_scroll_interval(rate, work)
+        self.auto_scroll_id = self.root.after(self.scroll_interval, self.auto_scroll)
+
+    def resume_auto_scroll(self):
+        """Start moving after a dwell, measuring elapsed time from now"""
+        self.last_scroll_tick = time.monotonic()
+        self.auto_scroll()
 
     def handle_page_turn(self):
         """Handle turning to the next page after reaching bottom"""
@@ -296,9 +817,8 @@ class BookBotApp:
         
         if self.auto_page_var.get():
             self.next_page()
-            self.text_area.yview_moveto(0)
-            if hasattr(self, 'scroll_params'):
-                delattr(self, 'scroll_params')
+            self.scroll_params = None
+            self.last_scroll_tick = None
             self.auto_scroll_var.set(True)
             self.auto_scroll()
 
@@ -310,15 +830,15 @@ class BookBotApp:
                 pass
             self.auto_scroll_id = None
             
-        if hasattr(self, 'page_turn_id') and self.page_turn_id is not None:
+        if self.page_turn_id is not None:
             try:
                 self.root.after_cancel(self.page_turn_id)
             except ValueError:
                 pass
             self.page_turn_id = None
         
-        if hasattr(self, 'scroll_params'):
-            delattr(self, 'scroll_params')
+        self.scroll_params = None
+        self.last_scroll_tick = None
         
         if self.auto_scroll_var.get() or self.auto_page_var.get():
             self.play_btn.configure(text="Pause")
@@ -330,14 +850,14 @@ class BookBotApp:
 
     def on_window_resize(self, event):
         """Handle window resize events"""
-        if (event.widget == self.root and 
-            (event.width != self.root.winfo_width() or 
-             event.height != self.root.winfo_height()) and
-            hasattr(self, 'scroll_params')):
-            self.root.update_idletasks()
-            delattr(self, 'scroll_params')
-            if self.auto_scroll_var.get():
-                self.auto_scroll()
+        if event.widget == self.text_area and self.viewport:
+            width, height = self.page_dimensions()
+            if (width, height) != (self.paginator.width, self.paginator.height):
+                # Re-wrap from the top visible row only
+                self.current_position = self.paginator.resize(width, height, self.viewport.top())
+                self.display_current_page()
+                # Rows changed size, the next tick re-measures the page
+                self.scroll_params = None
 
     def adjust_speed(self, delta):
         """Adjust reading speed by the given delta"""
@@ -349,13 +869,23 @@ class BookBotApp:
 
     def on_speed_change(self, event):
         """Handle speed slider changes"""
-        if hasattr(self, 'scroll_params'):
-            delattr(self, 'scroll_params')
-            if self.auto_scroll_var.get():
-                if self.text_area.yview()[1] >= 1.0 and self.auto_page_var.get():
-                    self.schedule_page_turn()
-                else:
-                    self.auto_scroll()
+        # The running tick picks up the new rate; a pending page turn is rescheduled
+        self.scroll_params = None
+        self.state.set("gui.speed", self.speed_scale.get())
+        self.save_state_later()
+        if self.page_turn_id is not None:
+            self.schedule_page_turn()
+
+    def save_state_later(self):
+        """Have the state store write out changes once they are due"""
+        due = self.state.due_in()
+        if due is not None and self.state_flush_id is None:
+            self.state_flush_id = self.root.after(int(due * 1000) + 1, self.flush_state)
+
+    def flush_state(self):
+        self.state_flush_id = None
+        self.state.tick()
+        self.save_state_later()
 
     def on_manual_scroll(self, event):
         """Handle manual scrolling while auto-scroll is active"""
@@ -379,6 +909,34 @@ class BookBotApp:
 
     def cleanup(self):
         """Clean up resources and event bindings"""
+        self.save_position()
+        if self.loader:
+            self.loader.cancel()
+            self.loader = None
+        if self.load_poll_id:
+            self.root.after_cancel(self.load_poll_id)
+            self.load_poll_id = None
+        if self.searcher:
+            self.searcher.cancel()
+            self.searcher = None
+        if self.search_poll_id:
+            self.root.after_cancel(self.search_poll_id)
+            self.search_poll_id = None
+        if self.rebalance_id:
+            self.root.after_cancel(self.rebalance_id)
+            self.rebalance_id = None
+        if self.prefetch_id:
+            self.root.after_cancel(self.prefetch_id)
+            self.prefetch_id = None
+        if self.filter_id:
+            self.root.after_cancel(self.filter_id)
+            self.filter_id = None
+        if self.state_flush_id:
+            self.root.after_cancel(self.state_flush_id)
+            self.state_flush_id = None
+        self.state.close()
+        self.catalog.close()
+
         if self.auto_scroll_id:
             try:
                 self.root.after_cancel(self.auto_scroll_id)
@@ -386,16 +944,23 @@ class BookBotApp:
                 pass
             self.auto_scroll_id = None
             
-        if hasattr(self, 'page_turn_id') and self.page_turn_id is not None:
+        if self.page_turn_id is not None:
             try:
                 self.root.after_cancel(self.page_turn_id)
             except ValueError:
                 pass
             self.page_turn_id = None
 
-        self.current_text = ""
-        if hasattr(self, 'scroll_params'):
-            delattr(self, 'scroll_params')
+        if self.book:
+            self.book.close()
+            self.book = None
+            self.paginator = None
+            self.viewport = None
+            self.prefetcher = None
+        if self.client:
+            self.client.close()
+            self.client = None
+        self.scroll_params = None
 
         self.root.unbind('<Configure>')
         self.root.unbind('<space>')
@@ -431,6 +996,9 @@ class BookBotApp:
         self.root.destroy()
 
 def main():
+    parser = argparse.ArgumentParser(description="Graphical book reader")
+    add_argument(parser)
+    enable_from(parser.parse_args())
     root = tk.Tk()
     app = BookBotApp(root)
     root.mainloop()
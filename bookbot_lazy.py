@@ -0,0 +1,36 @@
+import importlib.machinery
+import importlib.util
+import sys
+
+
+def _find_spec(name):
+    # Look submodules up on disk, so that finding tkinter.ttk does not
+    # import tkinter itself the way importlib.util.find_spec() would
+    parent, _, _ = name.rpartition(".")
+    if not parent:
+        return importlib.util.find_spec(name)
+    parent_spec = importlib.machinery.PathFinder.find_spec(parent)
+    if parent_spec is None or not parent_spec.submodule_search_locations:
+        return None
+    return importlib.machinery.PathFinder.find_spec(name, parent_spec.submodule_search_locations)
+
+
+def lazy_import(name):
+    """Module name, loaded on first attribute access; None if not installed.
+
+    Start-up then only pays for finding the module, and a script that never
+    touches it (the terminal reader never draws a histogram with NumPy, say)
+    never pays for loading it.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = _find_spec(name)
+    if spec is None:
+        return None
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
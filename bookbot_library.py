@@ -0,0 +1,129 @@
+import json
+import os
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from bookbot_cache import default_cache_dir
+from bookbot_compressed import BOOK_SUFFIXES
+RESCAN_INTERVAL = 10.0  # seconds before files are re-stat'ed for in-place edits
+
+LibraryEntry = namedtuple("LibraryEntry", ["name", "path", "size", "mtime_ns", "words"])
+
+
+class Library:
+    """Cached listing of the books in a directory.
+
+    The listing (name, size, mtime and, once known, word count) is kept in a
+    JSON manifest in the cache directory. A cold start reads the manifest
+    instead of stat'ing every file; the directory is re-read with os.scandir
+    only when its mtime changes or RESCAN_INTERVAL has passed, and word
+    counts survive for files whose size and mtime did not change.
+    """
+
+    def __init__(self, directory="books", manifest=None):
+        self.directory = Path(directory)
+        if manifest is None:
+            key = os.path.realpath(self.directory).replace(os.sep, "_").strip("_") or "root"
+            manifest = default_cache_dir() / "library" / f"{key}.json"
+        self.manifest = Path(manifest)
+        self.entries = []
+        self._by_path = {}
+        self._dir_mtime = None
+        self._scanned_at = 0.0
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.manifest, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._dir_mtime = data.get("dir_mtime_ns")
+        self._set_entries([LibraryEntry(*entry) for entry in data.get("entries", [])])
+
+    def save(self):
+        if not self._dirty:
+            return
+        self.manifest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dir_mtime_ns": self._dir_mtime, "entries": self.entries}, f)
+        os.replace(tmp, self.manifest)
+        self._dirty = False
+
+    def _set_entries(self, entries):
+        self.entries = entries
+        self._by_path = {entry.path: i for i, entry in enumerate(entries)}
+
+    def refresh(self, force=False):
+        """Bring the listing up to date; True if it changed"""
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            changed = bool(self.entries)
+            self._set_entries([])
+            return changed
+        now = time.monotonic()
+        if not force and dir_mtime == self._dir_mtime:
+            if not self._scanned_at:
+                # Fresh from the manifest, and nothing was added or removed since
+                self._scanned_at = now
+            if now - self._scanned_at < RESCAN_INTERVAL:
+                return False
+        self._scanned_at = now
+        self._dir_mtime = dir_mtime
+        entries = []
+        with os.scandir(self.directory) as it:
+            for dirent in it:
+                if not dirent.name.endswith(BOOK_SUFFIXES):
+                    continue
+                try:
+                    if not dirent.is_file():
+                        continue
+                    st = dirent.stat()
+                except OSError:
+                    continue
+                path = os.path.join(self.directory, dirent.name)
+                old = self.get(path)
+                unchanged = old and (old.size, old.mtime_ns) == (st.st_size, st.st_mtime_ns)
+                words = old.words if unchanged else None
+                entries.append(LibraryEntry(dirent.name, path, st.st_size, st.st_mtime_ns, words))
+        entries.sort(key=lambda entry: entry.name)
+        changed = entries != self.entries
+        if changed:
+            self._set_entries(entries)
+            self._dirty = True
+        self.save()
+        return changed
+
+    def get(self, path):
+        idx = self._by_path.get(str(path))
+        return self.entries[idx] if idx is not None else None
+
+    def set_words(self, path, words):
+        """Remember a book's word count, e.g. once a reader has analyzed it"""
+        idx = self._by_path.get(str(path))
+        if idx is not None and self.entries[idx].words != words:
+            self.entries[idx] = self.entries[idx]._replace(words=words)
+            self._dirty = True
+
+    def paths(self):
+        return [Path(entry.path) for entry in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def describe(entry):
+    """Short metadata line: size and, if known, word count"""
+    size = entry.size
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    text = f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+    if entry.words is not None:
+        text += f", {entry.words:,} words"
+    return text
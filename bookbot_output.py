@@ -0,0 +1,112 @@
+import csv
+import json
+import struct
+
+from bookbot_analyzer import NGRAM_NAMES
+
+FORMATS = ("text", "jsonl", "csv", "binary")
+
+# Binary stream: MAGIC, then one record per book:
+#   header   <HBQI  name length, flags, words, letter count
+#   name     UTF-8 bytes
+#   letters  <IQ    code point and count, once per letter
+# With FLAG_ERROR set the letters are replaced by <H length + UTF-8 message.
+MAGIC = b"BBH1"
+FLAG_ERROR = 1
+_HEADER = struct.Struct("<HBQI")
+_LETTER = struct.Struct("<IQ")
+_LENGTH = struct.Struct("<H")
+
+
+def _top(stats, k):
+    return {kind: table.top(k) for kind, table in zip(NGRAM_NAMES, stats.ngrams)}
+
+
+class JsonLinesWriter:
+    """One JSON object per book: path, words, chars and, with top, n-grams"""
+
+    def __init__(self, out, top=0):
+        self.out = out
+        self.top = top
+
+    def write(self, name, stats=None, error=None):
+        if error is not None:
+            record = {"path": name, "error": str(error)}
+        else:
+            record = {"path": name, "words": stats.words, "chars": stats.chars}
+            if stats.ngrams and self.top:
+                record["top"] = _top(stats, self.top)
+        self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.out.flush()
+
+    def close(self):
+        self.out.flush()
+
+
+class CsvWriter:
+    """Long format: a row per letter (and per top n-gram) of each book"""
+
+    def __init__(self, out, top=0):
+        self.out = out
+        self.top = top
+        self.writer = csv.writer(out)
+        self.writer.writerow(["path", "words", "kind", "item", "count"])
+
+    def write(self, name, stats=None, error=None):
+        rows = self.writer.writerows
+        if error is not None:
+            rows([[name, "", "error", str(error), ""]])
+        else:
+            rows([name, stats.words, "char", char, count] for char, count in stats.chars.items())
+            if self.top:
+                for kind, items in _top(stats, self.top).items():
+                    rows([name, stats.words, kind, item, count] for item, count in items)
+            if not stats.chars:
+                rows([[name, stats.words, "", "", ""]])
+        self.out.flush()
+
+    def close(self):
+        self.out.flush()
+
+
+class BinaryWriter:
+    """Packed letter histograms, see MAGIC above; read back with read_binary()"""
+
+    def __init__(self, out, top=0):
+        self.out = out
+        out.write(MAGIC)
+
+    def write(self, name, stats=None, error=None):
+        name = name.encode("utf-8")[:0xFFFF]
+        if error is not None:
+            message = str(error).encode("utf-8")[:0xFFFF]
+            data = (_HEADER.pack(len(name), FLAG_ERROR, 0, 0) + name +
+                    _LENGTH.pack(len(message)) + message)
+        else:
+            data = b"".join([_HEADER.pack(len(name), 0, stats.words, len(stats.chars)), name] +
+                            [_LETTER.pack(ord(char), count) for char, count in stats.chars.items()])
+        self.out.write(data)
+        self.out.flush()
+
+    def close(self):
+        self.out.flush()
+
+
+def read_binary(f):
+    """Yield (name, words, chars, error) for each record of a binary stream"""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a BookBot binary report")
+    while header := f.read(_HEADER.size):
+        name_length, flags, words, letters = _HEADER.unpack(header)
+        name = f.read(name_length).decode("utf-8")
+        if flags & FLAG_ERROR:
+            length, = _LENGTH.unpack(f.read(_LENGTH.size))
+            yield name, 0, {}, f.read(length).decode("utf-8")
+            continue
+        chars = {}
+        for char, count in _LETTER.iter_unpack(f.read(letters * _LETTER.size)):
+            chars[chr(char)] = count
+        yield name, words, chars, None
+
+
+WRITERS = {"jsonl": JsonLinesWriter, "csv": CsvWriter, "binary": BinaryWriter}
@@ -0,0 +1,254 @@
+from collections import OrderedDict, namedtuple
+
+from bookbot_profile import count, timed
+
+# A position is (line number, column) where column is a character index into
+# the decoded line and always the start of a wrapped row.
+START = (0, 0)
+NO_WRAP = 1 << 30
+
+Page = namedtuple('Page', ['start', 'rows', 'next'])
+
+MAX_WRAPPED_LINES = 4096
+CACHED_PAGES = 32  # prepared pages kept per paginator
+PREFETCH_PAGES = 4  # pages prepared ahead of the reader
+
+
+def wrap_spans(text, width):
+    """Word-wrap one line into (start, end) column spans of at most width chars"""
+    if len(text) <= width:
+        return [(0, len(text))]
+    spans = []
+    start = 0
+    while len(text) - start > width:
+        cut = text.rfind(' ', start, start + width + 1)
+        if cut <= start:
+            # A single word longer than the row is broken mid-word
+            spans.append((start, start + width))
+            start += width
+        else:
+            spans.append((start, cut))
+            start = cut + 1
+    spans.append((start, len(text)))
+    return spans
+
+
+class Paginator:
+    """Splits a Book into pages of wrapped rows for a given width and height.
+
+    Page starts are computed lazily and remembered as pages are visited, so
+    reaching page N costs time proportional to the distance travelled, not
+    to the size of the book. Resizing re-paginates from the current position.
+    Built pages and wrapped lines are kept in LRUs of fixed size, so going
+    back and forth between pages does not wrap the same text again.
+    """
+
+    def __init__(self, book, width, height):
+        self.book = book
+        self.width = max(1, width)
+        self.height = max(1, height)
+        self._wrapped = OrderedDict()  # line -> (text, spans)
+        self._pages = OrderedDict()  # start -> Page
+        self._reset(START)
+
+    def _reset(self, origin):
+        # Known consecutive page starts beginning at origin
+        self._starts = [origin]
+        self._numbers = {origin: 0}
+
+    @timed("paginate.resize")
+    def resize(self, width, height, anchor=None):
+        """Change the page size and re-paginate from anchor (a position)"""
+        width, height = max(1, width), max(1, height)
+        if (width, height) == (self.width, self.height):
+            return anchor
+        if width != self.width:
+            self._wrapped.clear()
+        self._pages.clear()
+        self.width, self.height = width, height
+        anchor = self.row_start(anchor or START)
+        self._reset(anchor)
+        return anchor
+
+    def _has_line(self, line):
+        self.book.index_until(line + 1)
+        return line < len(self.book.line_starts)
+
+    @timed("paginate.wrap")
+    def _spans(self, line):
+        wrapped = self._wrapped.get(line)
+        if wrapped is None:
+            text = self.book.line(line)
+            wrapped = self._wrapped[line] = (text, wrap_spans(text, self.width))
+            if len(self._wrapped) > MAX_WRAPPED_LINES:
+                self._wrapped.popitem(last=False)
+        else:
+            self._wrapped.move_to_end(line)
+        return wrapped
+
+    def row_start(self, pos):
+        """Snap a position to the start of the wrapped row that contains it"""
+        line, col = pos
+        if not self._has_line(line):
+            return START
+        _, spans = self._spans(line)
+        for start, end in reversed(spans):
+            if start <= col:
+                return (line, start)
+        return (line, 0)
+
+    def _iter_rows(self, pos):
+        """Yield (position, text) for each wrapped row from pos to the end"""
+        line, col = pos
+        while self._has_line(line):
+            text, spans = self._spans(line)
+            for start, end in spans:
+                if start >= col:
+                    yield (line, start), text[start:end]
+            line, col = line + 1, 0
+
+    def rows(self, pos, count):
+        """Up to count (position, text) rows from pos, and the position after them"""
+        rows = []
+        for item in self._iter_rows(pos):
+            if len(rows) == count:
+                return rows, item[0]
+            rows.append(item)
+        return rows, None
+
+    def _rows_from(self, pos, count):
+        rows, nxt = self.rows(pos, count)
+        return [text for _, text in rows], nxt
+
+    @timed("paginate.back")
+    def back(self, pos, count):
+        """Position count wrapped rows before pos (or the start of the book)"""
+        line, col = pos
+        found = []
+        while len(found) < count:
+            if col:
+                _, spans = self._spans(line)
+                before = [start for start, _ in spans if start < col]
+                found.extend((line, start) for start in reversed(before))
+            if line == 0:
+                break
+            line -= 1
+            col = NO_WRAP
+        if not found:
+            return START
+        return found[min(count, len(found)) - 1]
+
+    @timed("paginate.page")
+    def page(self, pos=START):
+        """The page of rows starting at pos"""
+        page = self._pages.get(pos)
+        if page is None:
+            rows, nxt = self._rows_from(pos, self.height)
+            page = self._pages[pos] = Page(pos, rows, nxt)
+            if len(self._pages) > CACHED_PAGES:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(pos)
+            count("paginate.page_hits")
+        nxt = page.next
+        if nxt is not None and self._numbers.get(pos) == len(self._starts) - 1:
+            self._numbers[nxt] = len(self._starts)
+            self._starts.append(nxt)
+        return page
+
+    def advance(self, pos, rows):
+        """Position rows wrapped rows after pos, or None past the last row"""
+        if rows <= 0:
+            return pos
+        return self._rows_from(pos, rows)[1]
+
+    def next_start(self, pos):
+        """Start of the page after the one at pos, or None at the end"""
+        number = self._numbers.get(pos)
+        if number is not None and number + 1 < len(self._starts):
+            return self._starts[number + 1]
+        return self.page(pos).next
+
+    def prev_start(self, pos):
+        """Start of the page ending just before pos"""
+        number = self._numbers.get(pos)
+        if number:
+            return self._starts[number - 1]
+        return self.back(pos, self.height)
+
+    def page_number(self, pos):
+        """Zero-based page number of pos, if known"""
+        if self._starts[0] != START:
+            return None
+        return self._numbers.get(pos)
+
+    def goto(self, number):
+        """Start of page number (zero-based), paginating forward as needed"""
+        if self._starts[0] != START:
+            self._reset(START)
+        while len(self._starts) <= number:
+            nxt = self.page(self._starts[-1]).next
+            if nxt is None:
+                break
+        return self._starts[min(number, len(self._starts) - 1)]
+
+
+class Prefetcher:
+    """Prepares the pages ahead of the reader, one page per step().
+
+    plan() is called with the reader's position and direction (1 forward,
+    -1 backward) whenever it may have moved, and step() whenever the reader
+    is idle. Pages are prepared in a chain from where the plan started, so
+    while the reader stays inside that chain, for instance scrolling row by
+    row, each page passed is replaced by one more page further ahead.
+    """
+
+    def __init__(self, paginator, pages=PREFETCH_PAGES):
+        self.paginator = paginator
+        self.pages = pages
+        self.direction = 1
+        self._size = None
+        self._origin = self._cursor = None
+        self._ready = []  # prepared page starts ahead of the reader, nearest first
+        self._done = True
+
+    def plan(self, pos, direction=1):
+        p = self.paginator
+        size = (p.width, p.height)
+        if size == self._size and direction == self.direction and self._covers(pos):
+            self._ready = [s for s in self._ready if (s > pos if direction > 0 else s < pos)]
+            return
+        self._size = size
+        self.direction = direction
+        self._origin = self._cursor = pos
+        self._ready = []
+        self._done = False
+
+    def _covers(self, pos):
+        if self._origin is None:
+            return False
+        if self.direction > 0:
+            return self._origin <= pos and (self._done or pos <= self._cursor)
+        return pos <= self._origin and (self._done or pos >= self._cursor)
+
+    @property
+    def pending(self):
+        return not self._done and len(self._ready) < self.pages
+
+    @timed("paginate.prefetch")
+    def step(self):
+        """Prepare one more page; False once there is nothing left to do"""
+        if not self.pending:
+            return False
+        p = self.paginator
+        if self.direction > 0:
+            nxt = p.next_start(self._cursor)
+        else:
+            nxt = p.prev_start(self._cursor) if self._cursor != START else None
+        if nxt is None:
+            self._done = True
+            return False
+        p.page(nxt)
+        self._ready.append(nxt)
+        self._cursor = nxt
+        return self.pending
@@ -0,0 +1,245 @@
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from functools import wraps
+
+from bookbot_lazy import lazy_import
+
+cProfile = lazy_import("cProfile")
+
+# Set BOOKBOT_PROFILE=1 (or pass --profile) to collect stage timings and
+# counters, reported on exit. Any other value is also a path that a
+# cProfile dump is written to, readable by pstats, snakeviz or flameprof.
+ENABLED = False
+
+_registry = []  # (stage, function) for everything decorated with timed()
+_histograms = {}
+_counters = Counter()
+_lock = threading.Lock()
+_profiler = None
+_dump_path = None
+_null = nullcontext()
+
+
+class Histogram:
+    """Latency histogram with power-of-two microsecond buckets"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = Counter()
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[int(seconds * 1e6).bit_length()] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.buckets.update(other.buckets)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples"""
+        wanted = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= wanted:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+
+def observe(stage, seconds):
+    if not ENABLED:
+        return
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.add(seconds)
+
+
+def count(counter, n=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[counter] += n
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+
+
+def stage(name):
+    """Context manager timing a block; a shared no-op when profiling is off"""
+    return _Stage(name) if ENABLED else _null
+
+
+def _wrap(name, func):
+    @wraps(func)
+    def timed_func(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe(name, time.perf_counter() - start)
+    return timed_func
+
+
+def timed(name):
+    """Decorator timing every call as stage name.
+
+    While profiling is off the function is returned untouched, so it costs
+    nothing; enable() swaps timing wrappers in afterwards, also for copies
+    made by "from module import func".
+    """
+    def decorate(func):
+        _registry.append((name, func))
+        return _wrap(name, func) if ENABLED else func
+    return decorate
+
+
+def _owner(func):
+    """The module or class that holds func under its own name"""
+    owner = sys.modules.get(func.__module__)
+    for part in func.__qualname__.split(".")[:-1]:
+        owner = getattr(owner, part, None)
+    return owner
+
+
+def _install():
+    global ENABLED
+    ENABLED = True
+    wrappers = {}  # id(func) -> (func, wrapper)
+    for name, func in _registry:
+        owner = _owner(func)
+        if owner is not None and owner.__dict__.get(func.__name__) is func:
+            wrappers[id(func)] = func, _wrap(name, func)
+            setattr(owner, func.__name__, wrappers[id(func)][1])
+    # Modules that did "from module import func" hold their own reference
+    for module in list(sys.modules.values()):
+        for attr, value in list(getattr(module, "__dict__", {}).items()):
+            entry = wrappers.get(id(value))
+            if entry and entry[0] is value:
+                setattr(module, attr, entry[1])
+
+
+def enable(dump_path=None):
+    """Start collecting; with dump_path also run cProfile and save it there"""
+    global _profiler, _dump_path
+    if not ENABLED:
+        _install()
+        atexit.register(finish)
+    if dump_path and _profiler is None:
+        _dump_path = dump_path
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def enabled():
+    return ENABLED
+
+
+def init_worker(enabled):
+    """Pool initializer: profile the worker if the parent process is profiling.
+
+    The worker reports nothing itself; its tasks hand their timings back
+    with take() and the parent adds them with merge().
+    """
+    atexit.unregister(finish)
+    with _lock:
+        # A forked worker starts with a copy of the parent's timings
+        _histograms.clear()
+        _counters.clear()
+    if enabled and not ENABLED:
+        _install()
+
+
+def take():
+    """This process's timings since the last take(), or None when not profiling"""
+    if not ENABLED:
+        return None
+    with _lock:
+        taken = dict(_histograms), Counter(_counters)
+        _histograms.clear()
+        _counters.clear()
+    return taken
+
+
+def merge(taken):
+    """Add timings returned by take() in a worker process"""
+    if not taken or not ENABLED:
+        return
+    histograms, counters = taken
+    with _lock:
+        for name, histogram in histograms.items():
+            if name in _histograms:
+                _histograms[name].merge(histogram)
+            else:
+                _histograms[name] = histogram
+        _counters.update(counters)
+
+
+def report(out=None):
+    """Print stage latencies and counters"""
+    out = out or sys.stderr
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+    if histograms:
+        print(f"{'stage':<28}{'calls':>9}{'total ms':>11}{'mean ms':>10}"
+              f"{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}", file=out)
+    for name, h in histograms:
+        print(f"{name:<28}{h.count:>9}{h.total * 1e3:>11.1f}{h.total / h.count * 1e3:>10.3f}"
+              f"{h.percentile(0.5) * 1e3:>9.3f}{h.percentile(0.9) * 1e3:>9.3f}"
+              f"{h.percentile(0.99) * 1e3:>9.3f}{h.max * 1e3:>9.3f}", file=out)
+    for name, value in counters:
+        print(f"{name:<28}{value:>9}", file=out)
+
+
+def finish():
+    """Stop cProfile, save its dump and print the report"""
+    global _profiler
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_dump_path)
+        _profiler = None
+        print(f"cProfile data written to {_dump_path}", file=sys.stderr)
+    report()
+
+
+def add_argument(parser):
+    """The --profile [PATH] option shared by every entry point"""
+    parser.add_argument("--profile", nargs="?", const="", default=None, metavar="PATH",
+                        help="report stage timings on exit; with PATH also save a cProfile dump")
+
+
+def enable_from(args):
+    if args.profile is not None:
+        enable(args.profile or None)
+
+
+def _from_environment():
+    value = os.environ.get("BOOKBOT_PROFILE", "")
+    if value and value.lower() not in ("0", "false", "no"):
+        enable(None if value.lower() in ("1", "true", "yes") else value)
+
+
+_from_environment()
@@ -1,118 +1,664 @@
-import curses
+import argparse
 import os
 from pathlib import Path
+import queue
 import time
 
+from bookbot_book import BookLoader, open_cached
+from bookbot_cache import AnalysisCache
+from bookbot_catalog import Catalog, info_line, title_line
+from bookbot_client import RemoteBook, ServerError, connect
+from bookbot_library import Library
+from bookbot_paginate import NO_WRAP, START, Paginator, Prefetcher
+from bookbot_profile import add_argument, count, enable_from, observe, stage, timed
+from bookbot_state import StateStore
+from bookbot_lazy import lazy_import
+
+curses = lazy_import("curses")
+bookbot_search = lazy_import("bookbot_search")  # only needed once the user searches
+
+# Rows per second for each auto-scroll speed setting (1-10)
+SCROLL_SPEEDS = (0.5, 1, 1.5, 2, 3, 4, 6, 8, 12, 20)
+MAX_CATCH_UP = 1.0  # seconds of missed ticks replayed after a stall
+
+class ScrollScheduler:
+    """Ticks at a steady rate against a monotonic deadline.
+
+    Each deadline is the previous one plus the tick period, so time spent
+    rendering does not add up into drift. The main loop sleeps in getch()
+    for timeout_ms() and asks due() how many ticks to apply when it wakes.
+    """
+
+    def __init__(self, rate, clock=time.monotonic):
+        self.clock = clock
+        self.rate = rate
+        self.deadline = None
+        self.dropped = 0
+
+    def start(self):
+        self.deadline = self.clock() + 1 / self.rate
+
+    def stop(self):
+        self.deadline = None
+
+    def set_rate(self, rate):
+        self.rate = rate
+        if self.deadline is not None:
+            self.deadline = self.clock() + 1 / rate
+
+    def timeout_ms(self):
+        """Milliseconds until the next tick is due"""
+        return max(0, int((self.deadline - self.clock()) * 1000 + 0.999))
+
+    def due(self):
+        """Number of ticks that have come due since the last call"""
+        now = self.clock()
+        if self.deadline is None or now < self.deadline:
+            return 0
+        period = 1 / self.rate
+        ticks = 1 + int((now - self.deadline) * self.rate)
+        limit = max(1, int(MAX_CATCH_UP * self.rate))
+        if ticks > limit:
+            # After a long stall resume from now rather than racing ahead
+            self.dropped += ticks - limit
+            count("scroll.dropped_ticks", ticks - limit)
+            ticks = limit
+            self.deadline = now + period
+        else:
+            self.deadline += ticks * period
+        return ticks
+
 class BookReader:
-    def __init__(self):
+    """The book, position, search and settings behind the terminal reader.
+
+    cache and state default to the user's own stores; with server=False the
+    reader never uses a book server.
+    """
+
+    def __init__(self, cache=None, state=None, server=True):
         self.books = []
         self.current_book = None
-        self.current_text = ""
-        self.current_pos = 0
+        self.book = None
+        self.current_pos = START  # (line, column) of the top row
+        self.cache = cache or AnalysisCache()
+        self.state = state or StateStore()  # reading positions and settings
+        self.client = connect() if server else None  # the shared book server, if one is running
+        self.paginator = None
+        self.prefetcher = None
+        self.direction = 1  # reading direction, for the prefetcher
+        self.loader = None
+        self.load_events = queue.Queue()
+        self.load_progress = 1.0
+        self.load_error = None
         self.auto_scroll = False
-        self.scroll_speed = 1
+        self.scroll_speed = min(max(self.state.get("reader.scroll_speed", 1), 1), len(SCROLL_SPEEDS))
         self.page_size = 20  # lines per page
+        self.searcher = None  # SearchLoader of the search under way
+        self.search_events = queue.Queue()
+        self.search_progress = (0, 0)  # (books indexed, books to search)
+        self.hits = []  # search hits in the current book
+        self.hit_idx = -1
+        self.pending_offset = None  # byte offset to show once the book opens
+        self._saved_pos = None  # current_pos as last handed to the state store
         
+    @timed("load.reader")
     def load_book(self, filepath):
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                self.current_text = f.read()
-                self.current_pos = 0
-                self.books.append(filepath)
-                self.current_book = filepath
-                return True
+            book, _ = open_cached(self.cache, filepath)
         except Exception as e:
             return False
+        self._set_book(filepath, book)
+        self.pending_offset = self.state.position(filepath)
+        return True
 
-    def get_current_page(self, height):
-        lines = self.current_text.split('\n')
-        start = self.current_pos
-        end = min(start + height - 4, len(lines))
-        return lines[start:end]
+    def _set_book(self, filepath, book):
+        if self.book:
+            self.book.close()
+        self.book = book
+        self.current_pos = START
+        self._saved_pos = None
+        self.paginator = None
+        self.prefetcher = None
+        self.direction = 1
+        self.books.append(filepath)
+        self.current_book = filepath
 
-    def next_page(self, height):
-        lines = self.current_text.split('\n')
-        self.current_pos = min(self.current_pos + height - 4, len(lines) - (height - 4))
+    def start_loading(self, filepath, offset=None, local=False):
+        """Open a book on a worker thread; poll_loading() picks up the result.
+
+        local opens it here even while a book server is running.
+        """
+        self.pending_offset = offset
+        self.hits = []
+        self.hit_idx = -1
+        if self.loader:
+            self.loader.cancel()
+        if self.book:
+            self.book.close()
+            self.book = None
+            self.paginator = None
+            self.prefetcher = None
+        self.current_book = filepath
+        self.load_progress = 0.0
+        self.load_error = None
+        self.loader = BookLoader(filepath, events=self.load_events,
+                                 client=None if local else self.client)
+        self.loader.start()
+
+    def poll_loading(self):
+        """Apply whatever the loader thread has reported since the last call"""
+        while True:
+            try:
+                loader, kind, value = self.load_events.get_nowait()
+            except queue.Empty:
+                return
+            if loader is not self.loader:
+                # Left over from a book the user already moved away from
+                if kind == 'opened':
+                    value.close()
+                continue
+            if kind == 'opened':
+                self._set_book(loader.path, value)
+                if self.pending_offset is None:
+                    self.pending_offset = self.state.position(loader.path)
+            elif kind == 'progress':
+                self.load_progress = value
+            elif kind == 'done':
+                self.load_progress = 1.0
+                self.loader = None
+            elif kind == 'error' and loader.client and isinstance(value, ConnectionError):
+                self.drop_client()
+            elif kind == 'error' and loader.client and isinstance(value, ServerError):
+                self.start_loading(loader.path, self.pending_offset, local=True)
+            elif kind == 'error':
+                self.load_error = value
+                self.loader = None
 
-    def prev_page(self, height):
-        self.current_pos = max(0, self.current_pos - (height - 4))
+    def drop_client(self):
+        """Go on without the book server, e.g. once it stops answering.
+
+        A book it had open (or was opening) is opened again locally, at the
+        last saved position.
+        """
+        if self.client:
+            self.client.close()
+            self.client = None
+        remote = isinstance(self.book, RemoteBook) or (self.loader and self.loader.client)
+        if self.current_book and remote:
+            self.start_loading(self.current_book, self.pending_offset)
+
+    def save_position(self):
+        """Note where the reader is; the state store writes it out later"""
+        if self.book and self.pending_offset is None and self._saved_pos != self.current_pos:
+            self._saved_pos = self.current_pos
+            self.state.set_position(self.current_book, self.book.offset(self.current_pos))
+
+    def set_scroll_speed(self, speed):
+        self.scroll_speed = min(max(speed, 1), len(SCROLL_SPEEDS))
+        self.state.set("reader.scroll_speed", self.scroll_speed)
+
+    def close(self):
+        self.save_position()
+        self.state.close()
+        self.cache.close()
+        if self.loader:
+            self.loader.cancel()
+        self.cancel_search()
+        if self.book:
+            self.book.close()
+            self.book = None
+        if self.client:
+            self.client.close()
+
+    @property
+    def loading(self):
+        return self.loader is not None
+
+    def _paginate(self, height, width):
+        """Paginator for the text area of a height x width terminal"""
+        rows, cols = max(1, height - 4), max(1, width - 1) if width else NO_WRAP
+        if self.paginator is None:
+            self.paginator = Paginator(self.book, cols, rows)
+            self.prefetcher = Prefetcher(self.paginator)
+        elif (cols, rows) != (self.paginator.width, self.paginator.height):
+            # Re-wrap from where the reader is instead of from the top
+            self.current_pos = self.paginator.resize(cols, rows, self.current_pos)
+        return self.paginator
+
+    def get_current_page(self, height, width=None):
+        return self._paginate(height, width).page(self.current_pos).rows
+
+    def next_page(self, height, width=None):
+        if not self.book:
+            return
+        self.direction = 1
+        nxt = self._paginate(height, width).next_start(self.current_pos)
+        if nxt is not None:
+            self.current_pos = nxt
+
+    def prev_page(self, height, width=None):
+        if not self.book:
+            return
+        self.direction = -1
+        self.current_pos = self._paginate(height, width).prev_start(self.current_pos)
+
+    def scroll_rows(self, rows, height, width=None):
+        """Move down by rows wrapped rows; False once the last page is reached"""
+        if not self.book:
+            return False
+        self.direction = 1
+        paginator = self._paginate(height, width)
+        for _ in range(rows):
+            nxt = paginator.advance(self.current_pos, 1)
+            # Stop when the last row of the book reaches the bottom of the screen
+            if nxt is None or paginator.advance(nxt, paginator.height - 1) is None:
+                return False
+            self.current_pos = nxt
+        return True
+
+    def prefetch(self):
+        """Prepare one page ahead of the reader; False when there is nothing to do"""
+        if not self.prefetcher or self.pending_offset is not None:
+            return False
+        self.prefetcher.plan(self.current_pos, self.direction)
+        return self.prefetcher.step()
+
+    def scroll_rate(self):
+        return SCROLL_SPEEDS[self.scroll_speed - 1]
+
+    def start_search(self, query, books, limit=1000):
+        """Search books on a worker thread, indexing any that are new or changed"""
+        self.cancel_search()
+        self.search_progress = (0, len(books))
+        self.searcher = bookbot_search.SearchLoader(query, books, limit, events=self.search_events,
+                                                    client=self.client)
+        self.searcher.start()
+
+    def cancel_search(self):
+        if self.searcher:
+            self.searcher.cancel()
+            self.searcher = None
+
+    def poll_search(self):
+        """Hits of the search under way once it is done, else None"""
+        while True:
+            try:
+                searcher, kind, value = self.search_events.get_nowait()
+            except queue.Empty:
+                return None
+            if searcher is not self.searcher:
+                continue  # a cancelled search
+            if kind == 'progress':
+                self.search_progress = value
+                continue
+            self.searcher = None
+            if self.client and self.client.lost:
+                self.drop_client()
+            if kind == 'error':
+                raise value
+            return value
+
+    def goto_offset(self, offset, height, width=None):
+        """Move to the row containing byte offset"""
+        if not self.book:
+            return
+        self.current_pos = self._paginate(height, width).row_start(self.book.position(offset))
+
+    def show_hits(self, hits, height, width=None):
+        """Jump to the first of hits (in the current book) from here on"""
+        if not self.book:
+            return 0
+        self.hits = hits
+        self.hit_idx = -1
+        if self.hits:
+            here = self.book.line_starts[self.current_pos[0]]
+            later = [i for i, hit in enumerate(self.hits) if hit.offset >= here]
+            self.hit_idx = later[0] if later else 0
+            self.goto_offset(self.hits[self.hit_idx].offset, height, width)
+        return len(self.hits)
+
+    def next_hit(self, step, height, width=None):
+        if self.hits:
+            self.hit_idx = (self.hit_idx + step) % len(self.hits)
+            self.goto_offset(self.hits[self.hit_idx].offset, height, width)
+
+class ScreenBuffer:
+    """Keeps the last frame on screen and rewrites only the rows that changed.
+
+    A frame is a list with one entry per screen row, each a list of
+    (x, text, attr) segments. Nothing is cleared between frames, so an
+    unchanged row costs nothing to send.
+    """
+
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.height, self.width = stdscr.getmaxyx()
+        self.rows = [()] * self.height
+        # Let curses move shifted text with terminal scroll/insert-line codes
+        stdscr.idlok(True)
+
+    def resize(self):
+        """Pick up a new terminal size after KEY_RESIZE"""
+        curses.update_lines_cols()
+        self.height, self.width = self.stdscr.getmaxyx()
+        self.rows = [()] * self.height
+        self.stdscr.clear()
+
+    def new_frame(self):
+        return [[] for _ in range(self.height)]
+
+    def _shift(self, frame, top, bottom):
+        """How many rows [top, bottom) moved up (positive) or down (negative)"""
+        old, new = self.rows, frame
+        for k in range(1, (bottom - top) // 2 + 1):
+            if old[top + k:bottom] == new[top:bottom - k]:
+                return k
+            if old[top:bottom - k] == new[top + k:bottom]:
+                return -k
+        return 0
+
+    @timed("render.draw")
+    def draw(self, frame, scroll_region=None):
+        """Show frame; rows inside scroll_region (top, bottom) may be scrolled"""
+        stdscr = self.stdscr
+        frame = [tuple(row) for row in frame]
+        if scroll_region:
+            top, bottom = scroll_region
+            shift = self._shift(frame, top, bottom)
+            if shift:
+                stdscr.setscrreg(top, bottom - 1)
+                stdscr.scrollok(True)
+                stdscr.scroll(shift)
+                stdscr.scrollok(False)
+                stdscr.setscrreg(0, self.height - 1)
+                kept = self.rows[top + shift:bottom] if shift > 0 else self.rows[top:bottom + shift]
+                blank = [()] * abs(shift)
+                self.rows[top:bottom] = kept + blank if shift > 0 else blank + kept
+        for y, row in enumerate(frame):
+            if row == self.rows[y]:
+                continue
+            stdscr.move(y, 0)
+            stdscr.clrtoeol()
+            for x, text, attr in row:
+                text = text[:max(0, self.width - 1 - x)]
+                if text:
+                    stdscr.addstr(y, x, text, attr)
+        self.rows = frame
+        stdscr.noutrefresh()
+        curses.doupdate()
 
 class BookBotUI:
     def __init__(self):
         self.reader = BookReader()
-        self.mode = "page"  # "page" or "scroll"
+        self.mode = self.reader.state.get("reader.mode", "page")  # "page" or "scroll"
         self.books_dir = Path("books")
+        self.books = Library(self.books_dir)
+        self.catalog = Catalog(self.books)
+        self.filter = ""  # typed in the menu to narrow the list by title and author
+        self._matches = None  # catalog ids that match the filter
+        self._looked_up = set()  # books whose word count was sought in the analysis cache
+        self.screen = None
+        self.results = None  # library search hits shown instead of the book list
+        self.query = ""
+        self.message = ""
+
+    def _screen(self, stdscr):
+        if self.screen is None or self.screen.stdscr is not stdscr:
+            self.screen = ScreenBuffer(stdscr)
+        return self.screen
+
+    def prompt(self, stdscr, label):
+        """Read a line of input on the bottom row"""
+        screen = self._screen(stdscr)
+        y = screen.height - 1
+        stdscr.move(y, 0)
+        stdscr.clrtoeol()
+        stdscr.addstr(y, 0, label[:screen.width - 1])
+        stdscr.timeout(-1)
+        curses.echo()
+        curses.curs_set(1)
+        try:
+            text = stdscr.getstr(y, min(len(label), screen.width - 1)).decode('utf-8', 'replace')
+        finally:
+            curses.noecho()
+            curses.curs_set(0)
+        # The prompt row is no longer what the buffer thinks it is
+        screen.rows[y] = None
+        return text.strip()
+
+    def search(self, stdscr, query, books, limit=1000):
+        """Hits for query in books, or None if the search was cancelled with Esc.
+
+        The search runs on a worker thread; meanwhile the bottom row counts
+        off the books brought up to date in the search index.
+        """
+        screen = self._screen(stdscr)
+        self.reader.start_search(query, books, limit)
+        stdscr.timeout(100)
+        while True:
+            hits = self.reader.poll_search()
+            if hits is not None:
+                return hits
+            done, total = self.reader.search_progress
+            status = f"Searching... {done}/{total} books indexed | Esc: Cancel"
+            y = screen.height - 1
+            stdscr.move(y, 0)
+            stdscr.clrtoeol()
+            stdscr.addstr(y, 0, status[:screen.width - 1])
+            screen.rows[y] = None  # see prompt()
+            stdscr.refresh()
+            if stdscr.getch() == 27:
+                self.reader.cancel_search()
+                return None
+
+    def library(self):
+        self.books.refresh()
+        return self.books.paths()
+
+    def matches(self):
+        """Catalog ids of the books that match the filter, in title order"""
+        if self.catalog.refresh() or self._matches is None:
+            self._matches = self.catalog.search(self.filter)
+        return self._matches
+
+    def set_filter(self, text):
+        self.filter = text
+        self._matches = None
+
+    def draw_results(self, stdscr, selected_idx):
+        """Search hits across the library, one per row"""
+        screen = self._screen(stdscr)
+        height, width = screen.height, screen.width
+        frame = screen.new_frame()
+        header = f"{len(self.results)} matches for '{self.query}'"
+        frame[0].append((max((width - len(header)) // 2, 0), header, curses.A_BOLD))
+        if self.message and height > 1:
+            frame[1].append((2, self.message[:width-4], 0))
+        rows = max(1, height - 3)
+        first = selected_idx - selected_idx % rows
+        # Rows start under the header; a terminal this short only has room for that
+        shown = self.results[first:first + rows] if height > 2 else []
+        for idx, hit in enumerate(shown, first):
+            prefix = ">" if idx == selected_idx else " "
+            name = Path(hit.path).name
+            text = f"{prefix} {name}: {bookbot_search.snippet(hit, max(10, width - len(name) - 8))}"
+            frame[idx - first + 2].append((2, text[:width-4], 0))
+        footer = "↑/↓: Select | Enter: Open at match | Esc: Books | q: Quit"
+        if height > 5:
+            frame[height-1].append((0, footer, 0))
+        screen.draw(frame)
+        return self.results
 
     def draw_menu(self, stdscr, selected_idx):
-        height, width = stdscr.getmaxyx()
-        stdscr.clear()
+        screen = self._screen(stdscr)
+        height, width = screen.height, screen.width
+        frame = screen.new_frame()
         
         # Draw header
         header = "BookBot Reader"
-        stdscr.addstr(0, (width - len(header)) // 2, header, curses.A_BOLD)
+        frame[0].append((max((width - len(header)) // 2, 0), header, curses.A_BOLD))
         
-        # Draw available books
-        books = list(self.books_dir.glob("*.txt"))
-        for idx, book in enumerate(books):
-            y = idx + 2
-            if y < height - 1:
-                prefix = ">" if idx == selected_idx else " "
-                text = f"{prefix} {book.name}"
-                stdscr.addstr(y, 2, text[:width-4])
+        # Only the screenful of matches around the selection is looked up
+        books = self.matches()
+        if self.message and height > 1:
+            frame[1].append((2, self.message[:width-4], 0))
+        elif self.filter and height > 1:
+            status = f"Filter: {self.filter}  ({len(books)} of {len(self.catalog)})"
+            frame[1].append((2, status[:width-4], 0))
+        rows = max(1, height - 3)
+        first = selected_idx - selected_idx % rows
+        shown = books[first:first + rows] if height > 2 else []
+        for idx, entry in enumerate(self.catalog.rows(shown), first):
+            if entry.words is None and entry.path not in self._looked_up:
+                self._looked_up.add(entry.path)
+                cached = self.reader.cache.get(entry.path)
+                if cached:
+                    self.books.set_words(entry.path, cached.words)
+                    entry = entry._replace(words=cached.words)
+            prefix = ">" if idx == selected_idx else " "
+            info = info_line(entry)
+            name = f"{prefix} {title_line(entry)}"
+            gap = width - 4 - len(name) - len(info)
+            text = name + " " * gap + info if gap > 1 else name
+            frame[idx - first + 2].append((2, text[:width-4], 0))
+        self.books.save()
         
         # Draw footer
-        footer = "↑/↓: Select | Enter: Open | q: Quit"
+        footer = "↑/↓/PgUp/PgDn: Select | Enter: Open | Type: Filter | /: Search | q: Quit"
         if height > 5:
-            stdscr.addstr(height-1, 0, footer[:width-1])
+            frame[height-1].append((0, footer, 0))
         
-        stdscr.refresh()
+        screen.draw(frame)
         return books
 
     def draw_reader(self, stdscr):
-        height, width = stdscr.getmaxyx()
         while True:
-            stdscr.clear()
+            try:
+                return self._draw_reader(stdscr)
+            except (ConnectionError, ServerError):
+                if not isinstance(self.reader.book, RemoteBook):
+                    raise
+                # The book server failed while paging: read on without it
+                self.reader.drop_client()
+
+    def _draw_reader(self, stdscr):
+        screen = self._screen(stdscr)
+        scheduler = ScrollScheduler(self.reader.scroll_rate())
+        if self.mode == "scroll":
+            scheduler.start()
+        while True:
+            height, width = screen.height, screen.width
+            self.reader.poll_loading()
+            if self.reader.load_error:
+                name = Path(self.reader.current_book).name
+                self.message = f"Could not open {name}: {self.reader.load_error}"
+                return 'menu'
+            if self.reader.book and self.reader.pending_offset is not None:
+                self.reader.goto_offset(self.reader.pending_offset, height, width)
+                self.reader.pending_offset = None
+            frame_start = time.perf_counter()
+            if self.mode == "scroll":
+                ticks = scheduler.due()
+                if ticks:
+                    count("scroll.ticks", ticks)
+                    with stage("scroll.step"):
+                        scrolled = self.reader.scroll_rows(ticks, height, width)
+                    if not scrolled:
+                        # Reached the end of the book
+                        self.mode = "page"
+                        scheduler.stop()
+            frame = screen.new_frame()
             
             # Draw header
             if self.reader.current_book:
                 header = f"Reading: {Path(self.reader.current_book).name}"
                 mode_info = f"Mode: {'Auto-scroll' if self.mode == 'scroll' else 'Page'}"
-                stdscr.addstr(0, 0, header[:width-1], curses.A_BOLD)
-                stdscr.addstr(0, max(width - len(mode_info) - 1, 0), mode_info)
+                if self.mode == "scroll":
+                    mode_info += f" ({self.reader.scroll_rate():g} rows/s)"
+                if self.reader.loading:
+                    mode_info = f"Indexing {self.reader.load_progress:.0%} | {mode_info}"
+                if self.reader.hits:
+                    mode_info = f"Match {self.reader.hit_idx + 1}/{len(self.reader.hits)} | {mode_info}"
+                elif self.message:
+                    mode_info = f"{self.message} | {mode_info}"
+                frame[0].append((0, header, curses.A_BOLD))
+                frame[0].append((max(width - len(mode_info) - 1, 0), mode_info, 0))
             
             # Draw content
-            if self.reader.current_text:
-                current_page = self.reader.get_current_page(height)
+            if self.reader.book:
+                current_page = self.reader.get_current_page(height, width)
                 for idx, line in enumerate(current_page):
                     if idx + 2 < height - 1:
-                        stdscr.addstr(idx + 2, 0, line[:width-1])
+                        frame[idx + 2].append((0, line, 0))
+            elif self.reader.loading and height > 2:
+                frame[2].append((0, "Loading...", 0))
             
             # Draw footer
-            footer = "←/→: Page | s: Toggle Scroll | +/-: Speed | m: Menu | q: Quit"
-            stdscr.addstr(height-1, 0, footer[:width-1])
+            footer = "←/→: Page | s: Toggle Scroll | +/-: Speed | /: Find | n/N: Next/Prev | m: Menu | q: Quit"
+            frame[height-1].append((0, footer, 0))
             
-            stdscr.refresh()
+            screen.draw(frame, scroll_region=(2, height - 1))
+            observe("render.frame", time.perf_counter() - frame_start)
             
-            if self.mode == "scroll" and self.reader.current_text:
-                time.sleep(1 / self.reader.scroll_speed)
-                self.reader.next_page(height)
-                continue
+            self.reader.save_position()
+            self.reader.state.tick()
+
+            # Prepare the next pages while no key is waiting
+            key = -1
+            stdscr.timeout(0)
+            while key == -1 and self.reader.prefetch():
+                key = stdscr.getch()
             
-            key = stdscr.getch()
-            if key == ord('q'):
-                break
+            # Sleep in getch until the next tick so keys are handled while scrolling
+            if self.mode == "scroll" and self.reader.book:
+                timeout = scheduler.timeout_ms()
+            elif self.reader.loading:
+                timeout = 100  # Keep the indexing progress moving
+            else:
+                timeout = -1
+            due = self.reader.state.due_in()
+            if due is not None:
+                # Wake up to write the saved position even if no key comes
+                due_ms = int(due * 1000) + 1
+                timeout = due_ms if timeout < 0 else min(timeout, due_ms)
+            if key == -1:
+                stdscr.timeout(timeout)
+                key = stdscr.getch()
+            if key != -1:
+                self.message = ""
+            if key == curses.KEY_RESIZE:
+                # Only the screen is reset; the paginator re-wraps from the current page
+                screen.resize()
+            elif key == ord('q'):
+                return 'quit'
             elif key == ord('m'):
                 return 'menu'
             elif key == ord('s'):
                 self.mode = "scroll" if self.mode == "page" else "page"
+                self.reader.state.set("reader.mode", self.mode)
+                if self.mode == "scroll":
+                    scheduler.start()
+                else:
+                    scheduler.stop()
             elif key == ord('+') or key == ord('='):
-                self.reader.scroll_speed = min(10, self.reader.scroll_speed + 1)
+                self.reader.set_scroll_speed(self.reader.scroll_speed + 1)
+                scheduler.set_rate(self.reader.scroll_rate())
             elif key == ord('-'):
-                self.reader.scroll_speed = max(1, self.reader.scroll_speed - 1)
+                self.reader.set_scroll_speed(self.reader.scroll_speed - 1)
+                scheduler.set_rate(self.reader.scroll_rate())
             elif key == curses.KEY_RIGHT and self.mode == "page":
-                self.reader.next_page(height)
+                self.reader.next_page(height, width)
             elif key == curses.KEY_LEFT and self.mode == "page":
-                self.reader.prev_page(height)
+                self.reader.prev_page(height, width)
+            elif key == ord('/') and self.reader.book:
+                query = self.prompt(stdscr, "Find: ")
+                hits = self.search(stdscr, query, [self.reader.current_book], limit=None) if query else None
+                if hits is not None and not self.reader.show_hits(hits, height, width):
+                    self.message = f"No matches for '{query}'"
+            elif key == ord('n'):
+                self.reader.next_hit(1, height, width)
+            elif key == ord('N'):
+                self.reader.next_hit(-1, height, width)
 
     def main(self, stdscr):
         # Setup
@@ -124,28 +670,73 @@ class BookBotUI:
         
         while True:
             if current_view == 'menu':
-                books = self.draw_menu(stdscr, selected_idx)
+                if self.results is not None:
+                    books = self.draw_results(stdscr, selected_idx)
+                else:
+                    books = self.draw_menu(stdscr, selected_idx)
                 
+                stdscr.timeout(-1)  # the reader may have left a timeout set
                 key = stdscr.getch()
-                if key == ord('q'):
+                self.message = ""
+                filtering = self.results is None and self.filter
+                if key == curses.KEY_RESIZE:
+                    self.screen.resize()
+                elif key == ord('q') and not filtering:
                     break
-                elif key == curses.KEY_UP:
+                elif key == curses.KEY_UP and books:
                     selected_idx = (selected_idx - 1) % len(books)
-                elif key == curses.KEY_DOWN:
+                elif key == curses.KEY_DOWN and books:
                     selected_idx = (selected_idx + 1) % len(books)
+                elif key in (curses.KEY_NPAGE, curses.KEY_PPAGE) and books:
+                    step = max(1, self.screen.height - 3)
+                    step = step if key == curses.KEY_NPAGE else -step
+                    selected_idx = min(max(selected_idx + step, 0), len(books) - 1)
+                elif key == ord('/') and not filtering:
+                    query = self.prompt(stdscr, "Search library: ")
+                    results = self.search(stdscr, query, self.library()) if query else None
+                    if results is not None:
+                        self.query = query
+                        self.results = results
+                        selected_idx = 0
+                elif key == 27 and self.results is not None:  # Esc
+                    self.results = None
+                    selected_idx = 0
+                elif key == 27 and self.filter:
+                    self.set_filter("")
+                    selected_idx = 0
+                elif key in (curses.KEY_BACKSPACE, 127, 8) and filtering:
+                    self.set_filter(self.filter[:-1])
+                    selected_idx = 0
+                elif self.results is None and 32 <= key < 127:
+                    self.set_filter(self.filter + chr(key))
+                    selected_idx = 0
                 elif key == 10:  # Enter key
-                    if books:
-                        if self.reader.load_book(books[selected_idx]):
+                    if books and self.results is not None:
+                        hit = books[selected_idx]
+                        self.reader.start_loading(hit.path, offset=hit.offset)
+                        current_view = 'reader'
+                    elif books:
+                        for entry in self.catalog.rows(books[selected_idx:selected_idx + 1]):
+                            self.reader.start_loading(entry.path)
                             current_view = 'reader'
             
             elif current_view == 'reader':
                 result = self.draw_reader(stdscr)
                 if result == 'menu':
+                    self.reader.state.flush()
                     current_view = 'menu'
+                elif result == 'quit':
+                    break
 
 def main():
+    parser = argparse.ArgumentParser(description="Terminal book reader")
+    add_argument(parser)
+    enable_from(parser.parse_args())
     app = BookBotUI()
-    curses.wrapper(app.main)
+    try:
+        curses.wrapper(app.main)
+    finally:
+        app.reader.close()
 
 if __name__ == "__main__":
     main()
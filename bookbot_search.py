@@ -0,0 +1,368 @@
+import os
+import queue
+import re
+import sqlite3
+import threading
+from array import array
+from collections import namedtuple
+from itertools import accumulate, repeat
+from pathlib import Path
+
+from bookbot_analyzer import CHUNK_SIZE, iter_chunks, iter_decoded
+from bookbot_cache import default_cache_dir
+from bookbot_client import ServerError
+from bookbot_compressed import open_book, read_range
+from bookbot_encoding import detect_file, skip_bom
+
+WORD = re.compile(r"\w+")
+
+# offset is the byte offset of the first word of the match in the book
+Hit = namedtuple("Hit", ["path", "offset", "length"])
+
+
+def tokenize(text):
+    """Search terms of a query, in order"""
+    return [word.lower() for word in WORD.findall(text)]
+
+
+def snippet(hit, width=60, encoding=None):
+    """A line of text around a hit, for result lists"""
+    encoding = encoding or detect_file(hit.path)
+    before = width // 3
+    start = max(0, hit.offset - before)
+    data = read_range(hit.path, start, start + width + before)
+    text = data.decode(encoding, "replace").replace("\r", " ").replace("\n", " ")
+    # Drop a partial character cut at either end
+    return text.strip("\ufffd")[:width]
+
+
+def encode_postings(words, offsets, lengths=None):
+    """Delta encode word numbers and byte offsets into one blob.
+
+    Both delta streams use the narrowest array type that fits them, named by
+    the first byte, so decoding is a frombytes() and two running sums.
+    lengths, the byte length of every occurrence, is only needed when some
+    differ from the term's own (its case changed the length); it is stored
+    as a third stream, after a "+" byte.
+    """
+    deltas = [b - a for a, b in zip([0] + words[:-1], words)]
+    deltas += [b - a for a, b in zip([0] + offsets[:-1], offsets)]
+    if lengths is not None:
+        deltas += lengths
+    largest = max(deltas, default=0)
+    for typecode in "BHIQ":
+        if largest < 1 << (8 * array(typecode).itemsize):
+            break
+    flag = b"+" if lengths is not None else b""
+    return flag + typecode.encode() + array(typecode, deltas).tobytes()
+
+
+def decode_postings(data):
+    """Inverse of encode_postings(): (word numbers, byte offsets, lengths or None)"""
+    has_lengths = data[:1] == b"+"
+    if has_lengths:
+        data = data[1:]
+    deltas = array(chr(data[0]))
+    deltas.frombytes(data[1:])
+    n = len(deltas) // (3 if has_lengths else 2)
+    return (list(accumulate(deltas[:n])), list(accumulate(deltas[n:2 * n])),
+            deltas[2 * n:].tolist() if has_lengths else None)
+
+
+def byte_length(text, encoding):
+    """Length of text encoded on its own, without the BOM some codecs add"""
+    return len(text.encode(encoding)) - len("".encode(encoding))
+
+
+class _Postings:
+    """Positions of one term in one book, collected during a scan"""
+
+    __slots__ = ("words", "offsets", "length", "lengths")
+
+    def __init__(self, length):
+        self.words = array("Q")
+        self.offsets = array("Q")
+        self.length = length  # bytes of the term itself in the book's encoding
+        self.lengths = None  # bytes of each occurrence, once one differs
+
+    def add(self, word, offset, length):
+        if length != self.length and self.lengths is None:
+            self.lengths = array("Q", [self.length]) * len(self.words)
+        self.words.append(word)
+        self.offsets.append(offset)
+        if self.lengths is not None:
+            self.lengths.append(length)
+
+    def encode(self):
+        lengths = self.lengths.tolist() if self.lengths is not None else None
+        return encode_postings(self.words.tolist(), self.offsets.tolist(), lengths)
+
+
+def scan_book(path, encoding="utf-8", chunk_size=CHUNK_SIZE):
+    """Term -> _Postings for every word in a book, in one streaming pass"""
+    postings = {}
+    word_number = 0
+    carry = ""
+    with open_book(path) as f:
+        # A BOM is not text, but still counts towards byte offsets
+        encoding, pos = skip_bom(f, encoding)  # pos: byte offset of the start of text
+        decoded = iter_decoded(iter_chunks(f, chunk_size), encoding)
+        for text, raw in _with_final(decoded):
+            final = text is None
+            text = carry + (text or "")
+            # A word at the very end may continue in the next chunk
+            matches = list(WORD.finditer(text))
+            if matches and not final and matches[-1].end() == len(text):
+                cut = matches.pop().start()
+            else:
+                cut = len(text)
+            # Byte offsets follow character offsets one-to-one for clean chunks
+            one_to_one = raw is not None and not carry
+            byte, char = pos, 0
+            for m in matches:
+                start = m.start()
+                if one_to_one:
+                    offset = pos + start
+                else:
+                    byte += len(text[char:start].encode(encoding))
+                    char = start
+                    offset = byte
+                word = m.group()
+                term = word.lower()
+                entry = postings.get(term)
+                if entry is None:
+                    entry = postings[term] = _Postings(byte_length(term, encoding))
+                if word == term or word.isascii():
+                    entry.add(word_number, offset, entry.length)
+                else:
+                    entry.add(word_number, offset, byte_length(word, encoding))
+                word_number += 1
+            carry = text[cut:]
+            pos += len(text[:cut].encode(encoding)) if not one_to_one else cut
+    return postings, word_number
+
+
+def _with_final(decoded):
+    for text, raw in decoded:
+        yield text, raw
+    yield None, None
+
+
+class SearchIndex:
+    """Positional inverted index of a library of books, kept in SQLite.
+
+    For every term and book the index stores the word number and byte
+    offset of each occurrence, delta encoded, and its byte length where that
+    is not the term's own. Word numbers make phrase queries exact; byte
+    offsets let a reader jump straight to a hit.
+    update() only rescans books whose size or mtime changed.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else default_cache_dir() / "search.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS books (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                encoding TEXT NOT NULL,
+                words INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                book INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                positions BLOB NOT NULL,
+                PRIMARY KEY (term, book)
+            );
+            CREATE INDEX IF NOT EXISTS postings_book ON postings (book);
+        """)
+
+    def _book_id(self, path):
+        row = self.db.execute("SELECT id FROM books WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def is_current(self, book):
+        path = os.path.realpath(book)
+        st = os.stat(path)
+        row = self.db.execute(
+            "SELECT size, mtime_ns FROM books WHERE path = ?", (path,)).fetchone()
+        return row == (st.st_size, st.st_mtime_ns)
+
+    def add(self, book, encoding=None):
+        """(Re)index one book, detecting its encoding unless one is given"""
+        path = os.path.realpath(book)
+        st = os.stat(path)
+        encoding = encoding or detect_file(path)
+        try:
+            postings, words = scan_book(path, encoding)
+        except UnicodeDecodeError:
+            # A stray byte the samples missed. Every byte is a Latin-1
+            # character, so offsets still line up
+            encoding = "latin-1"
+            postings, words = scan_book(path, encoding)
+        with self.db:
+            self._remove(path)
+            cur = self.db.execute(
+                "INSERT INTO books (path, size, mtime_ns, encoding, words) VALUES (?, ?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, encoding, words))
+            book_id = cur.lastrowid
+            self.db.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?, ?)",
+                ((term, book_id, len(p.words), p.encode()) for term, p in postings.items()))
+
+    def _remove(self, path):
+        book_id = self._book_id(path)
+        if book_id is not None:
+            self.db.execute("DELETE FROM postings WHERE book = ?", (book_id,))
+            self.db.execute("DELETE FROM books WHERE id = ?", (book_id,))
+
+    def remove(self, book):
+        with self.db:
+            self._remove(os.path.realpath(book))
+
+    def update(self, books, encoding=None, prune=False):
+        """Index new and changed books; returns the paths that were rescanned.
+
+        Books that cannot be read (gone, or a corrupt archive) are left out of
+        the index. With prune=True, books in the index that are not in books
+        are dropped.
+        """
+        changed = []
+        wanted = set()
+        for book in books:
+            path = os.path.realpath(book)
+            wanted.add(path)
+            try:
+                if self.is_current(path):
+                    continue
+                self.add(path, encoding)
+            except Exception:
+                self.remove(path)
+                continue
+            changed.append(book)
+        if prune:
+            stale = [p for p, in self.db.execute("SELECT path FROM books") if p not in wanted]
+            with self.db:
+                for path in stale:
+                    self._remove(path)
+        return changed
+
+    def _postings(self, term, book_ids=None):
+        sql = ("SELECT books.path, books.encoding, postings.book, postings.positions "
+               "FROM postings JOIN books ON books.id = postings.book WHERE postings.term = ?")
+        rows = self.db.execute(sql, (term,))
+        return {book: (path, encoding, data) for path, encoding, book, data in rows
+                if book_ids is None or book in book_ids}
+
+    def search(self, query, books=None, limit=1000):
+        """Hits for a word or phrase, ordered by book path and offset.
+
+        books restricts the search to those paths and limit=None returns every
+        hit. A query of several words matches them only where they are
+        consecutive in the book.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        book_ids = None
+        if books is not None:
+            book_ids = {self._book_id(os.path.realpath(b)) for b in books} - {None}
+        # Start from the rarest term so the other lookups touch fewest books
+        counts = {}
+        for term in set(terms):
+            counts[term] = self.db.execute(
+                "SELECT COALESCE(SUM(count), 0) FROM postings WHERE term = ?",
+                (term,)).fetchone()[0]
+            if not counts[term]:
+                return []
+        rarest = min(counts, key=counts.get)
+        candidates = self._postings(rarest, book_ids)
+        others = {term: self._postings(term, set(candidates))
+                  for term in set(terms) if term != rarest}
+
+        hits = []
+        for book in sorted(candidates, key=lambda b: candidates[b][0]):
+            if any(book not in postings for postings in others.values()):
+                continue
+            path, encoding, _ = candidates[book]
+            decoded = {}
+            for term in set(terms):
+                words, offsets, lengths = decode_postings(
+                    candidates[book][2] if term == rarest else others[term][book][2])
+                decoded[term] = dict(zip(words, offsets))
+                if term == terms[-1]:
+                    # Where each occurrence of the last term ends, which is where a hit ends
+                    lengths = lengths or repeat(byte_length(term, encoding))
+                    ends = {w: o + n for w, o, n in zip(words, offsets, lengths)}
+            first = decoded[terms[0]]
+            span = len(terms) - 1
+            for word in sorted(first):
+                if span and not all(word + i in decoded[t] for i, t in enumerate(terms)):
+                    continue
+                offset = first[word]
+                end = ends[word + span]
+                hits.append(Hit(path, offset, end - offset))
+                if limit is not None and len(hits) >= limit:
+                    return hits
+        return hits
+
+    def close(self):
+        self.db.close()
+
+
+class SearchLoader(threading.Thread):
+    """Runs a search on a worker thread and reports back through a queue.
+
+    Events are (loader, kind, value) tuples, as from bookbot_book.BookLoader:
+      ('progress', (done, total)) - books brought up to date in the index
+      ('hits', [Hit])
+      ('error', Exception)
+    Books are indexed one at a time, so the UI can show how far it got and
+    a cancelled search stops after the current book. With a client the book
+    server searches its own index; if it fails, the search runs here after
+    all, and client.lost tells the UI whether to go on without the server.
+    """
+
+    def __init__(self, query, books, limit=1000, events=None, client=None):
+        super().__init__(daemon=True)
+        self.query = query
+        self.books = list(books)
+        self.limit = limit
+        self.events = events if events is not None else queue.Queue()
+        self.client = client
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _emit(self, kind, value=None):
+        self.events.put((self, kind, value))
+
+    def run(self):
+        try:
+            if self.client:
+                try:
+                    self._emit('hits', self.client.search(self.query, self.books, self.limit))
+                    return
+                except (ConnectionError, ServerError):
+                    pass
+            self._run_local()
+        except Exception as e:
+            self._emit('error', e)
+
+    def _run_local(self):
+        # sqlite connections belong to the thread that opened them
+        index = SearchIndex()
+        try:
+            for done, book in enumerate(self.books, 1):
+                if self._cancelled.is_set():
+                    return
+                index.update([book])
+                self._emit('progress', (done, len(self.books)))
+            self._emit('hits', index.search(self.query, self.books, self.limit))
+        finally:
+            index.close()
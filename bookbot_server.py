@@ -0,0 +1,311 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from bookbot_book import open_cached
+from bookbot_cache import AnalysisCache
+from bookbot_client import SOCKET_NAME, default_socket_path
+from bookbot_lazy import lazy_import
+from bookbot_profile import add_argument, enable_from, stage
+
+bookbot_search = lazy_import("bookbot_search")
+
+JOBS = 8  # threads serving requests that touch books
+INDEXERS = 2  # threads building line indexes in the background
+MAX_LINES = 1024  # lines in one "lines" reply
+MAX_READ = 1 << 20  # bytes in one "read" reply
+REQUEST_LIMIT = 1 << 20  # longest request line accepted
+WRITE_HIGH_WATER = 256 << 10  # reply bytes buffered for a client before it is waited on
+IDLE_BOOKS = 8  # books kept open after their last client leaves
+
+
+class _Served:
+    """A book open in the server, and what its clients are waiting on"""
+
+    def __init__(self, key, stamp):
+        self.key = key
+        self.stamp = stamp  # (size, mtime_ns) of the file when it was opened
+        self.book = None
+        self.opened = None  # future for the Book
+        self.indexing = None  # future for the background line index
+        self.stats = None  # future for the analysis
+        self.refs = 0  # connections that opened it
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        if self.book is None:
+            return
+        if self.indexing is not None and not self.indexing.done():
+            # The indexing thread stops at its next step; the book is closed after that
+            self.indexing.add_done_callback(lambda _: self.book.close())
+        else:
+            self.book.close()
+
+
+class BookServer:
+    """Keeps books, line indexes and analysis results loaded for many readers.
+
+    Clients connect over a Unix socket and send one JSON object per line:
+    {"id": 1, "op": "lines", "path": ..., "first": 0, "count": 256}. Each
+    reply is one line, {"id": 1, "result": ...} or {"id": 1, "error": ...}.
+    A book is opened and indexed once however many clients read it, and it
+    stays open for IDLE_BOOKS more books after its last client leaves.
+
+    Work that touches a book runs on a thread pool so the event loop only
+    moves bytes. Each connection has one request in flight: the next line
+    is only read once the reply has been written and drained below
+    WRITE_HIGH_WATER, so a client that stops reading holds up nobody but
+    itself and costs at most that much buffered output.
+    """
+
+    def __init__(self, jobs=JOBS):
+        self.books = OrderedDict()  # realpath -> _Served, least recently released first
+        self.pool = ThreadPoolExecutor(jobs, thread_name_prefix="bookbot-serve")
+        self.indexers = ThreadPoolExecutor(INDEXERS, thread_name_prefix="bookbot-index")
+        # The search index is one sqlite connection, so it keeps to one thread
+        self.searcher = ThreadPoolExecutor(1, thread_name_prefix="bookbot-search")
+        self._search_index = None
+        self._local = threading.local()  # an AnalysisCache per pool thread
+        self.clients = 0
+
+    def _cache(self):
+        cache = getattr(self._local, "cache", None)
+        if cache is None:
+            cache = self._local.cache = AnalysisCache()
+        return cache
+
+    async def _run(self, func, *args, pool=None):
+        return await asyncio.get_running_loop().run_in_executor(pool or self.pool, func, *args)
+
+    # Books
+
+    def _load(self, key):
+        cache = self._cache()
+        book, _ = open_cached(cache, key)
+        cache.flush()  # pool threads keep their cache open for good
+        return book
+
+    def _index(self, served):
+        book = served.book
+        while not book.indexed and not served.closed:
+            book.index_step()
+
+    async def _open(self, path, opened):
+        key = os.path.realpath(path)
+        st = os.stat(key)
+        stamp = (st.st_size, st.st_mtime_ns)
+        served = self.books.get(key)
+        if served is not None and served.stamp != stamp:
+            # Changed on disk; clients that have it open keep the old copy
+            del self.books[key]
+            if served.refs == 0:
+                served.close()
+            served = None
+        if served is None:
+            served = self.books[key] = _Served(key, stamp)
+            served.opened = asyncio.ensure_future(self._run(self._load, key))
+        if key not in opened:
+            opened[key] = served
+            served.refs += 1
+        try:
+            served.book = await asyncio.shield(served.opened)
+        except Exception:
+            self._release(served, opened)
+            if self.books.get(key) is served:
+                del self.books[key]
+            raise
+        if served.indexing is None:
+            served.indexing = asyncio.ensure_future(
+                self._run(self._index, served, pool=self.indexers))
+        return served
+
+    def _release(self, served, opened):
+        if opened.pop(served.key, None) is None:
+            return
+        served.refs -= 1
+        if served.refs:
+            return
+        if self.books.get(served.key) is not served:
+            served.close()  # replaced by a newer copy of the file
+            return
+        self.books.move_to_end(served.key)
+        idle = [s for s in self.books.values() if s.refs == 0]
+        for stale in idle[:max(0, len(idle) - IDLE_BOOKS)]:
+            del self.books[stale.key]
+            stale.close()
+
+    def _served(self, request, opened):
+        served = opened.get(os.path.realpath(request["path"]))
+        if served is None or served.book is None:
+            raise ValueError("Book is not open")
+        return served
+
+    @staticmethod
+    def _status(book):
+        return {"lines": len(book.line_starts), "indexed": book.indexed, "progress": book.progress}
+
+    @staticmethod
+    def _lines(book, first, count):
+        count = min(count, MAX_LINES)
+        book.index_until(first + count)
+        last = min(first + count, len(book.line_starts))
+        reply = {"starts": book.line_starts[first:last].tolist(),
+                 "text": book.lines(first, max(0, last - first))}
+        reply.update(BookServer._status(book))
+        return reply
+
+    def _stats(self, key):
+        stats = self._cache().analyze(key)
+        return {"words": stats.words, "chars": stats.chars}
+
+    def _search(self, query, books, limit):
+        if self._search_index is None:
+            self._search_index = bookbot_search.SearchIndex()
+        self._search_index.update(books)
+        return [list(hit) for hit in self._search_index.search(query, books, limit)]
+
+    # Requests
+
+    async def dispatch(self, request, opened):
+        op = request.get("op")
+        if op == "open":
+            served = await self._open(request["path"], opened)
+            reply = {"path": served.key, "encoding": served.book.encoding,
+                     "size": served.book.size}
+            reply.update(self._status(served.book))
+            return reply
+        if op == "close":
+            served = opened.get(os.path.realpath(request["path"]))
+            if served is not None:
+                self._release(served, opened)
+            return None
+        if op == "status":
+            return self._status(self._served(request, opened).book)
+        if op == "lines":
+            book = self._served(request, opened).book
+            return await self._run(self._lines, book, int(request["first"]), int(request["count"]))
+        if op == "read":
+            book = self._served(request, opened).book
+            start = int(request["start"])
+            end = min(int(request["end"]), start + MAX_READ)
+            return await self._run(book.read, start, end)
+        if op == "position":
+            book = self._served(request, opened).book
+            return await self._run(book.position, int(request["offset"]))
+        if op == "offset":
+            book = self._served(request, opened).book
+            return await self._run(book.offset, tuple(request["position"]))
+        if op == "line_at":
+            book = self._served(request, opened).book
+            return await self._run(book.line_at, int(request["offset"]))
+        if op == "stats":
+            served = await self._open(request["path"], opened)
+            if served.stats is None:
+                served.stats = asyncio.ensure_future(self._run(self._stats, served.key))
+            return await asyncio.shield(served.stats)
+        if op == "search":
+            return await self._run(self._search, request["query"], request["books"],
+                                   request.get("limit"), pool=self.searcher)
+        if op == "ping":
+            return {"books": len(self.books), "clients": self.clients}
+        raise ValueError(f"Unknown request: {op!r}")
+
+    async def _reply(self, line, opened):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {"id": None, "error": "Request is not JSON"}
+        try:
+            return {"id": request.get("id"), "result": await self.dispatch(request, opened)}
+        except Exception as e:
+            return {"id": request.get("id"), "error": f"{type(e).__name__}: {e}"}
+
+    async def handle(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=WRITE_HIGH_WATER)
+        opened = {}  # realpath -> _Served, the books this connection holds open
+        self.clients += 1
+        try:
+            while line := await reader.readline():
+                with stage("server.request"):
+                    reply = await self._reply(line, opened)
+                writer.write(json.dumps(reply, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass  # gone, or sent a line longer than REQUEST_LIMIT
+        finally:
+            self.clients -= 1
+            for served in list(opened.values()):
+                self._release(served, opened)
+            writer.close()
+
+    async def serve(self, path):
+        # Bind with the socket already owner-only; a chmod afterwards would
+        # leave a moment in which other users could connect
+        mask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.handle, path=str(path),
+                                                     limit=REQUEST_LIMIT)
+        finally:
+            os.umask(mask)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        for served in self.books.values():
+            served.closed = True
+        self.indexers.shutdown(wait=True)
+        self.pool.shutdown(wait=True)
+        self.searcher.shutdown(wait=True)
+        for served in self.books.values():
+            if served.book is not None:
+                served.book.close()
+        self.books.clear()
+
+
+def _running(path):
+    """True if a server already answers on path"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+        except OSError:
+            return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve books to the BookBot readers on this host over a Unix socket")
+    parser.add_argument("--socket", default=None,
+                        help=f"socket path (default: $BOOKBOT_SOCKET, else {SOCKET_NAME} "
+                             "in $XDG_RUNTIME_DIR/bookbot or the state directory)")
+    parser.add_argument("-j", "--jobs", type=int, default=JOBS,
+                        help=f"threads serving book requests (default: {JOBS})")
+    add_argument(parser)
+    args = parser.parse_args(argv)
+    enable_from(args)
+    path = Path(args.socket) if args.socket else default_socket_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if _running(path):
+        raise SystemExit(f"A book server is already running on {path}")
+    if path.exists():
+        path.unlink()  # left behind by a server that did not shut down cleanly
+    server = BookServer(args.jobs)
+    print(f"Serving books on {path}", flush=True)
+    try:
+        asyncio.run(server.serve(path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    main()
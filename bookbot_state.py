@@ -0,0 +1,111 @@
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+FLUSH_DELAY = 2.0  # seconds changes may wait before they are written together
+
+
+def default_state_dir():
+    base = os.environ.get("BOOKBOT_STATE_DIR")
+    if base:
+        return Path(base)
+    xdg = os.environ.get("XDG_STATE_HOME")
+    return (Path(xdg) if xdg else Path.home() / ".local" / "state") / "bookbot"
+
+
+class StateStore:
+    """Reading positions and reader preferences, kept in SQLite.
+
+    Positions are byte offsets per book, so they survive a different window
+    size or wrap width. Setters only update memory: whatever changed is
+    written in one transaction FLUSH_DELAY seconds after the first change
+    (see tick()), or on flush() and close(). Auto-scroll moving the position
+    many times a second therefore costs one small write every few seconds,
+    and with WAL and synchronous=NORMAL those commits do not fsync.
+    """
+
+    def __init__(self, path=None, delay=FLUSH_DELAY):
+        self.path = Path(path) if path else default_state_dir() / "state.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.delay = delay
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS positions (
+                path TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS prefs (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self._positions = {}  # path -> offset, not yet written
+        self._prefs = {}
+        self._since = None  # monotonic time of the oldest unwritten change
+
+    def _changed(self):
+        if self._since is None:
+            self._since = time.monotonic()
+
+    def position(self, book):
+        """Saved byte offset in book, or None if it was never opened"""
+        path = os.path.realpath(book)
+        offset = self._positions.get(path)
+        if offset is None:
+            row = self.db.execute("SELECT offset FROM positions WHERE path = ?", (path,)).fetchone()
+            offset = row[0] if row else None
+        return offset
+
+    def set_position(self, book, offset):
+        path = os.path.realpath(book)
+        if self._positions.get(path) != offset:
+            self._positions[path] = offset
+            self._changed()
+
+    def get(self, key, default=None):
+        if key in self._prefs:
+            return self._prefs[key]
+        row = self.db.execute("SELECT value FROM prefs WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        if self._prefs.get(key, self) != value:
+            self._prefs[key] = value
+            self._changed()
+
+    @property
+    def pending(self):
+        return self._since is not None
+
+    def due_in(self):
+        """Seconds until pending changes are written, or None if there are none"""
+        if self._since is None:
+            return None
+        return max(0.0, self._since + self.delay - time.monotonic())
+
+    def tick(self):
+        """Write pending changes once they are FLUSH_DELAY old; call this often"""
+        if self._since is not None and self.due_in() == 0:
+            self.flush()
+
+    def flush(self):
+        if self._since is None:
+            return
+        now = time.time()
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO positions VALUES (?, ?, ?)",
+                                [(path, offset, now) for path, offset in self._positions.items()])
+            self.db.executemany("INSERT OR REPLACE INTO prefs VALUES (?, ?)",
+                                [(key, json.dumps(value)) for key, value in self._prefs.items()])
+        self._positions.clear()
+        self._prefs.clear()
+        self._since = None
+
+    def close(self):
+        self.flush()
+        self.db.close()
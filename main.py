@@ -1,3 +1,17 @@
+import argparse
+import io
+import sys
+from pathlib import Path
+
+from bookbot_analyzer import (BACKENDS, NGRAM_NAMES, analyze_file, analyze_stream, count_words_in,
+                              iter_chunks, iter_text, resolve_backend)
+from bookbot_cache import AnalysisCache
+from bookbot_compressed import open_book
+from bookbot_corpus import SPLIT_SIZE, analyze_corpus, find_books, iter_corpus
+from bookbot_encoding import detect_file
+from bookbot_output import FORMATS, WRITERS
+from bookbot_profile import add_argument, enable_from, stage
+
 def sort_on(dict):
     return dict["count"]
 
@@ -12,31 +26,183 @@ def count_chars(text):
     return chars
 
 def count_words(book):
-    with open(book) as f:
-        file_contents = f.read()
-        words = file_contents.split()
-        return len(words)
+    words, in_word = 0, False
+    with open_book(book) as f:
+        for text in iter_text(iter_chunks(f), detect_file(book)):
+            count, in_word = count_words_in(text, in_word)
+            words += count
+    return words
 
 def get_book(book):
-    with open(book) as f:
+    with io.TextIOWrapper(open_book(book), encoding=detect_file(book)) as f:
         file_contents = f.read()
         return file_contents
 
-def main():
-    path = "books/frankenstein.txt"
-    text = get_book(path)
-    word_count = count_words(path)
-    print("--- Begin report of books/frankenstein.txt ---")
-    print(f"{word_count} words found in the document\n")
-    
-    char_counts = count_chars(text)
-    char_list = [{"char": char, "count": count} for char, count in char_counts.items()]
+def print_report(name, stats, top=0, out=None):
+    print(f"--- Begin report of {name} ---", file=out)
+    print(f"{stats.words} words found in the document\n", file=out)
+
+    char_list = [{"char": char, "count": count} for char, count in stats.chars.items()]
     char_list.sort(reverse=True, key=sort_on)
-    
+
     for char_data in char_list:
-        print(f"The '{char_data['char']}' character was found {char_data['count']} times")
-    
-    print("--- End report ---")
+        print(f"The '{char_data['char']}' character was found {char_data['count']} times", file=out)
+
+    for kind, table in zip(NGRAM_NAMES, stats.ngrams):
+        # Space-saving counts may overestimate by up to table.floor
+        times = "times" if table.exact else f"times (±{table.floor})"
+        print(f"\nTop {top} {kind}s:", file=out)
+        for item, count in table.top(top):
+            print(f"The {kind} '{item}' was found {count} {times}", file=out)
+
+    print("--- End report ---", file=out)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Word and character report for books")
+    parser.add_argument("paths", nargs="*",
+                        help="book files, directories or glob patterns; - reads a book from stdin "
+                             "(default: books/frankenstein.txt)")
+    parser.add_argument("--paths-from", metavar="FILE",
+                        help="also read book paths, one per line, from FILE (- for stdin)")
+    parser.add_argument("--format", choices=FORMATS, default="text",
+                        help="text report, or JSON Lines, CSV or binary histograms per book")
+    parser.add_argument("-o", "--output", help="write results to this file instead of stdout")
+    parser.add_argument("--max-pending", type=int, default=None, metavar="N",
+                        help="books or ranges queued at once in batch mode (default: 2 x jobs)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes for corpus mode (default: all cores)")
+    parser.add_argument("--split-size", type=int, default=SPLIT_SIZE >> 20,
+                        help="MiB above which a book is counted in parallel ranges")
+    parser.add_argument("--backend", choices=BACKENDS, default="auto",
+                        help="letter histogram backend (default: numpy if installed, else bytes)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always recount instead of using the analysis cache")
+    parser.add_argument("--top", type=int, default=0, metavar="K",
+                        help="also report the K most frequent words, bigrams and trigrams")
+    parser.add_argument("--ngrams", type=int, choices=(1, 2, 3), default=3,
+                        help="longest word sequence to count for --top (default: 3)")
+    parser.add_argument("--space-saving", type=int, default=None, metavar="N",
+                        help="keep only about N entries per table (approximate counts, bounded memory)")
+    add_argument(parser)
+    return parser.parse_args(argv)
+
+def iter_paths(args):
+    """Books named on the command line and in --paths-from, expanded lazily.
+
+    A plain path is passed on even if it does not exist, so it is reported
+    as an error instead of silently skipped.
+    """
+    def expand(target):
+        if any(c in target for c in "*?[") or Path(target).is_dir():
+            return find_books([target])
+        return [Path(target)]
+
+    for target in args.paths:
+        if target != "-":
+            yield from expand(target)
+    if args.paths_from:
+        f = sys.stdin if args.paths_from == "-" else open(args.paths_from)
+        try:
+            for line in f:
+                if line.strip():
+                    yield from expand(line.rstrip("\r\n"))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def run_batch(args, ngrams, cache):
+    """Stream one result per book, in completion order, flushed as each finishes"""
+    binary = args.format == "binary"
+    if args.output:
+        out = open(args.output, "wb" if binary else "w", newline="" if args.format == "csv" else None)
+    else:
+        out = sys.stdout.buffer if binary else sys.stdout
+
+    if args.format == "text":
+        def write(name, stats, error):
+            if error is not None:
+                print(f"{name}: {error}", file=sys.stderr)
+            else:
+                print_report(name, stats, args.top, out)
+                print(file=out)
+            out.flush()
+    else:
+        write = WRITERS[args.format](out, args.top).write
+
+    failed = 0
+    with stage("count.batch"):
+        if "-" in args.paths:
+            write("-", analyze_stream(sys.stdin.buffer, backend=args.backend, ngrams=ngrams,
+                                      capacity=args.space_saving), None)
+        for book, stats, error in iter_corpus(iter_paths(args), jobs=args.jobs,
+                                              split_size=args.split_size << 20,
+                                              backend=args.backend, cache=cache, ngrams=ngrams,
+                                              capacity=args.space_saving,
+                                              max_pending=args.max_pending):
+            write(book.as_posix(), stats, error)
+            failed += error is not None
+    out.flush()
+    if args.output:
+        out.close()
+    if failed:
+        raise SystemExit(f"{failed} books could not be read")
+
+def run_report(args, ngrams, cache):
+    """Print a report per book, then one for all of them"""
+    books = find_books(args.paths)
+    if not books:
+        raise SystemExit("No books found")
+    split_size = args.split_size << 20
+    # One book only needs the process pool when it is big enough to be split
+    if len(books) == 1 and (args.jobs == 1 or books[0].stat().st_size <= split_size):
+        if cache:
+            stats = cache.analyze(books[0], backend=args.backend, ngrams=ngrams,
+                                  capacity=args.space_saving)
+        else:
+            stats = analyze_file(books[0], backend=args.backend, ngrams=ngrams,
+                                 capacity=args.space_saving)
+        print_report(books[0].as_posix(), stats, args.top)
+        return
+
+    with stage("count.corpus"):
+        per_book, total = analyze_corpus(books, jobs=args.jobs, split_size=split_size,
+                                         backend=args.backend, cache=cache, ngrams=ngrams,
+                                         capacity=args.space_saving)
+    if len(books) == 1:
+        print_report(books[0].as_posix(), per_book[0], args.top)
+        return
+    for book, stats in zip(books, per_book):
+        print_report(book.as_posix(), stats, args.top)
+        print()
+    print_report(f"{len(books)} books", total, args.top)
+
+def main(argv=None):
+    args = parse_args(argv)
+    enable_from(args)
+    try:
+        resolve_backend(args.backend)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if not args.paths and not args.paths_from:
+        args.paths = ["books/frankenstein.txt"]
+    if "-" in args.paths and args.paths_from == "-":
+        raise SystemExit("stdin cannot hold both a book and a list of paths")
+    ngrams = args.ngrams if args.top > 0 else 0
+    if args.space_saving is not None and args.space_saving < args.top:
+        raise SystemExit("--space-saving must be at least --top")
+    cache = None if args.no_cache else AnalysisCache()
+    try:
+        if args.format != "text" or args.paths_from or "-" in args.paths or args.output:
+            try:
+                run_batch(args, ngrams, cache)
+            except BrokenPipeError:
+                # The consumer went away, e.g. piped into head
+                sys.stderr.close()
+        else:
+            run_report(args, ngrams, cache)
+    finally:
+        if cache:
+            cache.close()
 
 if __name__ == "__main__":
     main()
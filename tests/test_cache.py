@@ -0,0 +1,35 @@
+import os
+
+from bookbot_analyzer import analyze_file
+from bookbot_cache import AnalysisCache
+
+
+def encoding_paths(cache):
+    return [path for path, in cache.db.execute("SELECT path FROM encodings")]
+
+
+def test_encodings_go_with_their_entries(tmp_path):
+    books = []
+    for n in range(3):
+        book = tmp_path / f"{n}.txt"
+        book.write_text("naïve café " * 200 * (n + 1), encoding="utf-8")
+        books.append(book)
+    cache = AnalysisCache(tmp_path / "analysis.sqlite")
+    try:
+        for book in books:
+            cache.analyze(book)
+        assert len(encoding_paths(cache)) == 3
+
+        # A changed file drops the encoding detected for its old contents
+        books[0].write_text("plain ascii " * 100, encoding="utf-8")
+        os.utime(books[0], ns=(1, 1))
+        cache.put(books[0], analyze_file(books[0]), "utf-8")
+        assert os.path.realpath(books[0]) not in encoding_paths(cache)
+
+        # Evicting a book's entries drops its encoding
+        assert encoding_paths(cache)
+        cache.max_bytes = 1
+        cache.put(books[2], analyze_file(books[2]), "utf-8")
+        assert encoding_paths(cache) == []
+    finally:
+        cache.close()
@@ -0,0 +1,66 @@
+import gzip
+import random
+
+import pytest
+
+from bookbot_compressed import CHECKPOINT, READ_SIZE, CompressedBuffer, read_range
+
+
+@pytest.fixture(scope="module")
+def text():
+    rng = random.Random(84)
+    words = "the of and to a in that was my naïve café Über façade Ångström".split()
+    lines, length = [], 0
+    while length < 3 * CHECKPOINT:
+        lines.append(" ".join(rng.choice(words) for _ in range(rng.randint(1, 12))) + "\n")
+        length += len(lines[-1])
+    return "".join(lines).encode("utf-8")
+
+
+def gzip_members(data, size):
+    return b"".join(gzip.compress(data[i:i + size]) for i in range(0, len(data), size))
+
+
+def zstd_frames(data, size):
+    zstandard = pytest.importorskip("zstandard")
+    compressor = zstandard.ZstdCompressor()
+    return b"".join(compressor.compress(data[i:i + size]) for i in range(0, len(data), size))
+
+
+@pytest.mark.parametrize("name, compress", [
+    ("one.txt.gz", gzip.compress),
+    ("members.txt.gz", lambda data: gzip_members(data, 700_000)),
+    ("one.txt.zst", lambda data: zstd_frames(data, len(data))),
+    ("frames.txt.zst", lambda data: zstd_frames(data, 700_000)),
+])
+def test_read_range_matches_plain_copy(tmp_path, text, name, compress):
+    plain = tmp_path / "plain.txt"
+    plain.write_bytes(text)
+    packed = tmp_path / name
+    packed.write_bytes(compress(text))
+    rng = random.Random(1)
+    ranges = [(0, 100), (len(text) - 100, len(text)), (len(text) - 10, len(text) + 10),
+              (CHECKPOINT - 5, CHECKPOINT + 5), (0, len(text))]
+    for _ in range(40):
+        start = rng.randrange(len(text))
+        ranges.append((start, start + rng.choice([1, 80, 5000, 2 * CHECKPOINT])))
+    # Backwards too, which replays from an earlier checkpoint
+    ranges += sorted(ranges[5:], reverse=True)
+    for start, end in ranges:
+        assert read_range(packed, start, end) == read_range(plain, start, end)
+
+
+def test_gzip_checkpoints_follow_output_size(tmp_path):
+    # Compresses about 1000:1, so one compressed read holds many checkpoints' worth
+    text = b"All work and no play makes Jack a dull boy.\n" * 500_000
+    book = tmp_path / "dull.txt.gz"
+    book.write_bytes(gzip.compress(text, 9))
+    buf = CompressedBuffer(book)
+    try:
+        assert len(buf) == len(text)
+        gaps = [b - a for a, b in zip(buf._starts, buf._starts[1:])]
+        assert max(gaps) < CHECKPOINT + READ_SIZE
+        for start in range(0, len(text), 3 * CHECKPOINT // 2):
+            assert buf[start:start + CHECKPOINT] == text[start:start + CHECKPOINT]
+    finally:
+        buf.close()
@@ -0,0 +1,41 @@
+import io
+import random
+
+import pytest
+
+from bookbot_analyzer import analyze_file
+from bookbot_corpus import analyze_corpus, iter_corpus
+from main import print_report
+
+WORDS = "the of and to a in that was my I with had which Victor Elizabeth naïve café Über façade".split()
+
+
+def write_book(path, size, encoding="utf-8", seed=84):
+    rng = random.Random(seed)
+    lines, length = [], 0
+    while length < size:
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))) + "\n")
+        length += len(lines[-1])
+    path.write_bytes("".join(lines).encode(encoding))
+    return path
+
+
+def report(stats):
+    out = io.StringIO()
+    print_report("book", stats, top=5, out=out)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "latin-1"])
+def test_split_report_matches_whole_book(tmp_path, encoding):
+    book = write_book(tmp_path / "book.txt", 300_000, encoding)
+    whole = analyze_file(book, encoding, ngrams=3)
+    per_book, _ = analyze_corpus([book], jobs=2, split_size=20_000, encoding=encoding, ngrams=3)
+    assert report(per_book[0]) == report(whole)
+
+
+def test_iter_corpus_split_matches_unsplit(tmp_path):
+    books = [write_book(tmp_path / f"{n}.txt", 100_000, seed=n) for n in range(3)]
+    split = {book: report(stats) for book, stats, _ in iter_corpus(books, jobs=2, split_size=15_000)}
+    whole = {book: report(stats) for book, stats, _ in iter_corpus(books, jobs=2)}
+    assert split == whole
@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from bookbot_compressed import read_range
+from bookbot_encoding import detect_file
+from bookbot_search import SearchIndex, decode_postings, encode_postings
+
+
+@pytest.mark.parametrize("words, offsets, lengths", [
+    ([], [], None),
+    ([0], [0], None),
+    ([0, 3, 9], [0, 17, 60], None),
+    ([1, 2, 300], [5, 70_000, 1 << 40], None),
+    ([0, 4], [3, 30], [5, 6]),
+])
+def test_postings_round_trip(words, offsets, lengths):
+    assert decode_postings(encode_postings(words, offsets, lengths)) == (words, offsets, lengths)
+
+
+def test_postings_round_trip_random():
+    rng = random.Random(84)
+    for _ in range(50):
+        n = rng.randint(1, 500)
+        words = sorted(rng.sample(range(10 * n), n))
+        offsets = sorted(rng.sample(range(10 * n + rng.choice([0, 1 << 20, 1 << 40])), n))
+        lengths = [rng.randint(1, 40) for _ in range(n)] if rng.random() < 0.5 else None
+        assert decode_postings(encode_postings(words, offsets, lengths)) == (words, offsets, lengths)
+
+
+TEXT = ("Chapter one\n"
+        "The Café was open; the CAFÉ closed at nine. Ærø and Straße.\n"
+        "“Quoted” words—and dashes—in the Café.\n") * 20
+
+
+@pytest.mark.parametrize("encoding", ["cp1252", "utf-16"])
+@pytest.mark.parametrize("query, count", [
+    ("café", 60), ("the café", 60), ("ærø", 20), ("straße", 20), ("quoted", 20),
+    ("dashes in the café", 20),
+])
+def test_hits_decode_to_the_query(tmp_path, encoding, query, count):
+    book = tmp_path / "book.txt"
+    book.write_bytes(TEXT.encode(encoding))
+    index = SearchIndex(tmp_path / "search.sqlite")
+    try:
+        index.update([book])
+        hits = index.search(query, limit=None)
+    finally:
+        index.close()
+    assert len(hits) == count
+    detected = detect_file(book)
+    for hit in hits:
+        found = read_range(book, hit.offset, hit.offset + hit.length).decode(detected)
+        assert " ".join(found.lower().replace("—", " ").split()) == query